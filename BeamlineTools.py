@@ -0,0 +1,162 @@
+"""
+Tools for summarising the beamline records in the CDB.
+
+Records are flattened and cached locally, one entry per day, so
+summaries over long periods only query the CDB for days not yet seen.
+The summaries themselves are computed on numpy arrays of the records.
+"""
+
+import os
+import json
+import time
+from datetime import datetime, timedelta
+
+import numpy
+
+SCALAR_KEYS = ['Particle Triggers', 'Requested Triggers', 'ToF0 Triggers',
+               'ToF1 Triggers', 'ToF2 Triggers']
+
+
+def BeamlineRecord(run_number, beamline):
+    """
+    Flatten a CDB beamline dictionary into a json friendly record,
+    times are stored as unix time.
+    """
+    record = {"run_number": run_number,
+              "optics": beamline["optics"],
+              "start_time": time.mktime(beamline["start_time"].timetuple()),
+              "end_time": time.mktime(beamline["end_time"].timetuple()),
+              "target_dips": beamline["end_pulse"] - beamline["start_pulse"]}
+    for k in SCALAR_KEYS:
+        record[k] = beamline["scalars"][k]
+    return record
+
+
+class BeamlineCache:
+    """
+    Local cache of beamline records, filled from the CDB on demand.
+
+    Only complete days are cached, so the current day is always
+    fetched from the CDB.
+    """
+
+    def __init__(self, cache_path="beamline_cache.json"):
+        """
+        Constructor, loads the cache if it exists.
+        """
+        self.cache_path = cache_path
+        self.days = {}
+        self._beamline = None
+
+        if os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                self.days = json.load(f)["days"]
+
+    def _get_beamline(self):
+        """
+        Only connect to the CDB once it is needed.
+        """
+        if self._beamline is None:
+            from cdb import Beamline
+            self._beamline = Beamline()
+        return self._beamline
+
+    def get_records(self, start_date, end_date):
+        """
+        Return the records of all runs between start_date and end_date,
+        sorted by run number.
+        """
+        today = datetime.now().replace(hour=0, minute=0, second=0,
+                                       microsecond=0)
+        records = {}
+        n_queries = 0
+
+        day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < end_date:
+            key = day.strftime("%Y-%m-%d")
+            if key in self.days:
+                day_records = self.days[key]
+            else:
+                runs = self._get_beamline().get_beamlines_for_dates(
+                    day, day + timedelta(days=1))
+                n_queries += 1
+                day_records = [BeamlineRecord(run_number, runs[run_number])
+                               for run_number in runs]
+                if day + timedelta(days=1) <= today:
+                    self.days[key] = day_records
+
+            # Runs spanning midnight appear on both days:
+            for r in day_records:
+                records[r["run_number"]] = r
+            day += timedelta(days=1)
+
+        if n_queries > 0:
+            print "Queried the CDB for %i days" % n_queries
+            self.save()
+
+        return [records[run_number] for run_number in sorted(records)]
+
+    def save(self):
+        """
+        Write the cache to disk.
+        """
+        with open(self.cache_path, "w") as f:
+            json.dump({"days": self.days}, f)
+
+
+def RecordTable(records):
+    """
+    Convert a list of records into a dictionary of numpy arrays,
+    one per record key, with the derived run_time and dip_rate.
+    """
+    table = {}
+    for key in ["run_number", "start_time", "end_time",
+                "target_dips"] + SCALAR_KEYS:
+        table[key] = numpy.array([r[key] for r in records], dtype=float)
+    table["run_number"] = table["run_number"].astype(int)
+    table["optics"] = numpy.array([str(r["optics"]) for r in records])
+
+    table["run_time"] = table["end_time"] - table["start_time"]
+    table["dip_rate"] = numpy.zeros(len(records))
+    good = table["run_time"] > 0
+    table["dip_rate"][good] = table["target_dips"][good] / \
+        table["run_time"][good]
+    return table
+
+
+def IntervalOverlapContent(edges, start, end, rate):
+    """
+    Sum of rate*overlap of the intervals [start, end] with each bin
+    of the given edges.
+
+    The cumulative integral of all the intervals is piecewise linear,
+    changing slope only at the interval ends, so it is evaluated at
+    those points and interpolated onto the bin edges.
+    """
+    edges = numpy.asarray(edges, dtype=float)
+    if len(start) == 0:
+        return numpy.zeros(len(edges) - 1)
+
+    points = numpy.concatenate([start, end])
+    slope_change = numpy.concatenate([rate, -rate])
+    order = numpy.argsort(points, kind="mergesort")
+    points = points[order]
+    slope = numpy.cumsum(slope_change[order])
+
+    integral = numpy.zeros(len(points))
+    integral[1:] = numpy.cumsum(slope[:-1]*numpy.diff(points))
+
+    return numpy.diff(numpy.interp(edges, points, integral))
+
+
+def GroupSum(keys, columns):
+    """
+    Group by keys and sum each of the columns (a dictionary of arrays).
+    Returns the unique keys and a dictionary of summed arrays.
+    """
+    unique_keys, inverse = numpy.unique(keys, return_inverse=True)
+    sums = {}
+    for name in columns:
+        sums[name] = numpy.bincount(inverse, weights=columns[name],
+                                    minlength=len(unique_keys))
+    return unique_keys, sums
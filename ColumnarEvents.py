@@ -0,0 +1,479 @@
+#!/usr/bin/env python
+"""
+Columnar store of the SciFi and TOF recon objects of a run.
+
+Every object type is a table of numpy columns, saved as one .npy file
+per column and opened memory mapped, so the data is only read when
+used. The nesting of the MAUS objects is kept as offset arrays:
+
+  clusters.digit_offsets      digits of cluster i are the digit rows
+                              digit_offsets[i]:digit_offsets[i+1]
+  spacepoints.cluster_offsets clusters of spacepoint i are
+  spacepoints.cluster_index   cluster_index[cluster_offsets[i]:...[i+1]]
+  tracks.sp_offsets           spacepoints of track i are
+  tracks.sp_index             sp_index[sp_offsets[i]:sp_offsets[i+1]]
+
+and the rows of each table are ordered by event, with
+<table>.event_offsets giving the rows of each event.
+
+writer = ColumnarWriter("08681_columns")
+for each spill:
+    writer.add_spill(spill)
+writer.close()
+
+store = ColumnarEvents("08681_columns")
+sps = store.gather("spacepoints", events, ["tracker", "station", "npe"])
+spacepoints = store.spacepoint_arrays(events)   # as SciFiArrays
+"""
+
+import os
+import json
+import argparse
+
+import numpy
+
+from SciFiArrays import ExpandRanges
+from TOFTools import TOFArrays
+
+FORMAT_VERSION = 1
+
+DTYPES = {
+    "events": {"run": numpy.int32, "spill": numpy.int32,
+               "event": numpy.int32, "tof1_nsp": numpy.int32,
+               "tof1_hslab": numpy.int32, "tof1_vslab": numpy.int32,
+               "tof2_hslab": numpy.int32, "tof2_vslab": numpy.int32},
+    "digits": {"tracker": numpy.int8, "station": numpy.int8,
+               "plane": numpy.int8, "channel": numpy.int16,
+               "npe": numpy.float64, "adc": numpy.int16},
+    "clusters": {"event": numpy.int64, "tracker": numpy.int8,
+                 "station": numpy.int8, "plane": numpy.int8,
+                 "channel": numpy.float64, "npe": numpy.float64,
+                 "used": bool, "in_event": bool},
+    "spacepoints": {"event": numpy.int64, "tracker": numpy.int8,
+                    "station": numpy.int8, "nchannels": numpy.int8,
+                    "npe": numpy.float64, "x": numpy.float64,
+                    "y": numpy.float64, "z": numpy.float64, "used": bool},
+    "tracks": {"event": numpy.int64, "tracker": numpy.int8,
+               "helical": bool, "nsp": numpy.int8, "x0": numpy.float64,
+               "y0": numpy.float64, "mx": numpy.float64,
+               "my": numpy.float64, "circle_x0": numpy.float64,
+               "circle_y0": numpy.float64, "R": numpy.float64,
+               "dsdz": numpy.float64, "line_sz_c": numpy.float64},
+    "tof01": {"event": numpy.int64, "time": numpy.float64},
+    "tof12": {"event": numpy.int64, "time": numpy.float64}}
+
+# (parent, child): (offsets column, index column or None if contiguous)
+RELATIONS = {("clusters", "digits"): ("digit_offsets", None),
+             ("spacepoints", "clusters"): ("cluster_offsets",
+                                           "cluster_index"),
+             ("tracks", "spacepoints"): ("sp_offsets", "sp_index")}
+
+_TRACK_PARAMS = ["x0", "y0", "mx", "my", "circle_x0", "circle_y0", "R",
+                 "dsdz", "line_sz_c"]
+
+
+def _ClusterKey(cluster):
+    """
+    Key identifying a cluster within an event.
+    """
+    return (cluster.get_tracker(), cluster.get_station(),
+            cluster.get_plane(), cluster.get_channel(), cluster.get_npe())
+
+
+def _SpacePointKey(sp):
+    """
+    Key identifying a spacepoint within an event.
+    """
+    pos = sp.get_position()
+    return (sp.get_tracker(), sp.get_station(), pos.x(), pos.y(), pos.z())
+
+
+class ColumnarWriter:
+    """
+    Extract spills into columns and write them as a columnar store.
+    """
+
+    def __init__(self, outdir):
+        """
+        Constructor, the store is written to outdir on close.
+        """
+        self.outdir = outdir
+        self.columns = {table: {key: [] for key in DTYPES[table]}
+                        for table in DTYPES}
+        self.links = {"digit_offsets": [0], "cluster_offsets": [0],
+                      "cluster_index": [], "sp_offsets": [0],
+                      "sp_index": []}
+        self.n_rows = {table: 0 for table in DTYPES}
+
+    def _add_cluster(self, event, cluster, in_event):
+        """
+        Append a cluster and its digits, returns the cluster row.
+        """
+        columns = self.columns["clusters"]
+        columns["event"].append(event)
+        columns["tracker"].append(cluster.get_tracker())
+        columns["station"].append(cluster.get_station())
+        columns["plane"].append(cluster.get_plane())
+        columns["channel"].append(cluster.get_channel())
+        columns["npe"].append(cluster.get_npe())
+        columns["used"].append(cluster.is_used())
+        columns["in_event"].append(in_event)
+
+        digits = self.columns["digits"]
+        for digit in cluster.get_digits():
+            digits["tracker"].append(digit.get_tracker())
+            digits["station"].append(digit.get_station())
+            digits["plane"].append(digit.get_plane())
+            digits["channel"].append(digit.get_channel())
+            digits["npe"].append(digit.get_npe())
+            digits["adc"].append(digit.get_adc())
+        self.n_rows["digits"] = len(digits["npe"])
+        self.links["digit_offsets"].append(self.n_rows["digits"])
+
+        self.n_rows["clusters"] += 1
+        return self.n_rows["clusters"] - 1
+
+    def add_recon_event(self, run, spill_number, event_number, recon_event,
+                        tof):
+        """
+        Append one recon event, tof is a row of TOFArrays.
+        """
+        event = self.n_rows["events"]
+        columns = self.columns["events"]
+        columns["run"].append(run)
+        columns["spill"].append(spill_number)
+        columns["event"].append(event_number)
+        for key in tof:
+            columns[key].append(tof[key])
+        self.n_rows["events"] += 1
+
+        scifi_event = recon_event.GetSciFiEvent()
+        cluster_rows = {}
+        for cluster in scifi_event.clusters():
+            cluster_rows[_ClusterKey(cluster)] = \
+                self._add_cluster(event, cluster, True)
+
+        sp_rows = {}
+        columns = self.columns["spacepoints"]
+        for sp in scifi_event.spacepoints():
+            pos = sp.get_position()
+            columns["event"].append(event)
+            columns["tracker"].append(sp.get_tracker())
+            columns["station"].append(sp.get_station())
+            columns["nchannels"].append(len(sp.get_channels()))
+            columns["npe"].append(sp.get_npe())
+            columns["x"].append(pos.x())
+            columns["y"].append(pos.y())
+            columns["z"].append(pos.z())
+            columns["used"].append(sp.is_used())
+            for cluster in sp.get_channels():
+                row = cluster_rows.get(_ClusterKey(cluster))
+                if row is None:
+                    row = self._add_cluster(event, cluster, False)
+                self.links["cluster_index"].append(row)
+            self.links["cluster_offsets"].append(
+                len(self.links["cluster_index"]))
+            sp_rows[_SpacePointKey(sp)] = self.n_rows["spacepoints"]
+            self.n_rows["spacepoints"] += 1
+
+        columns = self.columns["tracks"]
+        for helical, tracks in [(False, scifi_event.straightprtracks()),
+                                (True, scifi_event.helicalprtracks())]:
+            for track in tracks:
+                columns["event"].append(event)
+                columns["tracker"].append(track.get_tracker())
+                columns["helical"].append(helical)
+                columns["nsp"].append(len(track.get_spacepoints()))
+                if helical:
+                    values = [0, 0, 0, 0, track.get_circle_x0(),
+                              track.get_circle_y0(), track.get_R(),
+                              track.get_dsdz(), track.get_line_sz_c()]
+                else:
+                    values = [track.get_x0(), track.get_y0(),
+                              track.get_mx(), track.get_my(),
+                              0, 0, 0, 0, 0]
+                for key, value in zip(_TRACK_PARAMS, values):
+                    columns[key].append(value)
+                for sp in track.get_spacepoints():
+                    self.links["sp_index"].append(
+                        sp_rows.get(_SpacePointKey(sp), -1))
+                self.links["sp_offsets"].append(len(self.links["sp_index"]))
+
+    def add_spill(self, spill):
+        """
+        Append every recon event of a spill.
+        """
+        recon_events = spill.GetReconEvents()
+        first = self.n_rows["events"]
+        tof = TOFArrays(recon_events)
+        per_event = [key for key in tof if not key.startswith("tof01_") and
+                     not key.startswith("tof12_")]
+        for i, recon_event in enumerate(recon_events):
+            self.add_recon_event(spill.GetRunNumber(), spill.GetSpillNumber(),
+                                 i, recon_event,
+                                 {key: tof[key][i] for key in per_event})
+        for name in ("tof01", "tof12"):
+            self.columns[name]["event"].extend(tof[name + "_event"] + first)
+            self.columns[name]["time"].extend(tof[name + "_time"])
+
+    def close(self):
+        """
+        Write the store, returns the number of events.
+        """
+        n_events = self.n_rows["events"]
+        meta = {"version": FORMAT_VERSION, "n_events": n_events,
+                "tables": {}}
+        for table in DTYPES:
+            arrays = {key: numpy.array(self.columns[table][key],
+                                       dtype=DTYPES[table][key])
+                      for key in DTYPES[table]}
+            if "event" in arrays and table != "events":
+                arrays["event_offsets"] = numpy.searchsorted(
+                    arrays["event"], numpy.arange(n_events + 1))
+            for (parent, child), (offsets, index) in RELATIONS.items():
+                if parent == table:
+                    arrays[offsets] = numpy.array(self.links[offsets],
+                                                  dtype=numpy.int64)
+                    if index is not None:
+                        arrays[index] = numpy.array(self.links[index],
+                                                    dtype=numpy.int64)
+            self._write_table(table, arrays)
+            meta["tables"][table] = sorted(arrays)
+
+        with open(os.path.join(self.outdir, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        return n_events
+
+    def _write_table(self, table, arrays):
+        """
+        Save the columns of a table, one .npy file each.
+        """
+        tabledir = os.path.join(self.outdir, table)
+        if not os.path.isdir(tabledir):
+            os.makedirs(tabledir)
+        for key, array in arrays.items():
+            numpy.save(os.path.join(tabledir, key + ".npy"), array)
+
+
+class ColumnarEvents:
+    """
+    Read access to a columnar store, columns are memory mapped on
+    first use.
+    """
+
+    def __init__(self, path, mmap=True):
+        """
+        Constructor, reads the store description.
+        """
+        self.path = path
+        self.mmap_mode = "r" if mmap else None
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != FORMAT_VERSION:
+            raise ValueError("%s: unsupported format version %s" %
+                             (path, self.meta["version"]))
+        self.n_events = self.meta["n_events"]
+        self._columns = {}
+
+    def column(self, table, name):
+        """
+        A column of a table (memory mapped).
+        """
+        if (table, name) not in self._columns:
+            if name not in self.meta["tables"][table]:
+                raise KeyError("No column %s in table %s" % (name, table))
+            self._columns[(table, name)] = numpy.load(
+                os.path.join(self.path, table, name + ".npy"),
+                mmap_mode=self.mmap_mode)
+        return self._columns[(table, name)]
+
+    def columns(self, table):
+        """
+        The data column names of a table (no offsets or indices).
+        """
+        return sorted(DTYPES[table])
+
+    def _events(self, events):
+        """
+        Selected events as a sorted array (all if None).
+        """
+        if events is None:
+            return numpy.arange(self.n_events)
+        events = numpy.asarray(events)
+        if events.dtype == bool:
+            return numpy.flatnonzero(events)
+        return numpy.unique(events)
+
+    def rows(self, table, events=None):
+        """
+        Rows of a table belonging to the selected events, in order.
+        """
+        events = self._events(events)
+        if table == "events":
+            return events
+        if table == "digits":
+            return self.children("clusters", self.rows("clusters", events),
+                                 "digits")[1]
+        offsets = self.column(table, "event_offsets")
+        return ExpandRanges(offsets[events], offsets[events + 1])[1]
+
+    def event_range(self, table, first, last):
+        """
+        Zero copy views of all the columns of a table for the
+        contiguous events first to last-1.
+        """
+        if table == "events":
+            lo, hi = first, last
+        else:
+            offsets = self.column(table, "event_offsets")
+            lo, hi = offsets[first], offsets[last]
+        return {name: self.column(table, name)[lo:hi]
+                for name in self.columns(table)}
+
+    def gather(self, table, events=None, columns=None, rows=None):
+        """
+        The columns (all if None) of the rows of a table belonging to
+        the selected events (an array of event numbers or a boolean
+        mask, all if None), or of the given rows.
+        """
+        if rows is None:
+            rows = self.rows(table, events)
+        if columns is None:
+            columns = self.columns(table)
+        return {name: self.column(table, name)[rows] for name in columns}
+
+    def children(self, parent, rows, child):
+        """
+        For parent rows, return (owner, child rows) with one entry per
+        child, owner being the position in rows of its parent.
+        """
+        offsets_name, index_name = RELATIONS[(parent, child)]
+        offsets = self.column(parent, offsets_name)
+        rows = numpy.asarray(rows, dtype=numpy.int64)
+        owner, position = ExpandRanges(offsets[rows], offsets[rows + 1])
+        if index_name is None:
+            return owner, position
+        return owner, self.column(parent, index_name)[position]
+
+    def _local_events(self, event, events):
+        """
+        Position of each event number in the selection, as the "event"
+        column of SciFiArrays.
+        """
+        return numpy.searchsorted(events, event).astype(numpy.int32)
+
+    def spacepoint_arrays(self, events=None):
+        """
+        SciFiArrays.SpacePointArrays of the selected events.
+        """
+        events = self._events(events)
+        rows = self.rows("spacepoints", events)
+        arrays = self.gather("spacepoints", rows=rows)
+        arrays["event"] = self._local_events(arrays["event"], events)
+
+        owner, cluster_rows = self.children("spacepoints", rows, "clusters")
+        arrays["plane_sum"] = numpy.bincount(
+            owner, weights=self.column("clusters", "plane")[cluster_rows],
+            minlength=len(rows)).astype(numpy.int8)
+        arrays["channel_sum"] = numpy.bincount(
+            owner, weights=self.column("clusters", "channel")[cluster_rows],
+            minlength=len(rows))
+        return arrays
+
+    def cluster_arrays(self, events=None):
+        """
+        SciFiArrays.ClusterArrays of the selected events.
+        """
+        events = self._events(events)
+        rows = self.rows("clusters", events)
+        rows = rows[self.column("clusters", "in_event")[rows]]
+        arrays = self.gather("clusters", rows=rows)
+        del arrays["in_event"]
+        arrays["event"] = self._local_events(arrays["event"], events)
+        offsets = self.column("clusters", "digit_offsets")
+        arrays["ndigits"] = (offsets[rows + 1] - offsets[rows])\
+            .astype(numpy.int16)
+        return arrays
+
+    def spacepoint_cluster_arrays(self, events=None):
+        """
+        SciFiArrays.SpacePointClusterArrays of the selected events.
+        """
+        events = self._events(events)
+        sp_rows = self.rows("spacepoints", events)
+        sp, cluster_rows = self.children("spacepoints", sp_rows, "clusters")
+        clusters = self.gather("clusters", rows=cluster_rows,
+                               columns=["plane", "channel"])
+        sps = self.gather("spacepoints", rows=sp_rows,
+                          columns=["event", "tracker", "station",
+                                   "nchannels"])
+
+        arrays = {"event": self._local_events(sps["event"][sp], events),
+                  "sp": sp.astype(numpy.int32),
+                  "tracker": sps["tracker"][sp],
+                  "station": sps["station"][sp],
+                  "plane": clusters["plane"],
+                  "channel": clusters["channel"],
+                  "nchannels": sps["nchannels"][sp]}
+
+        owner, digit_rows = self.children("clusters", cluster_rows, "digits")
+        digits = self.gather("digits", rows=digit_rows,
+                             columns=["channel", "npe", "adc"])
+        for key in digits:
+            arrays["digit_" + key] = digits[key]
+        arrays["digit_offsets"] = numpy.concatenate(
+            [[0], numpy.cumsum(numpy.bincount(owner,
+                                              minlength=len(cluster_rows)))])\
+            .astype(numpy.int64)
+        return arrays
+
+    def pr_track_arrays(self, events=None):
+        """
+        SciFiArrays.PRTrackArrays of the selected events.
+        """
+        events = self._events(events)
+        arrays = self.gather("tracks", events)
+        arrays["event"] = self._local_events(arrays["event"], events)
+        return arrays
+
+    def tof_arrays(self, events=None):
+        """
+        TOFTools.TOFArrays of the selected events.
+        """
+        events = self._events(events)
+        arrays = self.gather("events", events,
+                             [k for k in self.columns("events")
+                              if k.startswith("tof")])
+        for name in ("tof01", "tof12"):
+            pairs = self.gather(name, events)
+            arrays[name + "_event"] = self._local_events(pairs["event"],
+                                                         events)
+            arrays[name + "_time"] = pairs["time"]
+        return arrays
+
+
+if __name__ == "__main__":
+
+    import ROOT
+    import libMausCpp  # pylint: disable = W0611
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outdir", help="directory of the columnar store",
+                        type=str)
+    parser.add_argument("infiles", help="recon files", type=str, nargs="+")
+    args = parser.parse_args()
+
+    chain = ROOT.TChain("Spill")
+    for f in args.infiles:
+        chain.AddFile(f)
+    data = ROOT.MAUS.Data()  # pylint: disable = E1101
+    chain.SetBranchAddress("data", data)
+
+    writer = ColumnarWriter(args.outdir)
+    for i in range(chain.GetEntries()):
+        chain.GetEntry(i)
+        spill = data.GetSpill()
+        if spill.GetDaqEventType() != "physics_event":
+            continue
+        writer.add_spill(spill)
+    print "Wrote %i events to %s" % (writer.close(), args.outdir)
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+"""
+Scan a grid of event selections (TOF01 window, TOF pixels, npe cut) in
+a single pass over the data.
+
+Every configuration is evaluated on each event of a spill as one bit
+of a per event bitmask, and the station efficiency partials, triplet
+channel hits (for dead channels) and alignment residuals are
+accumulated separately for every configuration. The SciFi and TOF
+arrays are only extracted once per spill, whatever the size of the
+grid.
+
+configs = CutGrid(tof01=[(28, 32), (28, 30.5), (26.5, 28.5)],
+                  npe_cut=[2, 3])
+scan = CutScan(configs)
+for each spill:
+    scan.fill_spill(spill.GetReconEvents())
+effs = scan.efficiencies()      # (n_configs, 10)
+"""
+
+import csv
+import itertools
+import argparse
+
+import numpy
+
+from TOFTools import TOFArrays, TimeWindowHit
+from SciFiArrays import SpacePointArrays, SpacePointClusterArrays, \
+    SpacePointDigitArrays, HelicalResidualArrays, ChannelRef, \
+    N_ChannelRefs, N_Tracker, N_Station
+from SciFiTools import ClusterLightYields
+from SciFiBootstrap import StationEfficiencyBootstrap, StationEfficiencies
+
+# Selection of SciFiEfficiencyV3, with no TOF01 or pixel cut:
+DEFAULT_CONFIG = {"tof01": None,
+                  "tof12": (0, 100),
+                  "tof1_single": True,
+                  "tof1_pixels": None,
+                  "tof2_pixels": None,
+                  "npe_cut": 3}
+
+# Residual histograms as SciFiAlign (position, residual):
+RES_BINS = (30, -150, 150, 80, -10, 10)
+RESIDUALS = ["x_yres", "y_xres"]
+
+
+def CutGrid(**axes):
+    """
+    All combinations of the given values of each cut, as a list of
+    configuration dicts (unset cuts take DEFAULT_CONFIG values).
+    """
+    names = sorted(axes)
+    configs = []
+    for values in itertools.product(*[axes[n] for n in names]):
+        config = dict(DEFAULT_CONFIG)
+        config.update(zip(names, values))
+        configs.append(config)
+    return configs
+
+
+def PackBits(masks):
+    """
+    Pack boolean masks (n_events, n_configs) into per event bitmasks,
+    (n_events, n_words) of uint64 with configuration i in bit i%64 of
+    word i//64.
+    """
+    n_events, n_configs = masks.shape
+    n_words = max(1, (n_configs + 63)//64)
+    padded = numpy.zeros((n_events, n_words*64), dtype=numpy.uint64)
+    padded[:, :n_configs] = masks
+    powers = numpy.left_shift(numpy.uint64(1),
+                              numpy.arange(64, dtype=numpy.uint64))
+    return (padded.reshape(n_events, n_words, 64)*powers).sum(axis=2)\
+        .astype(numpy.uint64)
+
+
+def UnpackBit(bits, config):
+    """
+    Boolean mask of the events passing configuration config.
+    """
+    word = bits[:, config//64]
+    return (numpy.right_shift(word, numpy.uint64(config % 64)) &
+            numpy.uint64(1)).astype(bool)
+
+
+def ExtractBatch(recon_events):
+    """
+    The arrays CutScan fills from, for a spill (None if it has no
+    recon events). Extraction is separate from filling so it can run
+    in reader processes (SharedPipeline).
+    """
+    if len(recon_events) == 0:
+        return None
+    return {"tof": TOFArrays(recon_events),
+            "spacepoints": SpacePointArrays(recon_events),
+            "sp_clusters": SpacePointClusterArrays(recon_events),
+            "digits": SpacePointDigitArrays(recon_events),
+            "residuals": HelicalResidualArrays(recon_events)}
+
+
+class CutScan:
+    """
+    Efficiency, dead channel and alignment accumulators for every
+    configuration of a list of selections.
+    """
+
+    def __init__(self, configs):
+        """
+        Constructor, configs is a list of dicts (e.g. from CutGrid).
+        """
+        self.configs = []
+        for config in configs:
+            full = dict(DEFAULT_CONFIG)
+            full.update(config)
+            self.configs.append(full)
+        n_configs = len(self.configs)
+
+        self._eff = StationEfficiencyBootstrap()
+        self.n_events = numpy.zeros(n_configs, dtype=numpy.int64)
+        self.eff_partials = numpy.zeros((n_configs,) +
+                                        self._eff.table().shape[1:],
+                                        dtype=numpy.int64)
+        self.channel_hits = numpy.zeros((n_configs, N_ChannelRefs),
+                                        dtype=numpy.int64)
+        self.residuals = numpy.zeros((n_configs, N_Tracker, N_Station,
+                                      len(RESIDUALS), RES_BINS[0],
+                                      RES_BINS[3]), dtype=numpy.int64)
+
+    def _pixel_mask(self, tof, name, pixels):
+        """
+        Events whose first TOF spacepoint is in the given horizontal
+        and vertical slabs, pixels is (hslabs, vslabs).
+        """
+        hslabs, vslabs = pixels
+        return numpy.in1d(tof[name + "_hslab"], list(hslabs)) & \
+            numpy.in1d(tof[name + "_vslab"], list(vslabs))
+
+    def evaluate(self, tof, n_events):
+        """
+        Per event bitmask of the configurations passed, from the
+        TOFArrays of a spill. Each distinct cut is evaluated once.
+        """
+        cache = {}
+        masks = numpy.ones((n_events, len(self.configs)), dtype=bool)
+        for i, config in enumerate(self.configs):
+            for key in ("tof01", "tof12", "tof1_single", "tof1_pixels",
+                        "tof2_pixels"):
+                value = config[key]
+                if (key, repr(value)) not in cache:
+                    if value is None or value is False:
+                        mask = numpy.ones(n_events, dtype=bool)
+                    elif key in ("tof01", "tof12"):
+                        mask = TimeWindowHit(tof[key + "_event"],
+                                             tof[key + "_time"], n_events,
+                                             value[0], value[1])
+                    elif key == "tof1_single":
+                        mask = tof["tof1_nsp"] == 1
+                    else:
+                        mask = self._pixel_mask(tof, key[:4], value)
+                    cache[(key, repr(value))] = mask
+                masks[:, i] &= cache[(key, repr(value))]
+        return PackBits(masks)
+
+    def fill_spill(self, recon_events):
+        """
+        Add a sequence of recon events to every configuration.
+        """
+        batch = ExtractBatch(recon_events)
+        if batch is not None:
+            self.fill_batch(batch)
+
+    def fill_batch(self, batch):
+        """
+        Add the arrays of a spill (from ExtractBatch) to every
+        configuration.
+        """
+        tof = batch["tof"]
+        n_events = len(tof["tof1_nsp"])
+        bits = self.evaluate(tof, n_events)
+
+        spacepoints = batch["spacepoints"]
+        sp_clusters = batch["sp_clusters"]
+        cluster_npe, saturated = ClusterLightYields(sp_clusters)
+
+        digits = batch["digits"]
+        digit_refs = ChannelRef(digits["tracker"].astype(int),
+                                digits["station"], digits["plane"],
+                                digits["channel"])
+        triplet_digits = digits["nchannels"] == 3
+
+        res = batch["residuals"]
+        hist = (res["tracker"].astype(int)*N_Station + res["station"] - 1)\
+            *len(RESIDUALS)
+        res_cells = [self._res_cell(hist, res["x"], res["y_res"]),
+                     self._res_cell(hist + 1, res["y"], res["x_res"])]
+
+        for i, config in enumerate(self.configs):
+            selected = UnpackBit(bits, i)
+            self.n_events[i] += numpy.count_nonzero(selected)
+
+            self.eff_partials[i] += self._eff.partial(
+                spacepoints, sp_clusters, cluster_npe, selected)
+
+            use = triplet_digits & selected[digits["event"]] & \
+                (digits["npe"] > config["npe_cut"])
+            self.channel_hits[i] += numpy.bincount(
+                digit_refs[use], minlength=N_ChannelRefs)
+
+            use = selected[res["event"]]
+            for cells, inside in res_cells:
+                self.residuals[i] += numpy.bincount(
+                    cells[use & inside], minlength=self.residuals[i].size)\
+                    .reshape(self.residuals.shape[1:])
+
+    def _res_cell(self, hist, position, residual):
+        """
+        Flat bin of each (position, residual) in the residual
+        histograms of one configuration, and whether it is inside the
+        histogram range.
+        """
+        nx, x_low, x_high, ny, y_low, y_high = RES_BINS
+        ix = numpy.floor((position - x_low)/(x_high - x_low)*nx).astype(int)
+        iy = numpy.floor((residual - y_low)/(y_high - y_low)*ny).astype(int)
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        return hist*nx*ny + ix*ny + iy, inside
+
+    def efficiencies(self):
+        """
+        Station efficiencies (n_configs, 10).
+        """
+        return StationEfficiencies(self.eff_partials, self._eff.centres)
+
+    def mean_residuals(self):
+        """
+        Mean residual of every (config, tracker, station, residual),
+        nan if empty.
+        """
+        nx, x_low, x_high, ny, y_low, y_high = RES_BINS
+        step = (y_high - y_low)/float(ny)
+        centres = y_low + step*(numpy.arange(ny) + 0.5)
+        counts = self.residuals.sum(axis=-2)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return (counts*centres).sum(axis=-1)/counts.sum(axis=-1)
+
+    def merge(self, other):
+        """
+        Add the results of another CutScan of the same configurations.
+        """
+        self.n_events += other.n_events
+        self.eff_partials += other.eff_partials
+        self.channel_hits += other.channel_hits
+        self.residuals += other.residuals
+
+    def save(self, fname):
+        """
+        Save the accumulated results to a numpy .npz file.
+        """
+        numpy.savez(fname, n_events=self.n_events,
+                    eff_partials=self.eff_partials,
+                    channel_hits=self.channel_hits,
+                    residuals=self.residuals,
+                    configs=numpy.array([repr(sorted(c.items()))
+                                         for c in self.configs]))
+
+    def load(self, fname):
+        """
+        Merge in results saved by another shard.
+        """
+        saved = numpy.load(fname)
+        self.n_events += saved["n_events"]
+        self.eff_partials += saved["eff_partials"]
+        self.channel_hits += saved["channel_hits"]
+        self.residuals += saved["residuals"]
+
+    def write_csv(self, fname):
+        """
+        Write the events and station efficiencies of every
+        configuration.
+        """
+        effs = self.efficiencies()
+        stations = ["eff_%i_%i" % (t, s) for t in range(N_Tracker)
+                    for s in range(1, N_Station + 1)]
+        keys = sorted(DEFAULT_CONFIG)
+        with open(fname, "w") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(keys + ["n_events"] + stations)
+            for config, n_events, eff in zip(self.configs, self.n_events,
+                                             effs):
+                writer.writerow([config[k] for k in keys] + [n_events] +
+                                ["%.5f" % e for e in eff])
+
+
+def _ParseWindow(text):
+    """
+    "low:high" to a (low, high) tuple.
+    """
+    low, high = text.split(":")
+    return (float(low), float(high))
+
+
+def _ParsePixels(text):
+    """
+    "2,3,4" to the same horizontal and vertical slab set.
+    """
+    slabs = tuple(int(s) for s in text.split(","))
+    return (slabs, slabs)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("infiles", help="recon files", type=str, nargs="+")
+    parser.add_argument("--tof01", help="TOF01 windows, low:high (ns)",
+                        type=_ParseWindow, nargs="+",
+                        default=[(28, 32), (28, 30.5), (26.5, 28.5)])
+    parser.add_argument("--tof1-pixels", help="TOF1 slab sets, e.g. 2,3,4",
+                        type=_ParsePixels, nargs="+", default=[None])
+    parser.add_argument("--tof2-pixels", help="TOF2 slab sets, e.g. 4,5,6",
+                        type=_ParsePixels, nargs="+", default=[None])
+    parser.add_argument("--npe-cut", help="digit npe cuts", type=float,
+                        nargs="+", default=[3])
+    parser.add_argument("--output", help="output name (.csv and .npz)",
+                        type=str, default="cut_scan")
+    parser.add_argument("--readers", help="reader processes (pipeline mode)",
+                        type=int, default=1)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--analyzers", help="analyzer processes (pipeline "
+                      "mode), 0 reads and fills in this process", type=int,
+                      default=0)
+    mode.add_argument("--workers", help="worker processes each reading "
+                      "and filling (file scheduler mode)", type=int,
+                      default=0)
+    parser.add_argument("--type-index", help="skip non physics spills "
+                        "using SpillTypeIndex files", action="store_true")
+    parser.add_argument("--manifest", help="FileManifest of the inputs, bad "
+                        "files are skipped", type=str, default=None)
+    args = parser.parse_args()
+
+    configs = CutGrid(tof01=args.tof01, tof1_pixels=args.tof1_pixels,
+                      tof2_pixels=args.tof2_pixels, npe_cut=args.npe_cut)
+    print "Scanning %i configurations" % len(configs)
+
+    infiles = args.infiles
+    entries = None
+    if args.manifest:
+        from FileManifest import FileManifest
+
+        manifest = FileManifest(args.manifest)
+        if manifest.build(infiles, max(args.workers, args.readers),
+                          checksum=False):
+            manifest.save()
+        infiles = manifest.valid_files(infiles)
+        entries = manifest.entries(infiles)
+
+    if args.analyzers > 0:
+        from SharedPipeline import SharedPipeline
+
+        pipeline = SharedPipeline(ExtractBatch, n_readers=args.readers,
+                                  n_analyzers=args.analyzers,
+                                  type_index=args.type_index)
+        scan = pipeline.run(infiles, lambda: CutScan(configs), entries)
+        pipeline.print_summary()
+    elif args.workers > 0:
+        from FileScheduler import FileScheduler
+
+        scheduler = FileScheduler(n_workers=args.workers,
+                                  type_index=args.type_index)
+        scan = scheduler.run(infiles, lambda: CutScan(configs),
+                             entries=entries)
+        scheduler.print_summary()
+    else:
+        from SpillReader import PrefetchReader
+
+        scan = CutScan(configs)
+        for entry, spill in PrefetchReader(infiles, entries=entries,
+                                           type_index=args.type_index):
+            scan.fill_spill(spill.GetReconEvents())
+
+    scan.save(args.output + ".npz")
+    scan.write_csv(args.output + ".csv")
@@ -0,0 +1,252 @@
+"""
+Tools for processing the raw tracker DAQ (VLSB) data.
+
+Raw hits are decoded into numpy arrays of (channelUID, ADC) per spill,
+and accumulated in dense numpy arrays which are only converted to ROOT
+objects at the end.
+"""
+
+import json
+
+import numpy
+
+from FrontEndLookup import N_ChanUIDS
+
+N_ADC = 256
+
+
+def VLSBArrays(daq_event):
+    """
+    Extract the channelUID (128*bank + channel) and ADC of every
+    VLSB hit in both trackers, returns two numpy arrays.
+    """
+    uids, adcs = [], []
+    for daq_array in (daq_event.GetTracker0DaqArray(),
+                      daq_event.GetTracker1DaqArray()):
+        for tracker_daq in daq_array:
+            for vlsb in tracker_daq.GetVLSBArray():
+                uids.append(128*vlsb.GetBankID() + vlsb.GetChannel())
+                adcs.append(vlsb.GetADC())
+
+    return numpy.array(uids, dtype=numpy.int64), \
+        numpy.array(adcs, dtype=numpy.int64)
+
+
+class PedestalMap:
+    """
+    Count of hits per (channelUID, ADC), held as a dense uint32 matrix.
+
+    Hits are buffered and added to the matrix with a single bincount
+    once flush_size hits have been collected.
+    """
+
+    def __init__(self, name="peds_both", flush_size=1000000):
+        """
+        Constructor, makes an empty map.
+        """
+        self.name = name
+        self.flush_size = flush_size
+        self.counts = numpy.zeros((N_ChanUIDS, N_ADC), dtype=numpy.uint32)
+        self._pending = []
+        self._n_pending = 0
+
+    def fill(self, uids, adcs):
+        """
+        Add arrays of hits, out of range values are dropped.
+        """
+        good = (uids >= 0) & (uids < N_ChanUIDS) & (adcs >= 0) & \
+            (adcs < N_ADC)
+        self._pending.append(uids[good]*N_ADC + adcs[good])
+        self._n_pending += numpy.count_nonzero(good)
+        if self._n_pending >= self.flush_size:
+            self.flush()
+
+    def fill_spill(self, spill):
+        """
+        Add all the raw hits of a spill.
+        """
+        self.fill(*VLSBArrays(spill.GetDAQData()))
+
+    def flush(self):
+        """
+        Add the buffered hits to the count matrix.
+        """
+        if self._n_pending > 0:
+            cells = numpy.bincount(numpy.concatenate(self._pending),
+                                   minlength=N_ChanUIDS*N_ADC)
+            self.counts += cells.reshape(N_ChanUIDS, N_ADC)\
+                .astype(numpy.uint32)
+        self._pending = []
+        self._n_pending = 0
+
+    def merge(self, other):
+        """
+        Add the counts of another PedestalMap (e.g. from another shard).
+        """
+        self.flush()
+        other.flush()
+        self.counts += other.counts
+
+    def ToTH2D(self):
+        """
+        Export the map as a TH2D of channelUID against ADC.
+        """
+        import ROOT
+
+        self.flush()
+        hist = ROOT.TH2D(self.name, "pedestals Both; channel no; ADC",
+                         N_ChanUIDS, -0.5, N_ChanUIDS - 0.5,
+                         N_ADC, -0.5, N_ADC - 0.5)
+
+        # Cells include underflow and overflow, ordered x fastest:
+        cells = numpy.zeros((N_ADC + 2, N_ChanUIDS + 2))
+        cells[1:-1, 1:-1] = self.counts.T
+        hist.SetContent(cells.ravel())
+        hist.SetEntries(float(self.counts.sum()))
+        return hist
+
+
+class StreamingCalibration:
+    """
+    Per channelUID pedestal and single photo-electron gain estimates,
+    updated from the raw VLSB data held in a PedestalMap.
+
+    The estimate can be refreshed at any point during a run, memory use
+    is fixed by the size of the map. Channels which drift from a
+    reference calibration (the calibration list of a FrontEndLookup)
+    are flagged, and a calibration json readable by
+    FrontEndLookup.ParseCalibration is written.
+    """
+
+    def __init__(self, pedestals=None, reference=None, min_entries=1000,
+                 max_gain=40, pedestal_tolerance=2.0, gain_tolerance=0.1):
+        """
+        Constructor, uses the given PedestalMap or makes a new one.
+        """
+        if pedestals is None:
+            pedestals = PedestalMap()
+        self.pedestals = pedestals
+        self.reference = reference
+        self.min_entries = min_entries
+        self.max_gain = max_gain
+        self.pedestal_tolerance = pedestal_tolerance
+        self.gain_tolerance = gain_tolerance
+
+        self.adc_pedestal = numpy.zeros(N_ChanUIDS)
+        self.adc_gain = numpy.zeros(N_ChanUIDS)
+        self.valid = numpy.zeros(N_ChanUIDS, dtype=bool)
+
+    def fill_spill(self, spill):
+        """
+        Add all the raw hits of a spill.
+        """
+        self.pedestals.fill_spill(spill)
+
+    def _peak_mean(self, counts, peak, width=2):
+        """
+        Count weighted mean ADC within width of each channel's peak bin.
+        """
+        adc = numpy.arange(N_ADC)
+        window = numpy.abs(adc[numpy.newaxis, :] - peak[:, numpy.newaxis])\
+            <= width
+        weights = counts*window
+        norm = weights.sum(axis=1)
+        norm[norm == 0] = 1
+        return (weights*adc).sum(axis=1)/norm
+
+    def estimate(self):
+        """
+        Estimate the pedestal (largest peak) and the single
+        photo-electron peak (largest peak after the first minimum
+        above the pedestal) for all channels at once.
+        """
+        self.pedestals.flush()
+        counts = self.pedestals.counts.astype(float)
+        adc = numpy.arange(N_ADC)[numpy.newaxis, :]
+
+        ped_bin = counts.argmax(axis=1)
+        self.adc_pedestal = self._peak_mean(counts, ped_bin)
+
+        # Search between the pedestal and max_gain above it, for the first
+        # bin where the (3 bin smoothed) counts stop falling:
+        offset = adc - ped_bin[:, numpy.newaxis]
+        search = (offset > 0) & (offset <= self.max_gain)
+        smooth = counts.copy()
+        smooth[:, 1:] += counts[:, :-1]
+        smooth[:, :-1] += counts[:, 1:]
+        rising = search[:, :-1] & (smooth[:, 1:] >= smooth[:, :-1])
+        valley_bin = rising.argmax(axis=1)
+        after_valley = search & (adc > valley_bin[:, numpy.newaxis]) & \
+            rising.any(axis=1)[:, numpy.newaxis]
+        pe_bin = numpy.where(after_valley, counts, -1).argmax(axis=1)
+        pe_adc = self._peak_mean(counts, pe_bin)
+
+        self.adc_gain = pe_adc - self.adc_pedestal
+        self.valid = (counts.sum(axis=1) >= self.min_entries) & \
+            after_valley.any(axis=1) & (pe_bin > valley_bin) & \
+            (self.adc_gain > 0)
+
+    def _reference_values(self, key):
+        """
+        Array of a reference calibration value, nan where unknown.
+        """
+        values = numpy.empty(N_ChanUIDS)
+        values.fill(numpy.nan)
+        if self.reference is not None:
+            for uid, c in enumerate(self.reference):
+                if key in c:
+                    values[uid] = c[key]
+        return values
+
+    def drifted(self):
+        """
+        Return the channelUIDs whose estimate differs from the
+        reference calibration by more than the tolerances.
+        """
+        ref_ped = self._reference_values("adc_pedestal")
+        ref_gain = self._reference_values("adc_gain")
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            known = self.valid & numpy.isfinite(ref_ped) & \
+                numpy.isfinite(ref_gain) & (ref_gain > 0)
+            ped_drift = numpy.abs(self.adc_pedestal - ref_ped) > \
+                self.pedestal_tolerance
+            gain_drift = numpy.abs(self.adc_gain/ref_gain - 1) > \
+                self.gain_tolerance
+
+        return numpy.flatnonzero(known & (ped_drift | gain_drift))
+
+    def calibration(self):
+        """
+        Generate the calibration list. Channels without a valid
+        estimate keep their reference values, TDC values are always
+        taken from the reference (or zero).
+        """
+        calib = []
+        for uid in range(N_ChanUIDS):
+            if self.reference is not None and self.reference[uid]:
+                c = dict(self.reference[uid])
+            elif self.valid[uid]:
+                c = {"tdc_pedestal": 0.0, "tdc_gain": 0.0}
+            else:
+                continue
+            c["bank"] = uid // 128
+            c["channel"] = uid % 128
+            c.pop("ChannelID", None)
+            if self.valid[uid]:
+                c["adc_pedestal"] = round(float(self.adc_pedestal[uid]), 3)
+                c["adc_gain"] = round(float(self.adc_gain[uid]), 3)
+            calib.append(c)
+        return calib
+
+    def write_json(self, fname):
+        """
+        Estimate and write the calibration, returns the drifted
+        channelUIDs.
+        """
+        self.estimate()
+        with open(fname, "w") as f:
+            json.dump(self.calibration(), f)
+        drifted = self.drifted()
+        print "Calibration: %i channels estimated, %i drifted" % \
+            (numpy.count_nonzero(self.valid), len(drifted))
+        return drifted
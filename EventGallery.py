@@ -0,0 +1,117 @@
+"""
+Batch rendering of SciFi event displays, kept out of the main
+event loop.
+
+Events are queued during the scan and rendered afterwards by a pool
+of batch mode ROOT workers, each reusing a single canvas.
+"""
+
+import os
+import multiprocessing
+
+
+class EventGallery:
+    """
+    Collect (spill, event) identifiers during a scan and then render
+    them in parallel to PNG files, with an index listing the images.
+
+    gallery = EventGallery("ds_missing")
+    gallery.add(i, spill.GetSpillNumber(), j)   # inside the loop
+    gallery.render(infiles, n_workers=4)        # after the loop
+    """
+
+    def __init__(self, outdir, index_name="index.txt"):
+        """
+        Constructor, stores where the images and index are written.
+        """
+        self.outdir = outdir
+        self.index_name = index_name
+        self.queue = []
+
+    def add(self, entry, spill_number, event_number):
+        """
+        Queue an event for rendering, entry is the TChain entry the
+        spill was read from.
+        """
+        self.queue.append((entry, spill_number, event_number))
+
+    def image_name(self, spill_number, event_number):
+        """
+        Name of the image for a given event, relative to outdir.
+        """
+        return "%04i_%i.png" % (spill_number, event_number)
+
+    def render(self, infiles, n_workers=4):
+        """
+        Render all queued events using n_workers processes, then
+        write the index file. Returns the path of the index.
+        """
+        if not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+
+        # Keep each worker reading forwards through the chain:
+        queue = sorted(self.queue)
+        n_workers = max(1, min(n_workers, len(queue)))
+        chunks = [queue[w::n_workers] for w in range(n_workers)]
+        tasks = [(infiles, self.outdir, chunk, self) for chunk in chunks]
+
+        print "Rendering %i events with %i workers" % (len(queue), n_workers)
+        if n_workers == 1:
+            results = [_RenderEvents(t) for t in tasks]
+        else:
+            pool = multiprocessing.Pool(n_workers)
+            try:
+                results = pool.map(_RenderEvents, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        rendered = sorted(r for chunk in results for r in chunk)
+
+        index_path = os.path.join(self.outdir, self.index_name)
+        with open(index_path, "w") as f:
+            f.write("# spill event entry image\n")
+            for entry, spill_number, event_number, image in rendered:
+                f.write("%i %i %i %s\n" % (spill_number, event_number,
+                                           entry, image))
+
+        return index_path
+
+
+def _RenderEvents(task):
+    """
+    Worker function, renders a chunk of events from its own TChain
+    onto a single batch mode canvas.
+    """
+    infiles, outdir, chunk, gallery = task
+
+    import ROOT
+    import libMausCpp  # pylint: disable = W0611
+    from PlotSciFiEvent import PlotSciFiEvent
+
+    ROOT.gROOT.SetBatch(True)
+
+    chain = ROOT.TChain("Spill")
+    for f in infiles:
+        chain.AddFile(f)
+    data = ROOT.MAUS.Data()  # pylint: disable = E1101
+    chain.SetBranchAddress("data", data)
+
+    canvas = ROOT.TCanvas("gallery_%i" % os.getpid(), "gallery", 1024, 768)
+    plot = PlotSciFiEvent()
+
+    rendered = []
+    last_entry = -1
+    for entry, spill_number, event_number in chunk:
+        if entry != last_entry:
+            chain.GetEntry(entry)
+            last_entry = entry
+        recon_event = data.GetSpill().GetReconEvents()[event_number]
+
+        plot.fill(recon_event.GetSciFiEvent())
+        plot.draw(canvas)
+        image = gallery.image_name(spill_number, event_number)
+        canvas.SaveAs(os.path.join(outdir, image))
+        rendered.append((entry, spill_number, event_number, image))
+
+    return rendered
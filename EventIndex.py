@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Persisted index of where each spill lives, so that single events can
+be looked at again without re-scanning a whole chain.
+
+index = EventIndex("index.json")
+index.build(infiles)
+index.save()
+recon_event = index.fetch_event(8681, spill, event)
+"""
+
+import os
+import json
+import argparse
+
+
+class EventIndex:
+    """
+    Maps (run, spill number, event number) to (file, tree entry).
+
+    Only physics spills are indexed, these are the ones containing
+    recon events. Files which have not changed since they were last
+    indexed are not re-read.
+    """
+
+    def __init__(self, index_path=None):
+        """
+        Constructor, loads an existing index if index_path exists.
+        """
+        self.index_path = index_path
+        self.files = {}
+        self.lookup = {}
+
+        # Open file for fetching:
+        self._open_path = None
+        self._open_file = None
+        self._open_tree = None
+        self._data = None
+
+        if index_path is not None and os.path.exists(index_path):
+            self.load(index_path)
+
+    def build(self, infiles):
+        """
+        Add infiles to the index, re-scanning only new or modified
+        files.
+        """
+        for path in infiles:
+            mtime = os.path.getmtime(path)
+            if path in self.files and self.files[path]["mtime"] == mtime:
+                continue
+            print "Indexing file: ", path
+            self.files[path] = {"mtime": mtime,
+                                "spills": self._scan_file(path)}
+        self._generate_lookup()
+
+    def _scan_file(self, path):
+        """
+        Read each spill in a file, returning a list of
+        [entry, run, spill number, number of recon events].
+        """
+        import ROOT
+        import libMausCpp  # pylint: disable = W0611
+
+        spills = []
+        root_file = ROOT.TFile(path, "READ")  # pylint: disable = E1101
+        tree = root_file.Get("Spill")
+        data = ROOT.MAUS.Data()  # pylint: disable = E1101
+        tree.SetBranchAddress("data", data)
+
+        for entry in range(tree.GetEntries()):
+            tree.GetEntry(entry)
+            spill = data.GetSpill()
+            if spill.GetDaqEventType() != "physics_event":
+                continue
+            spills.append([entry, spill.GetRunNumber(),
+                           spill.GetSpillNumber(),
+                           spill.GetReconEvents().size()])
+        root_file.Close()
+        return spills
+
+    def _generate_lookup(self):
+        """
+        Generate the (run, spill) -> (file, entry, n_events) lookup.
+        """
+        self.lookup = {}
+        for path in self.files:
+            for entry, run, spill, n_events in self.files[path]["spills"]:
+                self.lookup[(run, spill)] = (path, entry, n_events)
+
+    def save(self, index_path=None):
+        """
+        Write the index to disk as json.
+        """
+        if index_path is None:
+            index_path = self.index_path
+        with open(index_path, "w") as f:
+            json.dump({"files": self.files}, f)
+
+    def load(self, index_path):
+        """
+        Read an index written by save.
+        """
+        with open(index_path, "r") as f:
+            self.files = json.load(f)["files"]
+        self._generate_lookup()
+
+    def locate_spill(self, run, spill):
+        """
+        Return (file, entry, number of recon events) of a spill, raises
+        LookupError if the spill is not indexed.
+        """
+        try:
+            return self.lookup[(run, spill)]
+        except KeyError:
+            raise LookupError("Run %i spill %i is not indexed" % (run, spill))
+
+    def locate(self, run, spill, event=0):
+        """
+        Return the (file, entry) holding an event, raises LookupError
+        if the event is not indexed.
+        """
+        path, entry, n_events = self.locate_spill(run, spill)
+        if event < 0 or event >= n_events:
+            raise LookupError("Run %i spill %i has no event %i"
+                              % (run, spill, event))
+        return path, entry
+
+    def fetch_spill(self, run, spill):
+        """
+        Load a single spill, only its file is opened.
+        """
+        import ROOT
+        import libMausCpp  # pylint: disable = W0611
+
+        path, entry, n_events = self.locate_spill(run, spill)
+        if path != self._open_path:
+            if self._open_file is not None:
+                self._open_file.Close()
+            self._open_file = ROOT.TFile(path, "READ")  # pylint: disable = E1101
+            self._open_tree = self._open_file.Get("Spill")
+            self._data = ROOT.MAUS.Data()  # pylint: disable = E1101
+            self._open_tree.SetBranchAddress("data", self._data)
+            self._open_path = path
+        self._open_tree.GetEntry(entry)
+        return self._data.GetSpill()
+
+    def fetch_event(self, run, spill, event):
+        """
+        Load a single recon event. The returned object is only valid
+        until the next fetch.
+        """
+        self.locate(run, spill, event)
+        return self.fetch_spill(run, spill).GetReconEvents()[event]
+
+
+def ReadEventList(fname):
+    """
+    Read an event list written as spill*1000 + event (e.g. ds_bad.txt),
+    returning a list of (spill, event).
+    """
+    events = []
+    with open(fname, "r") as f:
+        for l in f:
+            if l.strip():
+                events.append(divmod(int(l), 1000))
+    return events
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index_path", help="the index file to create/update",
+                        type=str)
+    parser.add_argument("infiles", help="recon files to index", type=str,
+                        nargs="*")
+    parser.add_argument("--run", help="run number of the event list",
+                        type=int)
+    parser.add_argument("--events", help="event list (spill*1000 + event)"
+                        " to display from the index", type=str)
+    args = parser.parse_args()
+
+    index = EventIndex(args.index_path)
+    if args.infiles:
+        index.build(args.infiles)
+        index.save()
+    print "Indexed %i spills from %i files" % (len(index.lookup),
+                                              len(index.files))
+
+    # Revisit a flagged event list:
+    if args.events is not None:
+        from PlotSciFiEvent import PlotSciFiEvent
+        plot = PlotSciFiEvent()
+        for spill, event in ReadEventList(args.events):
+            print "Run %i, Spill %i, Event %i" % (args.run, spill, event)
+            recon_event = index.fetch_event(args.run, spill, event)
+            plot.fill(recon_event.GetSciFiEvent())
+            plot.draw(getattr(plot, "c", None))
+            plot.c.Update()
+            raw_input("press enter to continue")
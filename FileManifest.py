@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+Manifest of validated recon files, holding the entry count, size and
+checksum of each, so jobs can drop broken files up front and build
+chains without opening every file to count entries.
+
+Files are validated in parallel: each must open, not be a zombie or
+recovered (truncated) file, hold a Spill tree and have its last entry
+readable. Results are cached by size and mtime, so only new or changed
+files are checked again.
+
+manifest = FileManifest("manifest.json")
+manifest.build(infiles, n_workers=8)
+manifest.save()
+infiles = manifest.valid_files(infiles)
+chain = manifest.make_chain(infiles)
+"""
+
+import os
+import json
+import zlib
+import argparse
+import traceback
+import multiprocessing
+
+_CHUNK = 16*1024*1024
+
+
+def Adler32(path):
+    """
+    Adler-32 checksum of a file (as used by xrootd), as 8 hex digits.
+    """
+    checksum = 1
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(_CHUNK)
+            if not block:
+                break
+            checksum = zlib.adler32(block, checksum)
+    return "%08x" % (checksum & 0xffffffff)
+
+
+def ValidateFile(path, checksum=True):
+    """
+    Check a recon file, returns its manifest record. error is None for
+    a good file.
+    """
+    record = {"size": os.path.getsize(path),
+              "mtime": os.path.getmtime(path),
+              "entries": 0, "checksum": None, "error": None}
+    try:
+        import ROOT
+        import libMausCpp  # pylint: disable = W0611
+
+        root_file = ROOT.TFile.Open(path, "READ")  # pylint: disable = E1101
+        if not root_file or root_file.IsZombie():
+            record["error"] = "zombie file"
+        elif root_file.TestBit(ROOT.TFile.kRecovered):  # pylint: disable = E1101
+            record["error"] = "truncated (recovered) file"
+        elif root_file.GetEND() > record["size"]:
+            record["error"] = "truncated file, %i of %i bytes" % \
+                (record["size"], root_file.GetEND())
+        else:
+            tree = root_file.Get("Spill")
+            if not tree:
+                record["error"] = "no Spill tree"
+            else:
+                record["entries"] = int(tree.GetEntries())
+                if record["entries"] > 0 and \
+                        tree.GetEntry(record["entries"] - 1) <= 0:
+                    record["error"] = "last entry unreadable"
+        if root_file:
+            root_file.Close()
+        if record["error"] is None and checksum:
+            record["checksum"] = Adler32(path)
+    except Exception:  # pylint: disable = W0703
+        record["error"] = traceback.format_exc().strip().split("\n")[-1]
+    return record
+
+
+def _Validate(task):
+    """
+    Worker function, (path, checksum) to (path, record).
+    """
+    path, checksum = task
+    return path, ValidateFile(path, checksum)
+
+
+class FileManifest:
+    """
+    Maps each recon file (absolute path) to its size, mtime, entries,
+    checksum and validation error (None if good).
+    """
+
+    def __init__(self, manifest_path=None):
+        """
+        Constructor, loads an existing manifest if manifest_path
+        exists.
+        """
+        self.manifest_path = manifest_path
+        self.files = {}
+        if manifest_path is not None and os.path.exists(manifest_path):
+            self.load(manifest_path)
+
+    def _changed(self, path):
+        """
+        True if a file is not in the manifest or has changed since.
+        """
+        record = self.files.get(path)
+        return record is None or \
+            (record["size"], record["mtime"]) != \
+            (os.path.getsize(path), os.path.getmtime(path))
+
+    def build(self, infiles, n_workers=4, checksum=True):
+        """
+        Validate the new or modified files of infiles, using n_workers
+        processes. Returns the number of files checked.
+        """
+        paths = sorted(set(os.path.abspath(p) for p in infiles))
+        missing = [p for p in paths if not os.path.exists(p)]
+        for path in missing:
+            self.files[path] = {"size": 0, "mtime": 0, "entries": 0,
+                                "checksum": None, "error": "missing file"}
+        tasks = [(p, checksum) for p in paths
+                 if p not in missing and self._changed(p)]
+        if not tasks:
+            return 0
+
+        print "Validating %i files" % len(tasks)
+        if n_workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(n_workers, len(tasks)))
+            try:
+                results = pool.map(_Validate, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_Validate(t) for t in tasks]
+
+        for path, record in results:
+            self.files[path] = record
+            if record["error"] is not None:
+                print "Bad file: %s, %s" % (path, record["error"])
+        return len(tasks)
+
+    def save(self, manifest_path=None):
+        """
+        Write the manifest to disk as json.
+        """
+        if manifest_path is None:
+            manifest_path = self.manifest_path
+        with open(manifest_path, "w") as f:
+            json.dump({"files": self.files}, f, indent=1, sort_keys=True)
+
+    def load(self, manifest_path):
+        """
+        Read a manifest written by save.
+        """
+        with open(manifest_path, "r") as f:
+            self.files = json.load(f)["files"]
+
+    def record(self, path):
+        """
+        The record of a file, raises LookupError if it has not been
+        validated or has changed since.
+        """
+        path = os.path.abspath(path)
+        if path not in self.files or \
+                (os.path.exists(path) and self._changed(path)):
+            raise LookupError("%s is not in the manifest or has changed"
+                              % path)
+        return self.files[path]
+
+    def valid_files(self, infiles):
+        """
+        The files of infiles which passed validation, in order.
+        """
+        good = []
+        for path in infiles:
+            record = self.record(path)
+            if record["error"] is None:
+                good.append(path)
+            else:
+                print "Skipping bad file: %s, %s" % (path, record["error"])
+        return good
+
+    def entries(self, infiles):
+        """
+        Dictionary of the entry count of each file, as given in
+        infiles, for FileScheduler and SpillReader.
+        """
+        return {path: self.record(path)["entries"] for path in infiles}
+
+    def make_chain(self, infiles, tree_name="Spill"):
+        """
+        Build a TChain of the files, the entry counts are given to the
+        chain so the files are not opened here.
+        """
+        import ROOT
+
+        chain = ROOT.TChain(tree_name)
+        for path in infiles:
+            chain.AddFile(path, self.record(path)["entries"])
+        return chain
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", help="the manifest (json)", type=str)
+    parser.add_argument("infiles", help="recon files to validate", type=str,
+                        nargs="*")
+    parser.add_argument("--workers", help="validation processes", type=int,
+                        default=4)
+    parser.add_argument("--no-checksum", help="skip the file checksums",
+                        action="store_true")
+    args = parser.parse_args()
+
+    manifest = FileManifest(args.manifest)
+    if args.infiles:
+        manifest.build(args.infiles, args.workers, not args.no_checksum)
+        manifest.save()
+
+    n_bad = 0
+    for path, record in sorted(manifest.files.items()):
+        if record["error"] is not None:
+            n_bad += 1
+            print "BAD  %s: %s" % (path, record["error"])
+    print "%i files, %i bad, %i entries" % \
+        (len(manifest.files), n_bad,
+         sum(r["entries"] for r in manifest.files.values()))
@@ -0,0 +1,213 @@
+"""
+Process a dataset of recon files in parallel, split into entry range
+tasks of similar size so no worker is left idle at the end.
+
+Every file is cut into tasks of about task_mb (by its size and entry
+count) and the tasks are dealt largest first to the least loaded
+worker. A worker works through its own tasks, then steals the smallest
+remaining task of the worker with the most work left. Busy time per
+worker is recorded, so the parallel efficiency of a job can be seen.
+
+scheduler = FileScheduler(n_workers=8)
+scan = scheduler.run(infiles, lambda: CutScan(configs))
+scheduler.print_summary()
+"""
+
+import os
+import time
+import traceback
+import collections
+import multiprocessing
+
+from SpillReader import PrefetchReader
+
+
+def FileEntries(path):
+    """
+    Number of entries of the Spill tree of a file.
+    """
+    import ROOT
+
+    root_file = ROOT.TFile(path, "READ")  # pylint: disable = E1101
+    tree = root_file.Get("Spill")
+    n_entries = tree.GetEntries()
+    root_file.Close()
+    return n_entries
+
+
+def MakeTasks(infiles, entries=None, task_mb=256):
+    """
+    Split files into (bytes, path, start, stop) entry range tasks of
+    about task_mb, largest first. entries maps path to entry count,
+    files not in it are opened to count.
+    """
+    entries = entries or {}
+    tasks = []
+    for path in infiles:
+        size = os.path.getsize(path)
+        n_entries = entries.get(path)
+        if n_entries is None:
+            n_entries = FileEntries(path)
+        if n_entries == 0:
+            continue
+        n_tasks = min(n_entries, max(1, int(round(size/(task_mb*1e6)))))
+        bounds = [n_entries*i//n_tasks for i in range(n_tasks + 1)]
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            tasks.append((size*(stop - start)//n_entries, path, start, stop))
+    return sorted(tasks, reverse=True)
+
+
+def DealTasks(tasks, n_workers):
+    """
+    Deal tasks (largest first) to the least loaded of n_workers,
+    returns a deque of tasks per worker.
+    """
+    queues = [collections.deque() for i in range(n_workers)]
+    load = [0]*n_workers
+    for task in tasks:
+        worker = load.index(min(load))
+        queues[worker].append(task)
+        load[worker] += task[0]
+    return queues
+
+
+def FillSpill(analyzer, spill):
+    """
+    Default fill, analyzer.fill_spill on the recon events.
+    """
+    analyzer.fill_spill(spill.GetReconEvents())
+
+
+def _Worker(worker, make_analyzer, fill, depth, type_index, entries,
+            requests, replies):
+    """
+    Worker process, asks for tasks until there are none left.
+    """
+    try:
+        analyzer = make_analyzer()
+        stats = {"tasks": 0, "stolen": 0, "bytes": 0, "entries": 0,
+                 "busy_s": 0., "wait_s": 0.}
+        while True:
+            t0 = time.time()
+            requests.put(("next", worker, None))
+            task = replies.get()
+            t1 = time.time()
+            stats["wait_s"] += t1 - t0
+            if task is None:
+                break
+            size, path, start, stop, stolen = task
+            for entry, spill in PrefetchReader([path], depth=depth,
+                                               start=start, stop=stop,
+                                               entries=entries,
+                                               type_index=type_index):
+                fill(analyzer, spill)
+            stats["busy_s"] += time.time() - t1
+            stats["tasks"] += 1
+            stats["stolen"] += stolen
+            stats["bytes"] += size
+            stats["entries"] += stop - start
+        requests.put(("done", worker, (stats, analyzer)))
+    except Exception:  # pylint: disable = W0703
+        requests.put(("error", worker, traceback.format_exc()))
+
+
+class FileScheduler:
+    """
+    Runs an analyzer (with fill_spill and merge) over a dataset in
+    n_workers processes with size aware work stealing.
+    """
+
+    def __init__(self, n_workers=4, task_mb=256, depth=4, type_index=False):
+        """
+        Constructor, task_mb is the target task size. depth and
+        type_index are passed to each worker's SpillReader.
+        """
+        self.n_workers = n_workers
+        self.task_mb = task_mb
+        self.depth = depth
+        self.type_index = type_index
+        self.stats = {}
+
+    def _next_task(self, worker, queues):
+        """
+        The next task of a worker, stolen from the tail of the most
+        loaded worker when its own queue is empty. None when all done.
+        """
+        if queues[worker]:
+            return queues[worker].popleft() + (False,)
+        loaded = [q for q in queues if q]
+        if not loaded:
+            return None
+        victim = max(loaded, key=lambda q: sum(t[0] for t in q))
+        return victim.pop() + (True,)
+
+    def run(self, infiles, make_analyzer, fill=FillSpill, entries=None):
+        """
+        Process infiles, returns the merged analyzer. entries maps
+        paths to known entry counts (e.g. FileManifest.entries).
+        """
+        entries = entries or {}
+        tasks = MakeTasks(infiles, entries, self.task_mb)
+        queues = DealTasks(tasks, self.n_workers)
+        print "Scheduling %i tasks over %i files on %i workers" % \
+            (len(tasks), len(infiles), self.n_workers)
+
+        requests = multiprocessing.Queue()
+        replies = [multiprocessing.Queue() for i in range(self.n_workers)]
+        workers = [multiprocessing.Process(
+            target=_Worker, args=(i, make_analyzer, fill, self.depth,
+                                  self.type_index, entries, requests,
+                                  replies[i]))
+                   for i in range(self.n_workers)]
+        for process in workers:
+            process.daemon = True
+            process.start()
+
+        start = time.time()
+        self.stats = {"workers": {}}
+        merged = None
+        finished = False
+        try:
+            while len(self.stats["workers"]) < self.n_workers:
+                kind, worker, payload = requests.get()
+                if kind == "error":
+                    raise RuntimeError("FileScheduler worker %i failed:\n%s"
+                                       % (worker, payload))
+                elif kind == "next":
+                    replies[worker].put(self._next_task(worker, queues))
+                else:
+                    stats, analyzer = payload
+                    self.stats["workers"][worker] = stats
+                    if merged is None:
+                        merged = analyzer
+                    else:
+                        merged.merge(analyzer)
+            finished = True
+        finally:
+            for process in workers:
+                if not finished and process.is_alive():
+                    process.terminate()
+                process.join()
+        self.stats["wall_s"] = time.time() - start
+        return merged
+
+    def efficiency(self):
+        """
+        Parallel efficiency, total busy time over workers x wall time.
+        """
+        busy = sum(s["busy_s"] for s in self.stats["workers"].values())
+        return busy/max(self.n_workers*self.stats["wall_s"], 1e-9)
+
+    def print_summary(self):
+        """
+        Print the tasks, steals and utilisation of each worker.
+        """
+        wall = max(self.stats["wall_s"], 1e-9)
+        for worker, stats in sorted(self.stats["workers"].items()):
+            print "Worker %i: %i tasks (%i stolen), %i entries, %.1f MB, " \
+                "busy %.1f s (%.0f%%)" % \
+                (worker, stats["tasks"], stats["stolen"], stats["entries"],
+                 stats["bytes"]/1e6, stats["busy_s"],
+                 100.*stats["busy_s"]/wall)
+        print "Wall %.1f s, parallel efficiency %.0f%%" % \
+            (wall, 100.*self.efficiency())
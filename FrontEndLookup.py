@@ -4,15 +4,10 @@ Simple class to facilitate
 
 """
 import json
+import numpy
 
-try:
-    from cdb import Calibration, Cabling
-except:
-    print "CDB interface unavailable"
-    CDB_AVAIL = False
-else:
-    print "CDB interface available"
-    CDB_AVAIL = True
+# The CDB interface, imported on first use (see CDB):
+_cdb = {}
 
 # Definitions:
 N_Channel = 216
@@ -26,6 +21,24 @@ N_ChBank = 128
 N_ChanUIDS = N_Board*N_Bank*N_ChBank
 
 
+def CDB():
+    """
+    Import the CDB interface the first time it is needed, returns a
+    dict with the Calibration and Cabling classes, or None if the CDB
+    is unavailable.
+    """
+    if "available" not in _cdb:
+        try:
+            from cdb import Calibration, Cabling
+        except Exception:  # pylint: disable = W0703
+            print "CDB interface unavailable"
+            _cdb["available"] = False
+        else:
+            _cdb.update(available=True, Calibration=Calibration,
+                        Cabling=Cabling)
+    return _cdb if _cdb["available"] else None
+
+
 class FrontEndLookup:
     """
     Front end lookup class, used to determine the exact board and
@@ -44,9 +57,10 @@ class FrontEndLookup:
         if mapping_filepath is not None:
             with open(mapping_filepath, "r") as f:
                 self.mapping = self.ParseMapping(f)
-        elif runid is not None and CDB_AVAIL:
+        elif runid is not None and CDB() is not None:
             # Perform CDB operations to retrive mapping..
-            cdb_mapping = Cabling().get_cabling_for_run('Trackers', runid)
+            cdb_mapping = CDB()["Cabling"]().get_cabling_for_run('Trackers',
+                                                                 runid)
             self.mapping = self.ParseMapping(cdb_mapping.split('\n'))
         else:
             raise ValueError("Unable to load mapping, no methods available")
@@ -55,10 +69,10 @@ class FrontEndLookup:
         if calibration_filepath is not None:
             with open(calibration_filepath, "r") as f:
                 self.calibration = self.ParseCalibration(f.read())
-        elif runid is not None and CDB_AVAIL:
+        elif runid is not None and CDB() is not None:
             # Perform CDB operations to retrive mapping..
-            cdb_calib = Calibration().get_calibration_for_run('Trackers', 
-                                                              runid, 'trackers')
+            cdb_calib = CDB()["Calibration"]().get_calibration_for_run(
+                'Trackers', runid, 'trackers')
             print cdb_calib
             self.calibration = self.ParseCalibration(cdb_calib)
         else:
@@ -132,6 +146,21 @@ class FrontEndLookup:
 
         return saturation
 
+    def GetSaturationPEArray(self):
+        """
+        Saturation in PE of every channel, indexed by the 1d
+        reference (see _get1dref), 0 where unknown.
+        """
+        saturation = numpy.zeros(self._get1dref(N_Tracker, 1, 0, 0))
+        for tracker in range(N_Tracker):
+            for station in range(1, N_Station+1):
+                for plane in range(N_Plane):
+                    for channel in range(N_Channel):
+                        ref = self._get1dref(tracker, station, plane, channel)
+                        saturation[ref] = self.GetChannelSaturationPE\
+                            (tracker, station, plane, channel)
+        return saturation
+
     def GetBadChannelsPlane(self, tracker, station, plane):
         """
         Get all the bad channels for a given plane in the detector.
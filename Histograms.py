@@ -0,0 +1,238 @@
+"""
+Fixed binning histograms held as numpy arrays, filled from whole
+arrays at once and converted to ROOT only when written.
+
+Contents and sums of squared weights include the underflow and
+overflow bins (bin 0 and nbins+1, as ROOT), and the statistics ROOT
+keeps (sum of weights, weights squared, weighted x, x squared) are
+accumulated so the conversion to TH1D/TH2D is lossless. Histograms are
+plain numpy data, so they pickle and merge cheaply across processes.
+
+hist = Hist1D("triplet_ly", "triplet_ly", 30, -0.5, 29.5)
+hist.fill(npe_array)
+hist.ToTH1D().Write()
+"""
+
+import numpy
+
+
+def _Bins(values, nbins, low, high):
+    """
+    ROOT bin number (0 underflow, nbins+1 overflow) of each value.
+    """
+    values = numpy.asarray(values, dtype=float)
+    bins = numpy.floor((values - low)*(nbins/float(high - low))) + 1
+    return numpy.clip(bins, 0, nbins + 1).astype(numpy.int64)
+
+
+def _Weights(values, weights):
+    """
+    Weights as an array the length of values (1 if None).
+    """
+    if weights is None:
+        return numpy.ones(len(values))
+    return numpy.broadcast_to(numpy.asarray(weights, dtype=float),
+                              (len(values),))
+
+
+class Hist1D:
+    """
+    One dimensional histogram, the numpy equivalent of a TH1D.
+    """
+
+    def __init__(self, name, title, nbins, low, high):
+        """
+        Constructor, makes an empty histogram.
+        """
+        self.name = name
+        self.title = title
+        self.nbins = nbins
+        self.low = low
+        self.high = high
+        self.contents = numpy.zeros(nbins + 2)
+        self.sumw2 = numpy.zeros(nbins + 2)
+        self.entries = 0
+        # sum w, sum w^2, sum wx, sum wx^2 of in range entries (as ROOT):
+        self.stats = numpy.zeros(4)
+
+    def fill(self, values, weights=None):
+        """
+        Add an array of values, with optional weights (an array, or
+        one value for all). NaN values are skipped.
+        """
+        values = numpy.asarray(values, dtype=float).ravel()
+        weights = _Weights(values, weights)
+        good = ~numpy.isnan(values)
+        values, weights = values[good], weights[good]
+
+        bins = _Bins(values, self.nbins, self.low, self.high)
+        self.contents += numpy.bincount(bins, weights=weights,
+                                        minlength=self.nbins + 2)
+        self.sumw2 += numpy.bincount(bins, weights=weights*weights,
+                                     minlength=self.nbins + 2)
+        self.entries += len(values)
+
+        inside = (bins > 0) & (bins <= self.nbins)
+        x, w = values[inside], weights[inside]
+        self.stats += [w.sum(), (w*w).sum(), (w*x).sum(), (w*x*x).sum()]
+
+    def Fill(self, value, weight=1.0):
+        """
+        Add a single value, as TH1D.Fill.
+        """
+        self.fill([value], weight)
+
+    def edges(self):
+        """
+        The nbins+1 bin edges.
+        """
+        return numpy.linspace(self.low, self.high, self.nbins + 1)
+
+    def centres(self):
+        """
+        The nbins bin centres.
+        """
+        edges = self.edges()
+        return (edges[1:] + edges[:-1])/2.
+
+    def GetEntries(self):
+        """
+        Number of values filled, as TH1D.GetEntries.
+        """
+        return float(self.entries)
+
+    def merge(self, other):
+        """
+        Add the contents of another histogram of the same binning.
+        """
+        if (self.nbins, self.low, self.high) != \
+                (other.nbins, other.low, other.high):
+            raise ValueError("Can not merge %s and %s, binning differs" %
+                             (self.name, other.name))
+        self.contents += other.contents
+        self.sumw2 += other.sumw2
+        self.entries += other.entries
+        self.stats += other.stats
+
+    def ToTH1D(self, name=None):
+        """
+        Convert to a ROOT TH1D, with contents, errors, entries and
+        statistics.
+        """
+        import ROOT
+
+        hist = ROOT.TH1D(name or self.name, self.title, self.nbins,
+                         self.low, self.high)
+        hist.Sumw2()
+        hist.SetContent(self.contents)
+        hist.GetSumw2().Set(len(self.sumw2), self.sumw2)
+        hist.PutStats(numpy.array(self.stats))
+        hist.SetEntries(self.entries)
+        return hist
+
+
+class Hist2D:
+    """
+    Two dimensional histogram, the numpy equivalent of a TH2D.
+    contents is indexed [x bin, y bin].
+    """
+
+    def __init__(self, name, title, nbinsx, xlow, xhigh, nbinsy, ylow,
+                 yhigh):
+        """
+        Constructor, makes an empty histogram.
+        """
+        self.name = name
+        self.title = title
+        self.xaxis = (nbinsx, xlow, xhigh)
+        self.yaxis = (nbinsy, ylow, yhigh)
+        self.contents = numpy.zeros((nbinsx + 2, nbinsy + 2))
+        self.sumw2 = numpy.zeros((nbinsx + 2, nbinsy + 2))
+        self.entries = 0
+        # sum w, w^2, wx, wx^2, wy, wy^2, wxy of in range entries:
+        self.stats = numpy.zeros(7)
+
+    def fill(self, x, y, weights=None):
+        """
+        Add arrays of x and y values, with optional weights. Pairs
+        with a NaN are skipped.
+        """
+        x = numpy.asarray(x, dtype=float).ravel()
+        y = numpy.asarray(y, dtype=float).ravel()
+        weights = _Weights(x, weights)
+        good = ~(numpy.isnan(x) | numpy.isnan(y))
+        x, y, weights = x[good], y[good], weights[good]
+
+        nx, ny = self.xaxis[0], self.yaxis[0]
+        bx = _Bins(x, *self.xaxis)
+        by = _Bins(y, *self.yaxis)
+        cells = bx*(ny + 2) + by
+        size = (nx + 2)*(ny + 2)
+        self.contents += numpy.bincount(cells, weights=weights,
+                                        minlength=size).reshape(nx + 2,
+                                                                ny + 2)
+        self.sumw2 += numpy.bincount(cells, weights=weights*weights,
+                                     minlength=size).reshape(nx + 2, ny + 2)
+        self.entries += len(x)
+
+        inside = (bx > 0) & (bx <= nx) & (by > 0) & (by <= ny)
+        x, y, w = x[inside], y[inside], weights[inside]
+        self.stats += [w.sum(), (w*w).sum(), (w*x).sum(), (w*x*x).sum(),
+                       (w*y).sum(), (w*y*y).sum(), (w*x*y).sum()]
+
+    def Fill(self, x, y, weight=1.0):
+        """
+        Add a single pair, as TH2D.Fill.
+        """
+        self.fill([x], [y], weight)
+
+    def GetEntries(self):
+        """
+        Number of pairs filled, as TH2D.GetEntries.
+        """
+        return float(self.entries)
+
+    def merge(self, other):
+        """
+        Add the contents of another histogram of the same binning.
+        """
+        if (self.xaxis, self.yaxis) != (other.xaxis, other.yaxis):
+            raise ValueError("Can not merge %s and %s, binning differs" %
+                             (self.name, other.name))
+        self.contents += other.contents
+        self.sumw2 += other.sumw2
+        self.entries += other.entries
+        self.stats += other.stats
+
+    def ToTH2D(self, name=None):
+        """
+        Convert to a ROOT TH2D, with contents, errors, entries and
+        statistics.
+        """
+        import ROOT
+
+        hist = ROOT.TH2D(name or self.name, self.title,
+                         *(self.xaxis + self.yaxis))
+        hist.Sumw2()
+        # ROOT orders the cells x fastest:
+        hist.SetContent(numpy.ascontiguousarray(self.contents.T).ravel())
+        sumw2 = numpy.ascontiguousarray(self.sumw2.T).ravel()
+        hist.GetSumw2().Set(len(sumw2), sumw2)
+        hist.PutStats(numpy.array(self.stats))
+        hist.SetEntries(self.entries)
+        return hist
+
+
+def ToTObjects(objects):
+    """
+    Convert the Hist1D/Hist2D values of a dictionary to ROOT objects,
+    other values are kept.
+    """
+    rval = {}
+    for key, value in objects.items():
+        if isinstance(value, Hist1D):
+            value = value.ToTH1D()
+        elif isinstance(value, Hist2D):
+            value = value.ToTH2D()
+        rval[key] = value
+    return rval
@@ -2,7 +2,6 @@
 Tool to plot the SciFi Event
 """
 
-import ROOT
 import math
 
 
@@ -18,6 +17,8 @@ class PlotSciFiEvent:
         :type name: string
         :param name: "human readable" name to add to each histogram
         """
+        import ROOT
+
         self.prog_xz = True
         self.prog_yz = True
 
@@ -107,12 +108,28 @@ class PlotSciFiEvent:
             tg_zt = getattr(self, "tgpr_%s_%s_%s_%s" % (tracker, track, "zphi", typ))
             tg_zt.SetPoint(tg_zt.GetN(), pos.z(), phi)
 
-    def draw(self):
+    def draw(self, canvas=None):
         """
         Function to cause drawing of the plots...
+
+        :type canvas: ROOT.TCanvas
+        :param canvas: Optional canvas to reuse, otherwise a new one is made.
         """
+        import ROOT
 
-        self.c = ROOT.TCanvas("c", "c", 1024, 768)
+        # Detach the graphs from any previous draw, the multigraphs own
+        # their graphs and would delete them when replaced.
+        for tracker in ["us", "ds"]:
+            for prj in ["xy", "zx", "zy"]:
+                old_mg = getattr(self, "mg_%s_%s" % (tracker, prj), None)
+                if old_mg is not None and old_mg.GetListOfGraphs():
+                    old_mg.GetListOfGraphs().Clear()
+
+        if canvas is None:
+            self.c = ROOT.TCanvas("c", "c", 1024, 768)
+        else:
+            self.c = canvas
+            self.c.Clear()
 
         self.c.Divide(3, 2)
 
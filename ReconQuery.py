@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+Queries over the flattened recon tables of a run (a ColumnarEvents
+store), so ad-hoc questions need no event loop.
+
+Row filters and event level selections (e.g. a TOF01 window) are
+evaluated as numpy masks, and the result returned as arrays, counts
+per group or Hist1D/Hist2D histograms:
+
+store = OpenRun("columns", 8681, "08681_recon.root")
+q = Query(store, "spacepoints").where(tracker=1, station=5, nchannels=2,
+                                      used=False).tof_window("tof01",
+                                                             29.5, 31)
+q.count()
+q.count_by("station")
+q.histogram("npe", 30, -0.5, 29.5)
+"""
+
+import os
+import argparse
+
+import numpy
+
+from ColumnarEvents import ColumnarEvents, ColumnarWriter
+from TOFTools import TimeWindowHit
+from Histograms import Hist1D, Hist2D
+
+
+def OpenRun(cache_dir, run, infile=None):
+    """
+    Open the store of a run in cache_dir, extracting it from infile
+    (a recon file) the first time.
+    """
+    path = os.path.join(cache_dir, "%05i" % run)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        if infile is None:
+            raise LookupError("Run %i is not in %s" % (run, cache_dir))
+        import ROOT
+        import libMausCpp  # pylint: disable = W0611
+
+        root_file = ROOT.TFile(infile, "READ")  # pylint: disable = E1101
+        tree = root_file.Get("Spill")
+        data = ROOT.MAUS.Data()  # pylint: disable = E1101
+        tree.SetBranchAddress("data", data)
+        writer = ColumnarWriter(path)
+        for i in range(tree.GetEntries()):
+            tree.GetEntry(i)
+            spill = data.GetSpill()
+            if spill.GetDaqEventType() == "physics_event":
+                writer.add_spill(spill)
+        writer.close()
+        root_file.Close()
+    return ColumnarEvents(path)
+
+
+def _Condition(column, value):
+    """
+    Mask of a column equal to value, or in value if it is a list,
+    tuple or set.
+    """
+    if isinstance(value, (list, tuple, set)):
+        return numpy.in1d(column, list(value))
+    return column == value
+
+
+def _RowEvents(store, table, rows):
+    """
+    Event number of rows of a table, digits take the event of their
+    cluster.
+    """
+    if table == "events":
+        return rows
+    if table == "digits":
+        offsets = store.column("clusters", "digit_offsets")
+        clusters = numpy.searchsorted(offsets, rows, side="right") - 1
+        return store.column("clusters", "event")[clusters]
+    return store.column(table, "event")[rows]
+
+
+class Query:
+    """
+    A selection of the rows of one table of a store. Each method
+    returns a new Query, so partial queries can be reused.
+    """
+
+    def __init__(self, store, table, filters=(), event_filters=()):
+        """
+        Constructor, selects every row of the table.
+        """
+        self.store = store
+        self.table = table
+        self.filters = tuple(filters)
+        self.event_filters = tuple(event_filters)
+
+    def _extend(self, filters=(), event_filters=()):
+        """
+        Copy with extra filters.
+        """
+        return Query(self.store, self.table, self.filters + tuple(filters),
+                     self.event_filters + tuple(event_filters))
+
+    def where(self, **conditions):
+        """
+        Rows with column == value (or in value, for a list) for each
+        column=value given.
+        """
+        return self._extend([((column,), lambda c, v=value: _Condition(c, v))
+                             for column, value in conditions.items()])
+
+    def between(self, column, low=None, high=None):
+        """
+        Rows with low <= column < high (either may be None).
+        """
+        def in_range(values):
+            mask = numpy.ones(len(values), dtype=bool)
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values < high
+            return mask
+        return self._extend([((column,), in_range)])
+
+    def mask(self, function, *columns):
+        """
+        Rows where function(*columns) is True.
+        """
+        return self._extend([(columns, function)])
+
+    def events_where(self, table, **conditions):
+        """
+        Only rows of events with at least one row of table (which may
+        be "events" for the per event columns) passing conditions.
+        """
+        sub = Query(self.store, table).where(**conditions)
+        return self._extend(event_filters=[sub.event_mask])
+
+    def events_with(self, query):
+        """
+        Only rows of events with at least one row selected by another
+        query.
+        """
+        return self._extend(event_filters=[query.event_mask])
+
+    def tof_window(self, name, low_ns, high_ns):
+        """
+        Only rows of events with a TOF time (name is "tof01" or
+        "tof12") in (low_ns, high_ns), as TOFTools.TOF01CoincidenceTime.
+        """
+        def window():
+            pairs = self.store.gather(name)
+            return TimeWindowHit(pairs["event"], pairs["time"],
+                                 self.store.n_events, low_ns, high_ns)
+        return self._extend(event_filters=[window])
+
+    def selected_events(self):
+        """
+        Boolean mask of the events passing the event selections.
+        """
+        events = numpy.ones(self.store.n_events, dtype=bool)
+        for event_filter in self.event_filters:
+            events &= event_filter()
+        return events
+
+    def rows(self):
+        """
+        The selected rows of the table.
+        """
+        rows = self.store.rows(self.table, self.selected_events())
+        needed = sorted(set(c for columns, f in self.filters
+                            for c in columns))
+        data = self.store.gather(self.table, rows=rows, columns=needed)
+        keep = numpy.ones(len(rows), dtype=bool)
+        for columns, function in self.filters:
+            keep &= function(*[data[c] for c in columns])
+        return rows[keep]
+
+    def event_mask(self):
+        """
+        Boolean mask of the events with at least one selected row.
+        """
+        events = _RowEvents(self.store, self.table, self.rows())
+        return numpy.bincount(events, minlength=self.store.n_events) > 0
+
+    def arrays(self, columns=None):
+        """
+        The columns (all if None) of the selected rows, with "row".
+        """
+        rows = self.rows()
+        arrays = self.store.gather(self.table, rows=rows, columns=columns)
+        arrays["row"] = rows
+        return arrays
+
+    def count(self):
+        """
+        Number of selected rows.
+        """
+        return len(self.rows())
+
+    def count_by(self, *columns):
+        """
+        Number of selected rows per value of the columns, as a dict
+        keyed by value (or tuple of values).
+        """
+        data = self.arrays(list(columns))
+        keys = numpy.rec.fromarrays([data[c] for c in columns])
+        values, counts = numpy.unique(keys, return_counts=True)
+        if len(columns) == 1:
+            return {v[0]: int(n) for v, n in zip(values.tolist(), counts)}
+        return {tuple(v): int(n) for v, n in zip(values.tolist(), counts)}
+
+    def sum_by(self, column, *by):
+        """
+        Sum of a column per value of the by columns, as count_by.
+        """
+        data = self.arrays([column] + list(by))
+        keys = numpy.rec.fromarrays([data[c] for c in by])
+        values, inverse = numpy.unique(keys, return_inverse=True)
+        sums = numpy.bincount(inverse, weights=data[column],
+                              minlength=len(values))
+        if len(by) == 1:
+            return {v[0]: s for v, s in zip(values.tolist(), sums)}
+        return {tuple(v): s for v, s in zip(values.tolist(), sums)}
+
+    def histogram(self, column, nbins, low, high, name=None, weights=None):
+        """
+        Hist1D of a column of the selected rows, optionally weighted
+        by another column.
+        """
+        columns = [column] + ([weights] if weights else [])
+        data = self.arrays(columns)
+        name = name or "%s_%s" % (self.table, column)
+        hist = Hist1D(name, name, nbins, low, high)
+        hist.fill(data[column], data[weights] if weights else None)
+        return hist
+
+    def histogram2d(self, x, y, xbins, ybins, name=None):
+        """
+        Hist2D of two columns, xbins and ybins are (nbins, low, high).
+        """
+        data = self.arrays([x, y])
+        name = name or "%s_%s_%s" % (self.table, y, x)
+        hist = Hist2D(name, name, *(tuple(xbins) + tuple(ybins)))
+        hist.fill(data[x], data[y])
+        return hist
+
+
+def _ParseCondition(text):
+    """
+    "column=value" or "column=v1,v2" to (column, value).
+    """
+    column, value = text.split("=")
+    values = [float(v) if "." in v else int(v) for v in value.split(",")]
+    return column, values[0] if len(values) == 1 else values
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store", help="a ColumnarEvents directory", type=str)
+    parser.add_argument("table", help="table to query", type=str)
+    parser.add_argument("--where", help="conditions, e.g. tracker=1 "
+                        "station=4,5 used=0", type=str, nargs="*",
+                        default=[])
+    parser.add_argument("--tof01", help="TOF01 window low:high (ns)",
+                        type=str, default=None)
+    parser.add_argument("--count-by", help="columns to count by", type=str,
+                        nargs="*", default=None)
+    parser.add_argument("--hist", help="column:nbins:low:high", type=str,
+                        default=None)
+    args = parser.parse_args()
+
+    query = Query(ColumnarEvents(args.store), args.table)
+    query = query.where(**dict(_ParseCondition(c) for c in args.where))
+    if args.tof01:
+        low, high = [float(v) for v in args.tof01.split(":")]
+        query = query.tof_window("tof01", low, high)
+
+    print "Selected %i rows" % query.count()
+    if args.count_by:
+        for key, count in sorted(query.count_by(*args.count_by).items()):
+            print key, count
+    if args.hist:
+        column, nbins, low, high = args.hist.split(":")
+        hist = query.histogram(column, int(nbins), float(low), float(high))
+        for centre, content in zip(hist.centres(), hist.contents[1:-1]):
+            print "%8.2f %10.1f" % (centre, content)
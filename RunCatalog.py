@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""
+Local catalog of runs and their recon files, to select datasets by
+beamline optics tag without opening files or querying the CDB.
+
+catalog = RunCatalog("runs.db")
+catalog.add_records(BeamlineCache().get_records(start_date, end_date))
+catalog.add_files(["/home/ed/MICE/data/cooling/08681_recon.root"])
+infiles = catalog.query(optics="...", min_run_time=900)
+chain = catalog.make_chain(infiles)
+"""
+
+import os
+import re
+import sqlite3
+import argparse
+from datetime import datetime
+
+from BeamlineTools import SCALAR_KEYS
+
+# Column names for the beamline scalars:
+SCALAR_COLUMNS = [k.lower().replace(" ", "_") for k in SCALAR_KEYS]
+
+
+def _FirstRunNumber(tree):
+    """
+    Run number of the first spill of a Spill tree, None if empty.
+    """
+    import ROOT
+    import libMausCpp  # pylint: disable = W0611
+
+    if tree.GetEntries() == 0:
+        return None
+    data = ROOT.MAUS.Data()  # pylint: disable = E1101
+    tree.SetBranchAddress("data", data)
+    tree.GetEntry(0)
+    return data.GetSpill().GetRunNumber()
+
+
+class RunCatalog:
+    """
+    sqlite catalog holding the beamline record of each run, and the
+    path, entry count and size of each recon file.
+    """
+
+    def __init__(self, db_path="run_catalog.db"):
+        """
+        Constructor, opens (or creates) the catalog.
+        """
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS runs ("
+                        "run_number INTEGER PRIMARY KEY, optics TEXT, "
+                        "start_time REAL, end_time REAL, run_time REAL, "
+                        "target_dips REAL, %s)" %
+                        ", ".join("%s REAL" % c for c in SCALAR_COLUMNS))
+        self.db.execute("CREATE TABLE IF NOT EXISTS files ("
+                        "path TEXT PRIMARY KEY, run_number INTEGER, "
+                        "entries INTEGER, size INTEGER, mtime REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS runs_optics "
+                        "ON runs (optics)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_run "
+                        "ON files (run_number)")
+        self.db.commit()
+
+    def add_records(self, records):
+        """
+        Insert or update beamline records, as produced by
+        BeamlineTools.BeamlineCache.
+        """
+        columns = ["run_number", "optics", "start_time", "end_time",
+                   "run_time", "target_dips"] + SCALAR_COLUMNS
+        rows = []
+        for r in records:
+            rows.append([r["run_number"], r["optics"], r["start_time"],
+                         r["end_time"], r["end_time"] - r["start_time"],
+                         r["target_dips"]] + [r[k] for k in SCALAR_KEYS])
+        self.db.executemany("INSERT OR REPLACE INTO runs (%s) VALUES (%s)" %
+                            (", ".join(columns), ", ".join("?"*len(columns))),
+                            rows)
+        self.db.commit()
+
+    def add_files(self, paths, run_number=None):
+        """
+        Insert or update recon files. Files unchanged since they were
+        added are skipped. The run number is taken from the file name
+        (e.g. 08681_recon.root) unless given, or else from the first
+        spill of the file. Unreadable files are skipped with a warning.
+        """
+        import ROOT
+
+        for path in paths:
+            path = os.path.abspath(path)
+            size = os.path.getsize(path)
+            mtime = os.path.getmtime(path)
+            known = self.db.execute("SELECT size, mtime FROM files "
+                                    "WHERE path = ?", (path,)).fetchone()
+            if known is not None and tuple(known) == (size, mtime):
+                continue
+
+            root_file = ROOT.TFile(path, "READ")  # pylint: disable = E1101
+            tree = root_file.Get("Spill") if not root_file.IsZombie() \
+                else None
+            if not tree:
+                print "Skipping zombie file or file with no Spill tree: ", \
+                    path
+                root_file.Close()
+                continue
+            entries = tree.GetEntries()
+
+            run = run_number
+            if run is None:
+                match = re.match(r"\d+", os.path.basename(path))
+                if match is not None:
+                    run = int(match.group(0))
+                else:
+                    run = _FirstRunNumber(tree)
+            root_file.Close()
+            if run is None:
+                print "Skipping file with no run number: ", path
+                continue
+
+            print "Cataloged file: ", path, run, entries
+            self.db.execute("INSERT OR REPLACE INTO files VALUES "
+                            "(?, ?, ?, ?, ?)",
+                            (path, run, entries, size, mtime))
+        self.db.commit()
+
+    def query(self, optics=None, min_run_time=None, min_run=None,
+              max_run=None):
+        """
+        Return the paths of all files matching the selection,
+        ordered by run number.
+        """
+        conditions, params = [], []
+        if optics is not None:
+            conditions.append("runs.optics = ?")
+            params.append(optics)
+        if min_run_time is not None:
+            conditions.append("runs.run_time > ?")
+            params.append(min_run_time)
+        if min_run is not None:
+            conditions.append("files.run_number >= ?")
+            params.append(min_run)
+        if max_run is not None:
+            conditions.append("files.run_number <= ?")
+            params.append(max_run)
+
+        sql = "SELECT files.path FROM files LEFT JOIN runs " \
+              "ON files.run_number = runs.run_number"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY files.run_number, files.path"
+
+        return [str(row[0]) for row in self.db.execute(sql, params)]
+
+    def get_entries(self, path):
+        """
+        Return the cataloged number of entries of a file.
+        """
+        row = self.db.execute("SELECT entries FROM files WHERE path = ?",
+                              (os.path.abspath(path),)).fetchone()
+        if row is None:
+            raise LookupError("%s is not in the catalog" % path)
+        return row[0]
+
+    def make_chain(self, paths):
+        """
+        Build a TChain of the files, the cataloged entry counts are
+        given to the chain so the files are not opened here.
+        """
+        import ROOT
+
+        chain = ROOT.TChain("Spill")
+        for path in paths:
+            chain.AddFile(path, self.get_entries(path))
+        return chain
+
+    def tags(self):
+        """
+        Return (optics, number of runs, total run time) for each tag.
+        """
+        return self.db.execute("SELECT optics, COUNT(*), SUM(run_time) "
+                               "FROM runs GROUP BY optics "
+                               "ORDER BY optics").fetchall()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db_path", help="the catalog database", type=str)
+    parser.add_argument("--dates", help="add beamline records from the CDB"
+                        " (or beamline cache) between two dates YYYY-MM-DD",
+                        type=str, nargs=2)
+    parser.add_argument("--files", help="add recon files to the catalog",
+                        type=str, nargs="+")
+    parser.add_argument("--optics", help="select runs with an optics tag",
+                        type=str)
+    parser.add_argument("--min-run-time", help="select runs longer than (s)",
+                        type=float)
+    args = parser.parse_args()
+
+    catalog = RunCatalog(args.db_path)
+
+    if args.dates is not None:
+        from BeamlineTools import BeamlineCache
+        start_date, end_date = [datetime.strptime(d, "%Y-%m-%d")
+                                for d in args.dates]
+        catalog.add_records(BeamlineCache().get_records(start_date, end_date))
+
+    if args.files is not None:
+        catalog.add_files(args.files)
+
+    if args.optics is None and args.min_run_time is None:
+        for optics, n_runs, run_time in catalog.tags():
+            print "%20s %5i runs %8.1f hours" % (optics, n_runs,
+                                                 (run_time or 0)/3600.)
+    else:
+        for path in catalog.query(optics=args.optics,
+                                  min_run_time=args.min_run_time):
+            print path
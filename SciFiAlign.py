@@ -5,8 +5,6 @@ Quick script for checking the alignment of the detector internals
 using pattern recognition..
 """
 
-import ROOT
-import libMausCpp  # pylint: disable = W0611
 import math
 import TOFTools
 import os
@@ -20,6 +18,8 @@ class SciFiAlign:
 
     def __init__(self):
 
+        import ROOT
+
         # Generate histogram objects to store residuals in each
         # station:
         self.tknames = ["us", "ds"]
@@ -94,6 +94,7 @@ class SciFiAlign:
         Process the collected data to obtain an estimate for alignment
         at each station
         """
+        import ROOT
 
         for tk in self.tknames:
             for res in self.residuals:
@@ -151,6 +152,8 @@ class SciFiAlign:
         """
         Draw a single residual
         """
+        import ROOT
+
         hist = getattr(self, "res_%s_%i_%s" % (tkname, station, resname))
         prof = getattr(self, "resp_%s_%i_%s" % (tkname, station, resname))
         fit = getattr(self, "resf_%s_%i_%s" % (tkname, station, resname))
@@ -167,6 +170,9 @@ class SciFiAlign:
 
 if __name__ == "__main__":
 
+    import ROOT
+    import libMausCpp  # pylint: disable = W0611
+
     #infiles = ["/home/ed/MICE/data/08666_recon.root"]  # 170mev
 
     # bad 140mev data
@@ -0,0 +1,341 @@
+"""
+Extraction of SciFi recon objects into flat numpy arrays, so that
+analyses can be done on whole spills at once rather than object by
+object.
+
+Each function takes a sequence of recon events (e.g.
+spill.GetReconEvents()) and returns a dictionary of equal length
+arrays, with an "event" array holding the position of the recon event
+in the sequence.
+"""
+
+import numpy
+
+N_Tracker = 2
+N_Station = 5
+N_Plane = 3
+N_Channel = 216
+
+N_PlaneIDs = N_Tracker*N_Station*N_Plane
+N_StationIDs = N_Tracker*N_Station
+N_ChannelRefs = N_PlaneIDs*N_Channel
+
+
+def PlaneID(tracker, station, plane):
+    """
+    Unique plane number, (tracker)*15 + (station-1)*3 + plane.
+    """
+    return N_Plane*(N_Station*tracker + station - 1) + plane
+
+
+def ChannelRef(tracker, station, plane, channel):
+    """
+    Unique channel number, as FrontEndLookup._get1dref.
+    """
+    return channel + N_Channel*PlaneID(tracker, station, plane)
+
+
+def StationID(tracker, station):
+    """
+    Unique station number, (tracker)*5 + station-1.
+    """
+    return N_Station*tracker + station - 1
+
+
+def _ToArrays(columns, dtypes):
+    """
+    Convert a dictionary of lists into arrays of the given types.
+    """
+    return {key: numpy.array(columns[key], dtype=dtypes[key])
+            for key in columns}
+
+
+def ClusterArrays(recon_events):
+    """
+    Extract every cluster of the recon events.
+    """
+    dtypes = {"event": numpy.int32, "tracker": numpy.int8,
+              "station": numpy.int8, "plane": numpy.int8,
+              "channel": numpy.float64, "npe": numpy.float64,
+              "ndigits": numpy.int16, "used": bool}
+    columns = {key: [] for key in dtypes}
+
+    for event, recon_event in enumerate(recon_events):
+        for cluster in recon_event.GetSciFiEvent().clusters():
+            columns["event"].append(event)
+            columns["tracker"].append(cluster.get_tracker())
+            columns["station"].append(cluster.get_station())
+            columns["plane"].append(cluster.get_plane())
+            columns["channel"].append(cluster.get_channel())
+            columns["npe"].append(cluster.get_npe())
+            columns["ndigits"].append(cluster.get_digits().GetEntries())
+            columns["used"].append(cluster.is_used())
+
+    return _ToArrays(columns, dtypes)
+
+
+def SpacePointArrays(recon_events):
+    """
+    Extract every spacepoint of the recon events, nchannels is the
+    number of clusters (2 for duplets, 3 for triplets), plane_sum and
+    channel_sum are the sums over its clusters.
+    """
+    dtypes = {"event": numpy.int32, "tracker": numpy.int8,
+              "station": numpy.int8, "nchannels": numpy.int8,
+              "npe": numpy.float64, "x": numpy.float64,
+              "y": numpy.float64, "z": numpy.float64, "used": bool,
+              "plane_sum": numpy.int8, "channel_sum": numpy.float64}
+    columns = {key: [] for key in dtypes}
+
+    for event, recon_event in enumerate(recon_events):
+        for sp in recon_event.GetSciFiEvent().spacepoints():
+            pos = sp.get_position()
+            plane_sum, channel_sum = 0, 0.0
+            for cluster in sp.get_channels():
+                plane_sum += cluster.get_plane()
+                channel_sum += cluster.get_channel()
+            columns["event"].append(event)
+            columns["tracker"].append(sp.get_tracker())
+            columns["station"].append(sp.get_station())
+            columns["nchannels"].append(len(sp.get_channels()))
+            columns["plane_sum"].append(plane_sum)
+            columns["channel_sum"].append(channel_sum)
+            columns["npe"].append(sp.get_npe())
+            columns["x"].append(pos.x())
+            columns["y"].append(pos.y())
+            columns["z"].append(pos.z())
+            columns["used"].append(sp.is_used())
+
+    return _ToArrays(columns, dtypes)
+
+
+def SpacePointDigitArrays(recon_events):
+    """
+    Extract every digit of the clusters of every spacepoint, with the
+    number of clusters in the spacepoint (nchannels).
+    """
+    dtypes = {"event": numpy.int32, "tracker": numpy.int8,
+              "station": numpy.int8, "plane": numpy.int8,
+              "channel": numpy.int16, "npe": numpy.float64,
+              "adc": numpy.int16, "nchannels": numpy.int8}
+    columns = {key: [] for key in dtypes}
+
+    for event, recon_event in enumerate(recon_events):
+        for sp in recon_event.GetSciFiEvent().spacepoints():
+            nchannels = len(sp.get_channels())
+            for cluster in sp.get_channels():
+                for digit in cluster.get_digits():
+                    columns["event"].append(event)
+                    columns["tracker"].append(sp.get_tracker())
+                    columns["station"].append(sp.get_station())
+                    columns["plane"].append(digit.get_plane())
+                    columns["channel"].append(digit.get_channel())
+                    columns["npe"].append(digit.get_npe())
+                    columns["adc"].append(digit.get_adc())
+                    columns["nchannels"].append(nchannels)
+
+    return _ToArrays(columns, dtypes)
+
+
+def SpacePointClusterArrays(recon_events):
+    """
+    Extract the clusters of every spacepoint, sp is the index of the
+    spacepoint in SpacePointArrays. The digits of cluster i are
+    digit_*[digit_offsets[i]:digit_offsets[i+1]].
+    """
+    dtypes = {"event": numpy.int32, "sp": numpy.int32,
+              "tracker": numpy.int8, "station": numpy.int8,
+              "plane": numpy.int8, "channel": numpy.float64,
+              "nchannels": numpy.int8,
+              "digit_channel": numpy.int16, "digit_npe": numpy.float64,
+              "digit_adc": numpy.int16}
+    columns = {key: [] for key in dtypes}
+    n_digits = [0]
+
+    sp_index = 0
+    for event, recon_event in enumerate(recon_events):
+        for sp in recon_event.GetSciFiEvent().spacepoints():
+            nchannels = len(sp.get_channels())
+            for cluster in sp.get_channels():
+                columns["event"].append(event)
+                columns["sp"].append(sp_index)
+                columns["tracker"].append(sp.get_tracker())
+                columns["station"].append(sp.get_station())
+                columns["plane"].append(cluster.get_plane())
+                columns["channel"].append(cluster.get_channel())
+                columns["nchannels"].append(nchannels)
+                for digit in cluster.get_digits():
+                    columns["digit_channel"].append(digit.get_channel())
+                    columns["digit_npe"].append(digit.get_npe())
+                    columns["digit_adc"].append(digit.get_adc())
+                n_digits.append(len(columns["digit_npe"]))
+            sp_index += 1
+
+    arrays = _ToArrays(columns, dtypes)
+    arrays["digit_offsets"] = numpy.array(n_digits, dtype=numpy.int64)
+    return arrays
+
+
+def PRTrackArrays(recon_events):
+    """
+    Extract every straight and helical pattern recognition track.
+    Straight tracks fill x0, y0, mx, my and helical tracks fill
+    circle_x0, circle_y0, R, dsdz, line_sz_c, the others are 0.
+    """
+    dtypes = {"event": numpy.int32, "tracker": numpy.int8,
+              "helical": bool, "nsp": numpy.int8}
+    params = ["x0", "y0", "mx", "my", "circle_x0", "circle_y0", "R",
+              "dsdz", "line_sz_c"]
+    for key in params:
+        dtypes[key] = numpy.float64
+    columns = {key: [] for key in dtypes}
+
+    for event, recon_event in enumerate(recon_events):
+        scifi_event = recon_event.GetSciFiEvent()
+        for helical, tracks in [(False, scifi_event.straightprtracks()),
+                                (True, scifi_event.helicalprtracks())]:
+            for track in tracks:
+                columns["event"].append(event)
+                columns["tracker"].append(track.get_tracker())
+                columns["helical"].append(helical)
+                columns["nsp"].append(len(track.get_spacepoints()))
+                if helical:
+                    values = [0, 0, 0, 0, track.get_circle_x0(),
+                              track.get_circle_y0(), track.get_R(),
+                              track.get_dsdz(), track.get_line_sz_c()]
+                else:
+                    values = [track.get_x0(), track.get_y0(),
+                              track.get_mx(), track.get_my(),
+                              0, 0, 0, 0, 0]
+                for key, value in zip(params, values):
+                    columns[key].append(value)
+
+    return _ToArrays(columns, dtypes)
+
+
+def HelicalResidualArrays(recon_events):
+    """
+    Spacepoint residuals of the helical tracks used by
+    SciFiAlign.fill, i.e. the only track in its tracker, with one
+    spacepoint in each of the 5 stations. x_res and y_res are the
+    spacepoint position minus the helix position at its z.
+    """
+    dtypes = {"event": numpy.int32, "tracker": numpy.int8,
+              "station": numpy.int8, "x": numpy.float64,
+              "y": numpy.float64, "x_res": numpy.float64,
+              "y_res": numpy.float64}
+    columns = {key: [] for key in dtypes}
+
+    for event, recon_event in enumerate(recon_events):
+        scifi_event = recon_event.GetSciFiEvent()
+        n_tracks = [0]*N_Tracker
+        helical = [None]*N_Tracker
+        for track in scifi_event.straightprtracks():
+            n_tracks[track.get_tracker()] += 1
+        for track in scifi_event.helicalprtracks():
+            n_tracks[track.get_tracker()] += 1
+            helical[track.get_tracker()] = track
+
+        for tracker in range(N_Tracker):
+            track = helical[tracker]
+            if n_tracks[tracker] != 1 or track is None:
+                continue
+            sps = track.get_spacepoints()
+            if len(sps) != 5 or sum(sp.get_station() for sp in sps) != 15:
+                continue
+
+            radius = track.get_R()
+            for sp in sps:
+                pos = sp.get_position()
+                phi = (pos.z()*track.get_dsdz() + track.get_line_sz_c())/radius
+                columns["event"].append(event)
+                columns["tracker"].append(tracker)
+                columns["station"].append(sp.get_station())
+                columns["x"].append(pos.x())
+                columns["y"].append(pos.y())
+                columns["x_res"].append(pos.x() - track.get_circle_x0() -
+                                        radius*numpy.cos(phi))
+                columns["y_res"].append(pos.y() - track.get_circle_y0() -
+                                        radius*numpy.sin(phi))
+
+    return _ToArrays(columns, dtypes)
+
+
+def TrackRadiusAtZ(tracks, z):
+    """
+    Radius of PRTrackArrays tracks at z (tracker coordinates), lines
+    for straight tracks and helices (as in SciFiAlign) for helical.
+    """
+    x = tracks["x0"] + z*tracks["mx"]
+    y = tracks["y0"] + z*tracks["my"]
+
+    helical = tracks["helical"]
+    radius = tracks["R"][helical]
+    phi = (tracks["dsdz"][helical]*z + tracks["line_sz_c"][helical])/radius
+    x[helical] = tracks["circle_x0"][helical] + radius*numpy.cos(phi)
+    y[helical] = tracks["circle_y0"][helical] + radius*numpy.sin(phi)
+
+    return numpy.sqrt(x*x + y*y)
+
+
+def CountPerEvent(event, group, n_events, n_groups, mask=None):
+    """
+    Count entries per (event, group), returns an array of shape
+    (n_events, n_groups).
+    """
+    cell = event.astype(numpy.int64)*n_groups + group
+    if mask is not None:
+        cell = cell[mask]
+    return numpy.bincount(cell, minlength=n_events*n_groups)\
+        .reshape(n_events, n_groups)
+
+
+def KunoTotal(tracker, station):
+    """
+    Expected sum of the channel numbers of a triplet (see
+    SciFiTools.MissingFromDuplet), for arrays of tracker and station.
+    """
+    return numpy.where((tracker == 1) & (station == 5), 319.5, 318.0)
+
+
+def ExpandRanges(lo, hi):
+    """
+    For ranges [lo, hi) return (owner, index) with one entry per
+    element of every range, owner is the position of the range.
+    """
+    n = numpy.maximum(hi - lo, 0)
+    owner = numpy.repeat(numpy.arange(len(lo)), n)
+    first = numpy.cumsum(n) - n
+    index = numpy.repeat(lo, n) + numpy.arange(n.sum()) - \
+        numpy.repeat(first, n)
+    return owner, index
+
+
+def KeyJoin(keys_a, keys_b):
+    """
+    Return index arrays (ia, ib) of all pairs with keys_a[ia] ==
+    keys_b[ib], found by sorting and searching rather than looping.
+    """
+    order = numpy.argsort(keys_b, kind="mergesort")
+    sorted_b = keys_b[order]
+    lo = numpy.searchsorted(sorted_b, keys_a, "left")
+    hi = numpy.searchsorted(sorted_b, keys_a, "right")
+    ia, index = ExpandRanges(lo, hi)
+    return ia, order[index]
+
+
+def StationHits(spacepoints, n_events, mask=None):
+    """
+    Boolean arrays (n_events, 10) of whether each station has a
+    triplet, and a duplet, spacepoint.
+    """
+    station_id = StationID(spacepoints["tracker"].astype(int),
+                           spacepoints["station"])
+    triplet = spacepoints["nchannels"] == 3
+    if mask is None:
+        mask = numpy.ones(len(triplet), dtype=bool)
+    triplets = CountPerEvent(spacepoints["event"], station_id, n_events,
+                             N_StationIDs, mask & triplet) > 0
+    duplets = CountPerEvent(spacepoints["event"], station_id, n_events,
+                            N_StationIDs, mask & ~triplet) > 0
+    return triplets, duplets
@@ -0,0 +1,260 @@
+"""
+Bootstrap uncertainties on the station spacepoint efficiencies.
+
+The counts and light yield histograms used by
+SciFiTools.StationSpacePointEfficiency are stored per spill for all 10
+stations, as one small integer array per spill. Replicas are made by
+giving every spill a Poisson(1) weight and summing the partials, and
+the whole efficiency chain (including the template noise fit, done in
+numpy) is recomputed for every replica in worker processes, so the
+data never has to be read again.
+
+boot = StationEfficiencyBootstrap()
+for each spill:
+    boot.fill_arrays(spacepoints, sp_clusters, cluster_npe, event_mask)
+effs = boot.bootstrap(n_replicas=500)     # (500, 10)
+"""
+
+import multiprocessing
+
+import numpy
+
+from SciFiArrays import StationID, N_StationIDs
+
+# Layout of the per station partial counts:
+EVENTS, TRIPLETS, DOUBLETS, NOTHING = range(4)
+N_COUNTS = 4
+
+
+def _NoiseSlopes():
+    """
+    Default grid of slopes of the exponential noise term.
+    """
+    return numpy.linspace(-2.0, 0.5, 251)
+
+
+def StationEfficiencies(partials, centres, fit_low=2, fit_high=25,
+                        slopes=None):
+    """
+    Efficiency of every station from summed partials of shape
+    (..., 10, 4 + 2*(nbins+2)), as StationSpacePointEfficiency.compute.
+
+    The doublet light yield is fitted with p0*triplet + p1*exp(p3*x)
+    over the bins with centres in [fit_low, fit_high], weighting bins
+    by 1/content and skipping empty bins as in a default ROOT chi2 fit.
+    p0 and p1 are solved for every slope p3 of the grid, and the best
+    slope taken.
+
+    Returns the efficiencies (..., 10), 0 for stations without events.
+    """
+    if slopes is None:
+        slopes = _NoiseSlopes()
+    partials = numpy.asarray(partials, dtype=float)
+    nbins = len(centres)
+    counts = partials[..., :N_COUNTS]
+    triplet_ly = partials[..., N_COUNTS:N_COUNTS + nbins + 2]
+    doublet_ly = partials[..., N_COUNTS + nbins + 2:]
+
+    in_range = (centres >= fit_low) & (centres <= fit_high)
+    tpl = triplet_ly[..., 1:-1][..., in_range]
+    dat = doublet_ly[..., 1:-1][..., in_range]
+    x = centres[in_range]
+    weight = numpy.where(dat > 0, 1.0/numpy.maximum(dat, 1), 0.0)
+
+    # Exponential shapes (n_slopes, n_fit_bins):
+    expo = numpy.exp(slopes[:, numpy.newaxis]*x[numpy.newaxis, :])
+
+    s_tt = (weight*tpl*tpl).sum(axis=-1)[..., numpy.newaxis]
+    s_dt = (weight*dat*tpl).sum(axis=-1)[..., numpy.newaxis]
+    s_ee = numpy.dot(weight, (expo*expo).T)
+    s_te = numpy.dot(weight*tpl, expo.T)
+    s_de = numpy.dot(weight*dat, expo.T)
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        det = s_tt*s_ee - s_te*s_te
+        p0 = (s_dt*s_ee - s_de*s_te)/det
+        p1 = (s_tt*s_de - s_te*s_dt)/det
+        chi2 = -(p0*s_dt + p1*s_de)
+    chi2 = numpy.where(numpy.isfinite(chi2), chi2, numpy.inf)
+    chi2 = chi2.reshape(-1, len(slopes))
+    best = chi2.argmin(axis=1)
+    fraction = p0.reshape(-1, len(slopes))[numpy.arange(len(best)), best]\
+        .reshape(p0.shape[:-1])
+    fraction = numpy.where(numpy.isfinite(fraction), fraction, 0.0)
+
+    # Estimate real duplets from the integral of the template:
+    events = counts[..., EVENTS]
+    n_duplets = triplet_ly.sum(axis=-1)*fraction/2.
+    n_real = numpy.clip(counts[..., TRIPLETS] + n_duplets, 0,
+                        numpy.maximum(events, 0))
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return numpy.where(events > 0, n_real/events, 0.0)
+
+
+def _BootstrapChunk(task):
+    """
+    Efficiencies of n_replicas Poisson weighted sums of the spill
+    partials.
+    """
+    partials, centres, n_replicas, seed = task
+    rng = numpy.random.RandomState(seed)
+    weights = rng.poisson(1.0, (n_replicas, len(partials)))
+    summed = numpy.tensordot(weights, partials, axes=(1, 0))
+    return StationEfficiencies(summed, centres)
+
+
+class StationEfficiencyBootstrap:
+    """
+    Per spill partial counts and light yield histograms for all
+    stations, indexed by SciFiArrays.StationID, with bootstrap
+    resampling of the station efficiencies.
+    """
+
+    def __init__(self, nbins=30, low=-0.5, high=29.5):
+        """
+        Constructor, no spills added.
+        """
+        self.edges = numpy.linspace(low, high, nbins + 1)
+        self.centres = (self.edges[1:] + self.edges[:-1])/2.
+        self.width = N_COUNTS + 2*(nbins + 2)
+        self.partials = []
+
+    def _ly_bins(self, npe):
+        """
+        Histogram bin of each npe, 0 is the underflow and nbins+1 the
+        overflow (as ROOT).
+        """
+        return numpy.searchsorted(self.edges, npe, "right")
+
+    def fill_arrays(self, spacepoints, sp_clusters, cluster_npe,
+                    event_mask):
+        """
+        Store the partials of one spill, arguments as
+        StationSpacePointEfficiency.fill_arrays. event_mask may be
+        (n_events,) or per tracker (n_events, 2).
+        """
+        self.partials.append(self.partial(spacepoints, sp_clusters,
+                                          cluster_npe, event_mask))
+
+    def partial(self, spacepoints, sp_clusters, cluster_npe, event_mask):
+        """
+        The (10, width) partial counts of one spill, without storing
+        them.
+        """
+        event_mask = numpy.asarray(event_mask, dtype=bool)
+        if event_mask.ndim == 1:
+            event_mask = numpy.repeat(event_mask[:, numpy.newaxis], 2, axis=1)
+        n_events = len(event_mask)
+        station_mask = numpy.repeat(event_mask, N_StationIDs//2, axis=1)
+        nbins = len(self.centres)
+        partial = numpy.zeros((N_StationIDs, self.width), dtype=numpy.int32)
+        partial[:, EVENTS] = station_mask.sum(axis=0)
+
+        sp_event = spacepoints["event"].astype(numpy.int64)
+        sp_station = StationID(spacepoints["tracker"].astype(int),
+                               spacepoints["station"])
+        cell = sp_event*N_StationIDs + sp_station
+        selected = station_mask.ravel()[cell]
+        triplet = spacepoints["nchannels"] == 3
+
+        # Only the first triplet of each (event, station) is used:
+        triplet_cells, first = numpy.unique(cell[selected & triplet],
+                                            return_index=True)
+        triplets = numpy.flatnonzero(selected & triplet)[first]
+        has_triplet = numpy.zeros(n_events*N_StationIDs, dtype=bool)
+        has_triplet[triplet_cells] = True
+
+        # All duplets of (event, station)s without a triplet:
+        duplets = numpy.flatnonzero(selected & ~triplet & ~has_triplet[cell])
+        has_doublet = numpy.zeros(n_events*N_StationIDs, dtype=bool)
+        has_doublet[cell[duplets]] = True
+
+        partial[:, TRIPLETS] = numpy.bincount(sp_station[triplets],
+                                              minlength=N_StationIDs)
+        partial[:, DOUBLETS] = numpy.bincount(sp_station[duplets],
+                                              minlength=N_StationIDs)
+        partial[:, NOTHING] = (station_mask.ravel() & ~has_triplet &
+                               ~has_doublet).reshape(n_events, N_StationIDs)\
+            .sum(axis=0)
+
+        bins = self._ly_bins(cluster_npe)
+        for offset, sps in [(N_COUNTS, triplets),
+                            (N_COUNTS + nbins + 2, duplets)]:
+            chosen = numpy.zeros(len(sp_event), dtype=bool)
+            chosen[sps] = True
+            clusters = chosen[sp_clusters["sp"]]
+            partial[:, offset:offset + nbins + 2] = numpy.bincount(
+                sp_station[sp_clusters["sp"][clusters]]*(nbins + 2) +
+                bins[clusters], minlength=N_StationIDs*(nbins + 2))\
+                .reshape(N_StationIDs, nbins + 2)
+
+        return partial
+
+    def table(self):
+        """
+        The partials of every spill as one (n_spills, 10, width) array.
+        """
+        if not self.partials:
+            return numpy.zeros((0, N_StationIDs, self.width),
+                               dtype=numpy.int32)
+        return numpy.array(self.partials)
+
+    def merge(self, other):
+        """
+        Add the spills of another StationEfficiencyBootstrap.
+        """
+        self.partials.extend(other.partials)
+
+    def save(self, fname):
+        """
+        Save the partials to a numpy .npz file.
+        """
+        numpy.savez(fname, partials=self.table(), edges=self.edges)
+
+    def load(self, fname):
+        """
+        Add the spills saved by another shard.
+        """
+        saved = numpy.load(fname)
+        self.partials.extend(list(saved["partials"]))
+
+    def efficiencies(self):
+        """
+        Nominal efficiency of every station, from all spills.
+        """
+        return StationEfficiencies(self.table().sum(axis=0), self.centres)
+
+    def bootstrap(self, n_replicas=500, n_workers=4, chunk_size=50,
+                  seed=12345):
+        """
+        Efficiencies of n_replicas Poisson weighted replicas of the
+        spills, returns an array (n_replicas, 10).
+        """
+        partials = self.table().astype(float)
+        tasks = []
+        for i, start in enumerate(range(0, n_replicas, chunk_size)):
+            tasks.append((partials, self.centres,
+                          min(chunk_size, n_replicas - start), seed + i))
+
+        if n_workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(n_workers)
+            try:
+                chunks = pool.map(_BootstrapChunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            chunks = [_BootstrapChunk(t) for t in tasks]
+
+        return numpy.concatenate(chunks)
+
+    def summary(self, replicas):
+        """
+        Nominal efficiency, replica mean, standard deviation and the
+        16% and 84% quantiles of every station.
+        """
+        return {"eff": self.efficiencies(),
+                "mean": replicas.mean(axis=0),
+                "std": replicas.std(axis=0),
+                "q16": numpy.percentile(replicas, 16, axis=0),
+                "q84": numpy.percentile(replicas, 84, axis=0)}
@@ -14,6 +14,9 @@ import libMausCpp  # pylint: disable = W0611
 
 from SciFiTools import FindDeadChansHist, StationDeadProbability
 from FrontEndLookup import FrontEndLookup
+from SciFiMissingChannels import MissingChannelMap
+from SciFiArrays import SpacePointArrays, SpacePointDigitArrays, PlaneID
+from Histograms import Hist1D
 
 ###############################################################################
 # Argument parsing:
@@ -50,6 +53,7 @@ inpath = "/home/ed/MICE/testdata/"
 infiles = ["reprocessed/07432_recon.root"]
 outrootfile = "dead_07432.root"
 outcsvfile = "dead_07432.csv"
+outmissingfile = "missing_07432.csv"
 max_spills = 0  # 0 Will run over all data
 lookup = FrontEndLookup(maus_scifi_mapping, maus_scifi_calibration)
 
@@ -64,9 +68,13 @@ for tracker in [0,1]:
     for station in range(1,6):
         for plane in range (3):
             basename = "%i_%i_%i" % (tracker, station, plane)
-            ch_hists["chist_"+basename] = ROOT.TH1D("chist_"+basename,
-                                                    "chist_"+basename,
-                                                    220, -0.5, 219.5)
+            ch_hists["chist_"+basename] = Hist1D("chist_"+basename,
+                                                 "chist_"+basename,
+                                                 220, -0.5, 219.5)
+
+# Duplet predicted missing channels:
+missing_map = MissingChannelMap(npe_cut=3)
+
 # Load data for processing:
 print "Setting up ROOT TChain"
 chain = ROOT.TChain("Spill")
@@ -90,23 +98,26 @@ for i in range(chain.GetEntries()):
     if spill.GetDaqEventType() != "physics_event":
         continue
 
-    for j, recon_event in enumerate(spill.GetReconEvents()):
-        # print j, ":",
-
-        # Look for all triplet spacepoints and store the channel hits
-        # which made them. Dead fibres cannot contribute triplets.
-        for sp in recon_event.GetSciFiEvent().spacepoints():
-            if len(sp.get_channels()) == 3:
-                tracker = sp.get_tracker()
-                station = sp.get_station()
+    recon_events = spill.GetReconEvents()
+    digits = SpacePointDigitArrays(recon_events)
+    missing_map.fill_arrays(SpacePointArrays(recon_events), digits)
+
+    # Look for all triplet spacepoints and store the channel hits
+    # which made them (over an npe cut). Dead fibres cannot contribute
+    # triplets.
+    use = (digits["nchannels"] == 3) & (digits["npe"] > 3)
+    plane_ids = PlaneID(digits["tracker"][use].astype(int),
+                        digits["station"][use], digits["plane"][use])
+    channels = digits["channel"][use]
+    for tracker in range(2):
+        for station in range(1, 6):
+            for plane in range(3):
+                basename = "%i_%i_%i" % (tracker, station, plane)
+                ch_hists["chist_"+basename].fill(
+                    channels[plane_ids == PlaneID(tracker, station, plane)])
 
-                # Add clusters which are over an npe cut:
-                for cluster in sp.get_channels():
-                    for digit in cluster.get_digits():
-                        if digit.get_npe() > 3:
-                            plane = digit.get_plane()
-                            basename = "%i_%i_%i" % (tracker, station, plane)
-                            ch_hists["chist_"+basename].Fill(digit.get_channel())
+# Convert to ROOT for fitting, drawing and saving:
+ch_hists = {name: ch_hists[name].ToTH1D() for name in ch_hists}
 
 ###############################################################################
 # Process Hits
@@ -152,6 +163,12 @@ with open(outcsvfile, 'w') as csvfile:
                     writer.writerow(row)
 
 
+# Dump the fit-free duplet inefficiency of every channel:
+missing_map.write_csv(outmissingfile, lookup)
+print "Odd/even expected missing per station:", ", ".join(
+    "T%iS%i %.3f" % (t, s, missing_map.odd_even_ratio(t, s))
+    for t in range(2) for s in range(1, 6))
+
 # Print out the dead channels:
 print "==================================================================="
 print "Dead Channels found.."
@@ -8,9 +8,15 @@ import os
 import ROOT
 import libMausCpp  # pylint: disable = W0611
 from TOFTools import TOF12CoincidenceTime, TOF1SingleHit, TimeInSpill
-from SciFiTools import UnsaturatedCluster, StationSpacePointEfficiency
+from SciFiTools import UnsaturatedCluster, StationSpacePointEfficiency, \
+    ClusterLightYields
+from SciFiArrays import SpacePointArrays, SpacePointClusterArrays
+from SciFiBootstrap import StationEfficiencyBootstrap
+from SpillReader import PrefetchReader
+from FileManifest import FileManifest
 from ROOTTools import TemplateFitter, IntegrateExpErr
 import math
+import numpy
 
 max_spills = 0000  # 0 Will run over all data
 
@@ -29,34 +35,53 @@ tof1_vpixels = [2,3,4]
 tof2_hpixels = [4,5,6]
 tof2_vpixels = [4,5,6]
 
+# Per channel saturation (FrontEndLookup.GetSaturationPEArray()),
+# None will use an ADC of 255:
+saturation_table = None
+
 spe_us = [StationSpacePointEfficiency\
           (0, i, "us_%i"%i) for i in range(1,6)]
 spe_ds = [StationSpacePointEfficiency\
           (1, i, "ds_%i"%i) for i in range(1,6)]
 
-# Load data for processing:
-print "Setting up ROOT TChain"
-chain = ROOT.TChain("Spill")
+# Per spill partials for bootstrap errors on the efficiencies:
+bootstrap = StationEfficiencyBootstrap()
+n_replicas = 500
+partials_file = "eff_partials.npz"
+
+# Spills decoded ahead of the analysis in a background thread:
+prefetch_depth = 4
+decompression_threads = 0
+
+# Manifest of validated inputs, checksums read every byte of the data so
+# are left to FileManifest.py:
+manifest_file = "manifest.json"
+manifest_checksums = False
+
+# Validated inputs and entry counts, bad files are skipped:
+manifest = FileManifest(manifest_file)
+if manifest.build(infiles, checksum=manifest_checksums):
+    manifest.save()
+infiles = manifest.valid_files(infiles)
 
+# Load data for processing:
+print "Setting up the spill reader"
 for f in infiles:
     print "Appending file: ", f
-    chain.AddFile(f)
-
-data = ROOT.MAUS.Data()  # pylint: disable = E1101
-chain.SetBranchAddress("data", data)
+reader = PrefetchReader(infiles, depth=prefetch_depth,
+                        stop=max_spills + 1 if max_spills > 0 else 0,
+                        implicit_mt=decompression_threads,
+                        entries=manifest.entries(infiles), type_index=True)
 
 # Begin the processing
 print "Beginning Processing"
-for i in range(chain.GetEntries()):
-    print "Spill", i, "/", chain.GetEntries()
-    if max_spills > 0 and i > max_spills:
-        break
-    chain.GetEntry(i)
-    spill = data.GetSpill()
-    if spill.GetDaqEventType() != "physics_event":
-        continue
-
-    for j, recon_event in enumerate(spill.GetReconEvents()):
+for i, spill in reader:
+    print "Spill", i, "/", reader.n_entries
+    recon_events = spill.GetReconEvents()
+    fill_us = numpy.zeros(len(recon_events), dtype=bool)
+    fill_ds = numpy.zeros(len(recon_events), dtype=bool)
+
+    for j, recon_event in enumerate(recon_events):
         print j, ":",
 
         if TOF12CoincidenceTime(recon_event.GetTOFEvent(),0,100) and\
@@ -103,19 +128,41 @@ for i in range(chain.GetEntries()):
             ustrack_ok = True
             dstrack_ok = True
 
-            if dstrack_ok == True:
-                for s in spe_us:
-                    s.fill(recon_event)
+            fill_us[j] = dstrack_ok
+            fill_ds[j] = ustrack_ok
+
+    # Fill the station efficiencies for the whole spill at once:
+    if fill_us.any() or fill_ds.any():
+        spacepoints = SpacePointArrays(recon_events)
+        sp_clusters = SpacePointClusterArrays(recon_events)
+        cluster_npe, saturated = ClusterLightYields(sp_clusters,
+                                                    saturation_table)
+        for s in spe_us:
+            s.fill_arrays(spacepoints, sp_clusters, cluster_npe, fill_us)
+        for s in spe_ds:
+            s.fill_arrays(spacepoints, sp_clusters, cluster_npe, fill_ds)
+        bootstrap.fill_arrays(spacepoints, sp_clusters, cluster_npe,
+                              numpy.column_stack([fill_us, fill_ds]))
+
+print "Reader: %(entries_read)i entries, %(read_s).1f s reading, " \
+    "%(wait_s).1f s waiting" % reader.summary()
 
-            if ustrack_ok == True:
-                for s in spe_ds:
-                    s.fill(recon_event)
 # Generate plot:
 for e in spe_us:
     e.compute()
 for e in spe_ds:
     e.compute()
 
+# Bootstrap the efficiencies, replacing the formula errors:
+bootstrap.save(partials_file)
+replicas = bootstrap.bootstrap(n_replicas)
+boot_err = bootstrap.summary(replicas)["std"]
+for e in spe_us + spe_ds:
+    e.eff_err_formula = e.eff_err
+    e.eff_err = boot_err[5*e.tracker + e.station - 1]
+    print "Tracker %i, Station %i: %f +- %f (formula +- %f)" % \
+        (e.tracker, e.station, e.eff, e.eff_err, e.eff_err_formula)
+
 
 eff = ROOT.TH1D("eff", "Efficiency; Station[-ve=upstream]; Efficiency", 11, -5.5, 5.5)
 for e in spe_us:
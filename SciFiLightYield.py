@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+"""
+Light yield of every tracker channel, from the npe of unsaturated
+triplet clusters.
+
+All channels are histogrammed into one (6480, nbins) array and the
+Poisson model of SciFiTools.LightYieldFinder is fitted to every channel
+at once, by least squares over a grid of (npe, scale) shapes, split
+over worker processes. Results are cached per run so only new runs are
+fitted.
+"""
+
+import os
+import re
+import json
+import argparse
+import multiprocessing
+
+import numpy
+
+from SciFiArrays import SpacePointClusterArrays, ChannelRef, N_ChannelRefs
+from SciFiTools import ClusterLightYields
+
+
+def _Gamma(x):
+    """
+    Gamma function of an array (Lanczos approximation, x > 0).
+    """
+    coef = [676.5203681218851, -1259.1392167224028, 771.32342877765313,
+            -176.61503916999185, 12.507343278686905,
+            -0.13857109526572012, 9.9843695780195716e-6,
+            1.5056327351493116e-7]
+    x = numpy.asarray(x, dtype=float) - 1
+    a = numpy.ones_like(x)*0.99999999999980993
+    t = x + 7.5
+    for i, c in enumerate(coef):
+        a += c/(x + i + 1)
+    return numpy.sqrt(2*numpy.pi)*t**(x + 0.5)*numpy.exp(-t)*a
+
+
+def PoissonShapes(x, npe_grid, scale_grid):
+    """
+    The LightYieldFinder model (without normalisation),
+    (npe/scale)^(x/scale) exp(-npe/scale) / Gamma(x/scale + 1),
+    for every (npe, scale) pair. Returns shapes (n_grid, len(x)) and
+    the npe and scale of each row.
+    """
+    npe, scale = [g.ravel() for g in numpy.meshgrid(npe_grid, scale_grid,
+                                                    indexing="ij")]
+    mu = (npe/scale)[:, numpy.newaxis]
+    k = numpy.maximum(x[numpy.newaxis, :], 0)/scale[:, numpy.newaxis]
+    shapes = numpy.exp(k*numpy.log(mu) - mu)/_Gamma(k + 1)
+    return shapes, npe, scale
+
+
+def _ParabolaMin(left, mid, right):
+    """
+    Minimum of the parabola through values at -1, 0 and +1 steps,
+    returns its offset (in steps, within +-1), value and curvature
+    (chi2 rise over one step), as mid where there is no minimum.
+    """
+    curve = (left + right)/2. - mid
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        shift = numpy.where(curve > 0, (left - right)/(4.*curve), 0.)
+    shift = numpy.clip(numpy.nan_to_num(shift), -1, 1)
+    return shift, mid + curve*shift**2 - (left - right)*shift/2., curve
+
+
+def _Crossing(profile, grid, level, inside, outside):
+    """
+    Point of each row of a profile where it crosses level, linearly
+    interpolated from the inside to the outside grid index (the
+    inside point itself at the end of the grid).
+    """
+    rows = numpy.arange(len(profile))
+    outside = numpy.clip(outside, 0, len(grid) - 1)
+    inside = numpy.clip(inside, 0, len(grid) - 1)
+    p_in = profile[rows, inside]
+    p_out = profile[rows, outside]
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        frac = numpy.where(p_out > p_in, (level - p_in)/(p_out - p_in), 0.)
+    return grid[inside] + numpy.clip(frac, 0, 1)*(grid[outside] -
+                                                  grid[inside])
+
+
+def _FitChunk(task):
+    """
+    Fit a block of channel histograms (n_channels, nbins) to the
+    Poisson shapes, returning npe, npe_err and chi2 per channel.
+
+    Empty bins are excluded and bins weighted by 1/content, as in a
+    default ROOT chi2 fit. The normalisation is solved analytically
+    for every shape. The chi2 is profiled over scale and the npe and
+    its error (half width of the chi2 + 1 interval) are interpolated
+    between grid points, so neither is limited by the grid step.
+    """
+    counts, centres, low_npe, npe_grid, scale_grid = task
+    shapes, npe, scale = PoissonShapes(centres, npe_grid, scale_grid)
+
+    # Fit from low_npe to the last non-empty bin (as LightYieldFinder):
+    weights = numpy.where(counts > 0, 1.0/numpy.maximum(counts, 1), 0.0)
+    weights[:, centres < low_npe] = 0.0
+
+    wy = weights*counts
+    sum_wys = wy.dot(shapes.T)
+    sum_wss = weights.dot((shapes*shapes).T)
+    sum_wyy = (wy*counts).sum(axis=1)[:, numpy.newaxis]
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        chi2 = sum_wyy - numpy.where(sum_wss > 0, sum_wys**2/sum_wss, 0.0)
+
+    # Profile over scale, refining the minimum between scale points:
+    n_channels = len(counts)
+    chi2 = chi2.reshape(n_channels, len(npe_grid), len(scale_grid))
+    rows = numpy.arange(n_channels)
+    cols = numpy.arange(len(npe_grid))
+    j = numpy.clip(chi2.argmin(axis=2), 1, len(scale_grid) - 2)
+    profile = _ParabolaMin(chi2[rows[:, None], cols, j - 1],
+                           chi2[rows[:, None], cols, j],
+                           chi2[rows[:, None], cols, j + 1])[1]
+    profile = numpy.minimum(profile, chi2.min(axis=2))
+
+    # Minimum of the profile, between npe points:
+    i = numpy.clip(profile.argmin(axis=1), 1, len(npe_grid) - 2)
+    shift, best_chi2, curve = _ParabolaMin(profile[rows, i - 1],
+                                           profile[rows, i],
+                                           profile[rows, i + 1])
+    step = npe_grid[1] - npe_grid[0]
+    best_npe = npe_grid[i] + shift*step
+
+    # The chi2 + 1 crossings, from the parabola when within a step of
+    # the minimum, else linearly interpolated between npe points:
+    level = best_chi2[:, numpy.newaxis] + 1
+    inside = profile <= level
+    first = numpy.where(inside, cols, len(npe_grid)).min(axis=1)
+    last = numpy.where(inside, cols, -1).max(axis=1)
+    npe_lo = _Crossing(profile, npe_grid, level[:, 0], first, first - 1)
+    npe_hi = _Crossing(profile, npe_grid, level[:, 0], last, last + 1)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        half_width = numpy.where(curve > 0, step/numpy.sqrt(curve), numpy.inf)
+    narrow = (first >= i - 1) & (last <= i + 1) & (half_width < 2*step)
+    npe_err = numpy.where(narrow, half_width, (npe_hi - npe_lo)/2.)
+
+    return best_npe, npe_err, best_chi2
+
+
+class ChannelLightYield:
+    """
+    Histograms of unsaturated triplet cluster npe for every channel,
+    indexed by the 1d channel reference (SciFiArrays.ChannelRef).
+    """
+
+    def __init__(self, nbins=30, low=-0.5, high=29.5, low_npe=2,
+                 min_entries=50):
+        """
+        Constructor, makes the empty (6480, nbins) histogram array.
+        """
+        self.edges = numpy.linspace(low, high, nbins + 1)
+        self.centres = (self.edges[1:] + self.edges[:-1])/2.
+        self.low_npe = low_npe
+        self.min_entries = min_entries
+        self.counts = numpy.zeros((N_ChannelRefs, nbins))
+
+    def fill(self, refs, npe):
+        """
+        Add arrays of channel references and cluster npe.
+        """
+        nbins = len(self.centres)
+        bins = numpy.searchsorted(self.edges, npe, "right") - 1
+        good = (bins >= 0) & (bins < nbins) & (refs >= 0) & \
+            (refs < N_ChannelRefs)
+        self.counts += numpy.bincount(refs[good]*nbins + bins[good],
+                                      minlength=N_ChannelRefs*nbins)\
+            .reshape(N_ChannelRefs, nbins)
+
+    def fill_spill(self, recon_events, saturation_table=None):
+        """
+        Add the unsaturated triplet clusters of a sequence of recon
+        events, each to the channel of the cluster.
+        """
+        clusters = SpacePointClusterArrays(recon_events)
+        npe, saturated = ClusterLightYields(clusters, saturation_table)
+        use = (clusters["nchannels"] == 3) & ~saturated
+        refs = ChannelRef(clusters["tracker"][use].astype(int),
+                          clusters["station"][use].astype(int),
+                          clusters["plane"][use].astype(int),
+                          numpy.floor(clusters["channel"][use]).astype(int))
+        self.fill(refs, npe[use])
+
+    def merge(self, other):
+        """
+        Add the histograms of another ChannelLightYield.
+        """
+        self.counts += other.counts
+
+    def fit(self, n_workers=4, chunk_size=256,
+            npe_grid=numpy.arange(1.0, 30.05, 0.1),
+            scale_grid=numpy.arange(0.5, 4.01, 0.05)):
+        """
+        Fit every channel with at least min_entries, returns a dict of
+        npe, npe_err and chi2 arrays (nan for channels not fitted).
+        """
+        results = {}
+        for key in ["npe", "npe_err", "chi2"]:
+            results[key] = numpy.empty(N_ChannelRefs)
+            results[key].fill(numpy.nan)
+
+        fitted = numpy.flatnonzero(self.counts.sum(axis=1) >=
+                                   self.min_entries)
+        tasks = [(self.counts[fitted[i:i + chunk_size]], self.centres,
+                  self.low_npe, npe_grid, scale_grid)
+                 for i in range(0, len(fitted), chunk_size)]
+
+        if n_workers > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(n_workers)
+            try:
+                chunks = pool.map(_FitChunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            chunks = [_FitChunk(t) for t in tasks]
+
+        for i, chunk in enumerate(chunks):
+            channels = fitted[i*chunk_size:(i + 1)*chunk_size]
+            for key, values in zip(["npe", "npe_err", "chi2"], chunk):
+                results[key][channels] = values
+
+        return results
+
+
+class LightYieldCache:
+    """
+    Per run store of fitted channel light yields, one json file per
+    run in cache_dir.
+    """
+
+    def __init__(self, cache_dir="light_yield_cache"):
+        """
+        Constructor, makes the cache directory if needed.
+        """
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, run):
+        """
+        File holding the results of a run.
+        """
+        return os.path.join(self.cache_dir, "light_yield_%05i.json" % run)
+
+    def has(self, run):
+        """
+        True if the run has been fitted.
+        """
+        return os.path.exists(self.path(run))
+
+    def load(self, run):
+        """
+        Return the results of a run as arrays.
+        """
+        with open(self.path(run), "r") as f:
+            saved = json.load(f)
+        return {key: numpy.array(saved[key], dtype=float)
+                for key in ["npe", "npe_err", "chi2"]}
+
+    def save(self, run, results):
+        """
+        Store the results of a run, nan is stored as null.
+        """
+        saved = {"run": run}
+        for key in ["npe", "npe_err", "chi2"]:
+            saved[key] = [None if numpy.isnan(v) else float(v)
+                          for v in results[key]]
+        with open(self.path(run), "w") as f:
+            json.dump(saved, f)
+
+
+if __name__ == "__main__":
+
+    import ROOT
+    import libMausCpp  # pylint: disable = W0611
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("infiles", help="recon files, one per run",
+                        type=str, nargs="+")
+    parser.add_argument("--cache", help="the light yield cache directory",
+                        type=str, default="light_yield_cache")
+    parser.add_argument("--workers", help="fitting processes", type=int,
+                        default=4)
+    args = parser.parse_args()
+
+    cache = LightYieldCache(args.cache)
+
+    for infile in args.infiles:
+        # Run number from the file name, else from its first physics spill:
+        match = re.match(r"\d+", os.path.basename(infile))
+        run = int(match.group(0)) if match is not None else None
+        if run is not None and cache.has(run):
+            print "Run %i already fitted" % run
+            continue
+
+        print "Processing file: %s" % infile
+        ly = ChannelLightYield()
+        root_file = ROOT.TFile(infile, "READ")  # pylint: disable = E1101
+        tree = root_file.Get("Spill")
+        data = ROOT.MAUS.Data()  # pylint: disable = E1101
+        tree.SetBranchAddress("data", data)
+        fitted = False
+        for i in range(tree.GetEntries()):
+            tree.GetEntry(i)
+            spill = data.GetSpill()
+            if spill.GetDaqEventType() != "physics_event":
+                continue
+            if run is None:
+                run = spill.GetRunNumber()
+                if cache.has(run):
+                    fitted = True
+                    break
+            ly.fill_spill(spill.GetReconEvents())
+        root_file.Close()
+
+        if run is None:
+            print "No physics spills in %s, skipped" % infile
+            continue
+        if fitted:
+            print "Run %i already fitted" % run
+            continue
+
+        print "Fitting run %i" % run
+        results = ly.fit(n_workers=args.workers)
+        cache.save(run, results)
+        print "Fitted %i channels" % numpy.count_nonzero(
+            numpy.isfinite(results["npe"]))
@@ -0,0 +1,166 @@
+"""
+Dead channel signal from duplet spacepoints, without fitting.
+
+For every duplet the plane and channel which should have completed it
+is found with the kuno sum (SciFiTools.MissingFromDupletBatch). These
+"expected but missing" counts are compared per channel with the number
+of triplet hits on that channel (as collected in SciFiDeadEst.py) to
+give an inefficiency for each of the 6480 tracker channels.
+"""
+
+import csv
+import numpy
+
+from SciFiArrays import SpacePointArrays, SpacePointDigitArrays, \
+    ChannelRef, N_ChannelRefs, N_Tracker, N_Station, N_Plane, N_Channel
+from SciFiTools import MissingFromDupletBatch
+
+
+class MissingChannelMap:
+    """
+    Per channel counts of triplet hits and of duplets predicting
+    a hit on the channel.
+    """
+
+    def __init__(self, npe_cut=3):
+        """
+        Constructor, npe_cut is applied to the triplet digits.
+        """
+        self.npe_cut = npe_cut
+        self.triplet_hits = numpy.zeros(N_ChannelRefs, dtype=numpy.int64)
+        self.expected_missing = numpy.zeros(N_ChannelRefs)
+
+    def fill(self, recon_events):
+        """
+        Add a sequence of recon events (e.g. spill.GetReconEvents()).
+        """
+        self.fill_arrays(SpacePointArrays(recon_events),
+                         SpacePointDigitArrays(recon_events))
+
+    def fill_arrays(self, sp, digits):
+        """
+        Add the SpacePointArrays and SpacePointDigitArrays of a spill.
+        """
+        duplet = sp["nchannels"] == 2
+        tracker = sp["tracker"][duplet].astype(int)
+        station = sp["station"][duplet].astype(int)
+        plane, channel = MissingFromDupletBatch(
+            tracker, station, sp["plane_sum"][duplet].astype(int),
+            sp["channel_sum"][duplet])
+        # A prediction half way between two channels (T1S5, whose kuno
+        # total is odd, or a two digit cluster) is shared between them,
+        # as rint would give it all to the even one:
+        lower = numpy.floor(channel)
+        half = numpy.abs(channel - lower - 0.5) < 1e-6
+        nearest = numpy.where(half, lower, numpy.rint(channel)).astype(int)
+        weights = numpy.where(half, 0.5, 1.)
+        self.fill_missing(tracker, station, plane, nearest, weights)
+        self.fill_missing(tracker[half], station[half], plane[half],
+                          nearest[half] + 1, weights[half])
+
+        hit = (digits["nchannels"] == 3) & (digits["npe"] > self.npe_cut)
+        self.fill_hits(digits["tracker"][hit].astype(int),
+                       digits["station"][hit].astype(int),
+                       digits["plane"][hit].astype(int),
+                       digits["channel"][hit].astype(int))
+
+    def _count(self, tracker, station, plane, channel, weights=None):
+        """
+        Count (or sum weights) per channel reference, dropping
+        unphysical channels.
+        """
+        good = (plane >= 0) & (plane < N_Plane) & \
+            (channel >= 0) & (channel < N_Channel)
+        refs = ChannelRef(tracker[good], station[good], plane[good],
+                          channel[good])
+        if weights is not None:
+            weights = weights[good]
+        return numpy.bincount(refs, weights, minlength=N_ChannelRefs)
+
+    def fill_missing(self, tracker, station, plane, channel, weights=None):
+        """
+        Add arrays of predicted missing channels, with optional
+        (fractional) weights.
+        """
+        self.expected_missing += self._count(tracker, station, plane,
+                                             channel, weights)
+
+    def fill_hits(self, tracker, station, plane, channel):
+        """
+        Add arrays of triplet channel hits.
+        """
+        self.triplet_hits += self._count(tracker, station, plane, channel)
+
+    def merge(self, other):
+        """
+        Add the counts of another MissingChannelMap.
+        """
+        self.triplet_hits += other.triplet_hits
+        self.expected_missing += other.expected_missing
+
+    def inefficiency(self):
+        """
+        Per channel inefficiency, missing/(missing + hits), and its
+        binomial error. Channels without counts are given 0 +- 1.
+        """
+        total = (self.expected_missing + self.triplet_hits).astype(float)
+        ineff = numpy.zeros(N_ChannelRefs)
+        error = numpy.ones(N_ChannelRefs)
+        seen = total > 0
+        ineff[seen] = self.expected_missing[seen]/total[seen]
+        error[seen] = numpy.sqrt(ineff[seen]*(1 - ineff[seen])/total[seen])
+        return ineff, error
+
+    def odd_even_ratio(self, tracker, station):
+        """
+        Expected missing counts on the odd over the even channels of a
+        station, near 1 unless the predictions favour a parity.
+        """
+        refs = ChannelRef(tracker, station, numpy.arange(N_Plane)[:, None],
+                          numpy.arange(N_Channel)[None, :])
+        missing = self.expected_missing[refs]
+        return missing[:, 1::2].sum()/max(missing[:, ::2].sum(), 1.)
+
+    def table(self):
+        """
+        Return a list of dictionaries, one per channel.
+        """
+        ineff, error = self.inefficiency()
+        rows = []
+        for tracker in range(N_Tracker):
+            for station in range(1, N_Station + 1):
+                for plane in range(N_Plane):
+                    for channel in range(N_Channel):
+                        ref = ChannelRef(tracker, station, plane, channel)
+                        rows.append({"tracker": tracker,
+                                     "station": station,
+                                     "plane": plane,
+                                     "trchannel": channel,
+                                     "triplet_hits": self.triplet_hits[ref],
+                                     "expected_missing":
+                                     self.expected_missing[ref],
+                                     "inefficiency": ineff[ref],
+                                     "inefficiency_err": error[ref]})
+        return rows
+
+    def write_csv(self, fname, lookup=None):
+        """
+        Write the per channel table, with the channelUID if a
+        FrontEndLookup is given.
+        """
+        fieldnames = ["tracker", "station", "plane", "trchannel",
+                      "channelUID", "triplet_hits", "expected_missing",
+                      "inefficiency", "inefficiency_err"]
+        with open(fname, "w") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            for row in self.table():
+                row["channelUID"] = -1
+                if lookup is not None:
+                    try:
+                        row["channelUID"] = lookup.GetChannel(
+                            row["tracker"], row["station"], row["plane"],
+                            row["trchannel"])["channelUID"]
+                    except (LookupError, TypeError):
+                        pass
+                writer.writerow(row)
@@ -0,0 +1,144 @@
+"""
+Per trigger cluster and spacepoint multiplicities, for monitoring the
+occupancy of each plane and station.
+
+Counts are made per spill from the arrays of SciFiArrays, and the
+distributions held as numpy arrays which can be saved and merged
+across shards of a run.
+"""
+
+import numpy
+
+from SciFiArrays import ClusterArrays, SpacePointArrays, CountPerEvent, \
+    PlaneID, StationID, N_PlaneIDs, N_StationIDs
+
+
+class MultiplicityAnalyzer:
+    """
+    Distributions of the number of single and double (or more) digit
+    clusters per plane, and of duplet and triplet spacepoints per
+    station, per trigger.
+
+    Counts above max_count are held in an overflow bin.
+    """
+
+    distributions = {"clusters_singles": N_PlaneIDs,
+                     "clusters_double": N_PlaneIDs,
+                     "sp_duplets": N_StationIDs,
+                     "sp_triplets": N_StationIDs}
+
+    titles = {"clusters_singles": "clusters single Both; planeid "
+                                  "[(tracker-1)*15 + (station-1)*3 + plane];"
+                                  " count/trigger",
+              "clusters_double": "clusters double Both; planeid "
+                                 "[(tracker-1)*15 + (station-1)*3 + plane];"
+                                 " count/trigger",
+              "sp_duplets": "Duplets; stationid [(tracker-1)*5 + station-1];"
+                            " count/trigger",
+              "sp_triplets": "Triplets; stationid "
+                             "[(tracker-1)*5 + station-1]; count/trigger"}
+
+    def __init__(self, max_count=3):
+        """
+        Constructor, makes empty distributions.
+        """
+        self.max_count = max_count
+        self.n_triggers = 0
+        self.counts = {}
+        for name, n_ids in self.distributions.items():
+            self.counts[name] = numpy.zeros((n_ids, max_count + 2),
+                                            dtype=numpy.int64)
+
+    def _accumulate(self, name, per_event):
+        """
+        Add per event counts (n_events, n_ids) to a distribution.
+        """
+        n_ids = per_event.shape[1]
+        bins = numpy.minimum(per_event, self.max_count + 1)
+        cell = numpy.arange(n_ids)[numpy.newaxis, :]*(self.max_count + 2) \
+            + bins
+        self.counts[name] += numpy.bincount(
+            cell.ravel(), minlength=n_ids*(self.max_count + 2))\
+            .reshape(n_ids, self.max_count + 2)
+
+    def fill(self, recon_events):
+        """
+        Add a sequence of recon events (e.g. the selected triggers of
+        a spill).
+        """
+        n_events = len(recon_events)
+        if n_events == 0:
+            return
+        self.n_triggers += n_events
+
+        cl = ClusterArrays(recon_events)
+        plane_id = PlaneID(cl["tracker"].astype(int), cl["station"],
+                           cl["plane"])
+        single = cl["ndigits"] == 1
+        self._accumulate("clusters_singles",
+                         CountPerEvent(cl["event"], plane_id, n_events,
+                                       N_PlaneIDs, single))
+        self._accumulate("clusters_double",
+                         CountPerEvent(cl["event"], plane_id, n_events,
+                                       N_PlaneIDs, ~single))
+
+        sp = SpacePointArrays(recon_events)
+        station_id = StationID(sp["tracker"].astype(int), sp["station"])
+        triplet = sp["nchannels"] == 3
+        self._accumulate("sp_duplets",
+                         CountPerEvent(sp["event"], station_id, n_events,
+                                       N_StationIDs, ~triplet))
+        self._accumulate("sp_triplets",
+                         CountPerEvent(sp["event"], station_id, n_events,
+                                       N_StationIDs, triplet))
+
+    def mean(self, name):
+        """
+        Mean count per trigger of each plane or station.
+        """
+        if self.n_triggers == 0:
+            return numpy.zeros(self.distributions[name])
+        values = numpy.arange(self.max_count + 2)
+        return (self.counts[name]*values).sum(axis=1)/float(self.n_triggers)
+
+    def merge(self, other):
+        """
+        Add the results of another MultiplicityAnalyzer.
+        """
+        self.n_triggers += other.n_triggers
+        for name in self.counts:
+            self.counts[name] += other.counts[name]
+
+    def save(self, fname):
+        """
+        Save the distributions to a numpy .npz file.
+        """
+        numpy.savez(fname, n_triggers=self.n_triggers, **self.counts)
+
+    def load(self, fname):
+        """
+        Merge in distributions saved by another shard.
+        """
+        saved = numpy.load(fname)
+        self.n_triggers += int(saved["n_triggers"])
+        for name in self.counts:
+            self.counts[name] += saved[name]
+
+    def getTObjects(self):
+        """
+        Return the distributions as TH2Ds of id against count.
+        """
+        import ROOT
+
+        rval = {}
+        for name, n_ids in self.distributions.items():
+            hist = ROOT.TH2D(name, self.titles[name],
+                             n_ids, -0.5, n_ids - 0.5,
+                             self.max_count + 1, -0.5, self.max_count + 0.5)
+            for i in range(n_ids):
+                for c in range(self.max_count + 2):
+                    hist.SetBinContent(i + 1, c + 1, self.counts[name][i, c])
+            hist.SetEntries(self.n_triggers*n_ids)
+            hist.SetStats(False)
+            rval[name] = hist
+        return rval
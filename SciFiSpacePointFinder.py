@@ -0,0 +1,155 @@
+"""
+Standalone spacepoint finder working on arrays of clusters, so that
+cluster level cuts (npe threshold, kuno tolerance) can be studied
+without re-running the MAUS reconstruction.
+
+clusters = ClusterArrays(spill.GetReconEvents())
+spacepoints = FindSpacePoints(clusters, npe_cut=2.0, kuno_tolerance=2.0)
+
+The spacepoint table has the event, tracker, station, nchannels and
+npe columns of SciFiArrays.SpacePointArrays (no positions), so it can
+be used in place of it (e.g. with SciFiArrays.StationHits), with the
+indices of the clusters used in c0, c1, c2 (-1 if absent).
+"""
+
+import numpy
+
+from SciFiArrays import KunoTotal, KeyJoin, ExpandRanges, StationID, \
+    N_Channel
+
+# Spacing used to build sortable (group, channel) values:
+_CH_SPAN = 4*N_Channel
+
+
+def _Resolve(candidates, rank, n_clusters, used):
+    """
+    Accept candidates (an array of cluster index columns, -1 for
+    none) in order of rank, so that each cluster is used at most once.
+
+    Each round accepts every candidate which is the best ranked
+    candidate of all its clusters, then drops those conflicting with
+    them. used is updated with the accepted clusters.
+    """
+    accepted = numpy.zeros(len(rank), dtype=bool)
+    alive = numpy.ones(len(rank), dtype=bool)
+    for col in candidates:
+        alive &= ~used[numpy.maximum(col, 0)] | (col < 0)
+
+    while alive.any():
+        best = numpy.empty(n_clusters)
+        best.fill(numpy.inf)
+        for col in candidates:
+            ok = alive & (col >= 0)
+            numpy.minimum.at(best, col[ok], rank[ok])
+
+        winner = alive.copy()
+        for col in candidates:
+            winner &= (col < 0) | (best[numpy.maximum(col, 0)] == rank)
+        accepted |= winner
+
+        for col in candidates:
+            used[col[winner & (col >= 0)]] = True
+        for col in candidates:
+            alive &= ~winner & (~used[numpy.maximum(col, 0)] | (col < 0))
+
+    return accepted
+
+
+def _TripletCandidates(clusters, key, good, kuno_tolerance):
+    """
+    All plane 0 x plane 1 x plane 2 combinations within a station
+    whose channel sum is within kuno_tolerance of the kuno total.
+    """
+    index = numpy.flatnonzero(good)
+    planes = [index[clusters["plane"][index] == p] for p in range(3)]
+
+    # Pair planes 0 and 1:
+    ia, ib = KeyJoin(key[planes[0]], key[planes[1]])
+    i0, i1 = planes[0][ia], planes[1][ib]
+    kuno = KunoTotal(clusters["tracker"][i0], clusters["station"][i0])
+    target = kuno - clusters["channel"][i0] - clusters["channel"][i1]
+
+    # Search plane 2, sorted by (station group, channel):
+    i2_all = planes[2]
+    value2 = key[i2_all]*_CH_SPAN + clusters["channel"][i2_all]
+    order = numpy.argsort(value2, kind="mergesort")
+    value2 = value2[order]
+    lo = numpy.searchsorted(value2, key[i0]*_CH_SPAN + target -
+                            kuno_tolerance, "left")
+    hi = numpy.searchsorted(value2, key[i0]*_CH_SPAN + target +
+                            kuno_tolerance, "right")
+    pair, match = ExpandRanges(lo, hi)
+    i0, i1, kuno = i0[pair], i1[pair], kuno[pair]
+    i2 = i2_all[order[match]]
+
+    residual = numpy.abs(clusters["channel"][i0] + clusters["channel"][i1] +
+                         clusters["channel"][i2] - kuno)
+    return [i0, i1, i2], residual
+
+
+def _DupletCandidates(clusters, key, good):
+    """
+    All pairs of clusters in different planes of a station whose
+    missing channel (as in SciFiTools.MissingFromDuplet) is a real
+    channel.
+    """
+    index = numpy.flatnonzero(good)
+    planes = [index[clusters["plane"][index] == p] for p in range(3)]
+
+    firsts, seconds = [], []
+    for pa, pb in [(0, 1), (0, 2), (1, 2)]:
+        ia, ib = KeyJoin(key[planes[pa]], key[planes[pb]])
+        firsts.append(planes[pa][ia])
+        seconds.append(planes[pb][ib])
+    i0, i1 = numpy.concatenate(firsts), numpy.concatenate(seconds)
+
+    missing = KunoTotal(clusters["tracker"][i0], clusters["station"][i0]) \
+        - clusters["channel"][i0] - clusters["channel"][i1]
+    inside = (missing >= 0) & (missing <= N_Channel - 1)
+    return [i0[inside], i1[inside]]
+
+
+def FindSpacePoints(clusters, npe_cut=0.0, kuno_tolerance=2.0,
+                    find_duplets=True):
+    """
+    Find triplet, and then duplet, spacepoints from an array of
+    clusters (SciFiArrays.ClusterArrays). Clusters below npe_cut are
+    not used. Triplets are preferred by smallest kuno residual, and
+    duplets by largest npe.
+    """
+    n_clusters = len(clusters["event"])
+    key = clusters["event"].astype(numpy.int64)*10 + \
+        StationID(clusters["tracker"].astype(int), clusters["station"])
+    good = clusters["npe"] >= npe_cut
+    used = numpy.zeros(n_clusters, dtype=bool)
+
+    triplets, residual = _TripletCandidates(clusters, key, good,
+                                            kuno_tolerance)
+    npe = sum(clusters["npe"][c] for c in triplets)
+    rank = numpy.lexsort((-npe, residual)).argsort().astype(float)
+    accepted = _Resolve(triplets, rank, n_clusters, used)
+    c = [col[accepted] for col in triplets]
+
+    if find_duplets:
+        duplets = _DupletCandidates(clusters, key, good & ~used)
+        npe = sum(clusters["npe"][col] for col in duplets)
+        rank = (-npe).argsort(kind="mergesort").argsort().astype(float)
+        accepted = _Resolve(duplets, rank, n_clusters, used)
+        for i in range(2):
+            c[i] = numpy.concatenate([c[i], duplets[i][accepted]])
+        c[2] = numpy.concatenate([c[2], -numpy.ones(numpy.count_nonzero
+                                                    (accepted), dtype=int)])
+
+    c0, c1, c2 = c
+    spacepoints = {"c0": c0, "c1": c1, "c2": c2,
+                   "event": clusters["event"][c0],
+                   "tracker": clusters["tracker"][c0],
+                   "station": clusters["station"][c0],
+                   "nchannels": numpy.where(c2 >= 0, 3, 2)
+                   .astype(numpy.int8),
+                   "npe": clusters["npe"][c0] + clusters["npe"][c1] +
+                   numpy.where(c2 >= 0, clusters["npe"][c2], 0.0)}
+
+    # Order by event, as the recon tables are:
+    order = numpy.argsort(spacepoints["event"], kind="mergesort")
+    return {k: spacepoints[k][order] for k in spacepoints}
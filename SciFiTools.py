@@ -1,14 +1,19 @@
 """
 Some tools for processing spacepoints.. (and now clusters)
 
+ROOT is only imported by the functions which need it, so the
+numerical helpers can be used without loading ROOT.
 """
 
-import ROOT
 from array import array
 from math import sqrt, pow
 from ROOTTools import TemplateFitter, IntegrateExpErr
+from Histograms import Hist1D, Hist2D, ToTObjects
 import math
 import numbers
+import numpy
+from SciFiArrays import KunoTotal, ChannelRef, PRTrackArrays, \
+    TrackRadiusAtZ, CountPerEvent
 
 
 def MissingFromDuplet(sp):
@@ -36,6 +41,14 @@ def MissingFromDuplet(sp):
     return plane_total - plane_sum, kuno_total - kuno_sum
 
 
+def MissingFromDupletBatch(tracker, station, plane_sum, channel_sum):
+    """
+    MissingFromDuplet for arrays of duplets, given the sums of
+    the planes and channels of their clusters.
+    """
+    return 3 - plane_sum, KunoTotal(tracker, station) - channel_sum
+
+
 def UnsaturatedCluster(cluster):
     """
     Determine the light yield from a cluster, but also
@@ -54,11 +67,66 @@ def UnsaturatedCluster(cluster):
         return npe_sum
 
 
+def UnsaturatedClusterBatch(digit_adc, digit_npe, digit_offsets,
+                            saturation_pe=None):
+    """
+    UnsaturatedCluster for many clusters at once, the digits of
+    cluster i are digit_*[digit_offsets[i]:digit_offsets[i+1]].
+
+    If saturation_pe (per digit, e.g. from
+    FrontEndLookup.GetSaturationPEArray) is given, digits with npe at
+    or above it are saturated, otherwise (or where it is 0) an ADC of
+    255 is used.
+
+    returns arrays of cluster npe (0 if saturated) and saturation flag.
+    """
+    n_clusters = len(digit_offsets) - 1
+    cluster = numpy.repeat(numpy.arange(n_clusters),
+                           numpy.diff(digit_offsets))
+
+    saturated_digit = numpy.abs(digit_adc - 255) < 0.5
+    if saturation_pe is not None:
+        known = saturation_pe > 0
+        saturated_digit = numpy.where(known, digit_npe >= saturation_pe,
+                                      saturated_digit)
+
+    saturated = numpy.bincount(cluster, weights=saturated_digit,
+                               minlength=n_clusters) > 0
+    npe = numpy.bincount(cluster, weights=digit_npe, minlength=n_clusters)
+    npe[saturated] = 0.0
+
+    return npe, saturated
+
+
+def ClusterLightYields(sp_clusters, saturation_table=None):
+    """
+    Apply UnsaturatedClusterBatch to SciFiArrays.SpacePointClusterArrays,
+    optionally with the per channel saturation table of
+    FrontEndLookup.GetSaturationPEArray.
+    """
+    saturation_pe = None
+    if saturation_table is not None:
+        n_digits = numpy.diff(sp_clusters["digit_offsets"])
+        refs = ChannelRef(numpy.repeat(sp_clusters["tracker"], n_digits)
+                          .astype(int),
+                          numpy.repeat(sp_clusters["station"], n_digits),
+                          numpy.repeat(sp_clusters["plane"], n_digits),
+                          sp_clusters["digit_channel"])
+        saturation_pe = saturation_table[refs]
+
+    return UnsaturatedClusterBatch(sp_clusters["digit_adc"],
+                                   sp_clusters["digit_npe"],
+                                   sp_clusters["digit_offsets"],
+                                   saturation_pe)
+
+
 def FindDeadChansHist(hist):
     """
     Find dead channels from a histogram of a planes channel
     hits which combined to make tripets.
     """
+    import ROOT
+
     deadchs = []
 
     ch_START = 0
@@ -128,6 +196,8 @@ def LightYieldFinder(histo):
     Process a 1D histogram to find the estimated
     light yield.
     """
+    import ROOT
+
     low_npe = 2
     high_npe = low_npe
     for i in range(histo.GetNbinsX()):
@@ -246,6 +316,120 @@ class TrackEfficiency:
         #    rval.update(s.getTObjects())
         return rval
 
+############################################################################
+class TrackEfficiencyBatch:
+    """
+    TrackEfficiency for both trackers at once, from the pattern
+    recognition track arrays of whole spills.
+
+    Helical tracks are projected along their helix to stations 1 and
+    5, so the feducial cut also works with field. Set helical_feducial
+    to False for the TrackEfficiency behaviour (events with a helical
+    track are left out of the feducial counts).
+    """
+
+    def __init__(self, name="tke", z_stn_1=0, z_stn_5=1100,
+                 r_feducial=100, helical_feducial=True):
+        """
+        Initilise elements, counts are indexed [tracker, n spacepoints]
+        """
+        self.name = name
+        self.z_stn_1 = z_stn_1
+        self.z_stn_5 = z_stn_5
+        self.r_feducial = r_feducial
+        self.helical_feducial = helical_feducial
+
+        self.all_tracks = numpy.zeros((2, 6), dtype=numpy.int64)
+        self.feducial_tracks = numpy.zeros((2, 6), dtype=numpy.int64)
+
+    def _longest(self, tracks, n_events, mask):
+        """
+        Longest track per (event, tracker) of the masked tracks, 0 if
+        there are none.
+        """
+        longest = numpy.zeros(n_events*2, dtype=numpy.int64)
+        cell = tracks["event"].astype(numpy.int64)*2 + tracks["tracker"]
+        numpy.maximum.at(longest, cell[mask],
+                         numpy.minimum(tracks["nsp"][mask], 5))
+        return longest.reshape(n_events, 2)
+
+    def _accumulate(self, counts, longest, event_mask):
+        """
+        Add the longest tracks of the selected (event, tracker) pairs.
+        """
+        for tracker in range(2):
+            counts[tracker] += numpy.bincount(
+                longest[:, tracker][event_mask[:, tracker]], minlength=6)
+
+    def fill_arrays(self, tracks, n_events, event_mask=None):
+        """
+        Fill from SciFiArrays.PRTrackArrays of n_events events,
+        event_mask (n_events, 2) selects the events used per tracker.
+        """
+        if event_mask is None:
+            event_mask = numpy.ones((n_events, 2), dtype=bool)
+        event_mask = numpy.asarray(event_mask, dtype=bool)
+        if event_mask.ndim == 1:
+            event_mask = numpy.repeat(event_mask[:, numpy.newaxis], 2, axis=1)
+
+        everything = numpy.ones(len(tracks["event"]), dtype=bool)
+        self._accumulate(self.all_tracks,
+                         self._longest(tracks, n_events, everything),
+                         event_mask)
+
+        # Feducial cut, the track remains inside the tracker at both ends:
+        inside = (TrackRadiusAtZ(tracks, self.z_stn_1) < self.r_feducial) & \
+            (TrackRadiusAtZ(tracks, self.z_stn_5) < self.r_feducial)
+        feducial_mask = event_mask
+        if not self.helical_feducial:
+            inside &= ~tracks["helical"]
+            helical_found = CountPerEvent(tracks["event"], tracks["tracker"],
+                                          n_events, 2, tracks["helical"]) > 0
+            feducial_mask = event_mask & ~helical_found
+        self._accumulate(self.feducial_tracks,
+                         self._longest(tracks, n_events, inside),
+                         feducial_mask)
+
+    def fill_spill(self, recon_events, event_mask=None):
+        """
+        Fill with the track statistics of a sequence of recon events.
+        """
+        self.fill_arrays(PRTrackArrays(recon_events), len(recon_events),
+                         event_mask)
+
+    def merge(self, other):
+        """
+        Add the counts of another TrackEfficiencyBatch.
+        """
+        self.all_tracks += other.all_tracks
+        self.feducial_tracks += other.feducial_tracks
+
+    def compute(self):
+        """
+        Calculate the efficiency of 5-spacepoint tracks, and of any
+        track, per tracker (as TrackEfficiency.compute).
+        """
+        results = {}
+        for tracker in range(2):
+            for label, counts in [("all", self.all_tracks[tracker]),
+                                  ("fed", self.feducial_tracks[tracker])]:
+                total = counts.sum()
+                results["eff_%s_5p_%i" % (label, tracker)] = \
+                    self.efficiency(counts[5], total)
+                results["eff_%s_all_%i" % (label, tracker)] = \
+                    self.efficiency(counts[1:6].sum(), total)
+        self.results = results
+        return results
+
+    def efficiency(self, hit, total):
+        """
+        Return efficiency and errors:
+        """
+        if total > 0:
+            return float(hit)/total, math.sqrt(hit)/total
+        return 0, 1
+
+
 ############################################################################
 class StationSpacePointEfficiency:
     """
@@ -272,13 +456,13 @@ class StationSpacePointEfficiency:
         self.c_doublet = 0
         self.c_nothing = 0
 
-        # Make ROOT Objects:
-        self.triplet_ly = ROOT.TH1D(self.name+"_triplet_ly",
-                                    self.name+"_triplet_ly",
-                                    30, -0.5, 29.5)
-        self.doublet_ly = ROOT.TH1D(self.name+"_doublet_ly",
-                                    self.name+"_doublet_ly",
-                                    30, -0.5, 29.5)
+        # Make histograms (converted to ROOT in compute/getTObjects):
+        self.triplet_ly = Hist1D(self.name+"_triplet_ly",
+                                 self.name+"_triplet_ly",
+                                 30, -0.5, 29.5)
+        self.doublet_ly = Hist1D(self.name+"_doublet_ly",
+                                 self.name+"_doublet_ly",
+                                 30, -0.5, 29.5)
 
     def fill(self, recon_event):
         """
@@ -298,9 +482,8 @@ class StationSpacePointEfficiency:
                 if len(sp.get_channels()) == 3:
                     tripletfound = True
                     self.c_triplet += 1
-                    for cluster in sp.get_channels():
-                        self.triplet_ly.Fill\
-                            (UnsaturatedCluster(cluster))
+                    self.triplet_ly.fill([UnsaturatedCluster(cluster)
+                                          for cluster in sp.get_channels()])
                     # Found a triplet spacepoint, so no point
                     # to looking further.
                     break
@@ -310,6 +493,7 @@ class StationSpacePointEfficiency:
         # final step).
         doubletfound = False
         if not tripletfound:
+            doublet_npe = []
             for sp in recon_event.GetSciFiEvent().spacepoints():
                 if (sp.get_tracker() == self.tracker) and\
                    (sp.get_station() == self.station):
@@ -317,18 +501,64 @@ class StationSpacePointEfficiency:
                         doubletfound = True
                         self.c_doublet += 1
                         for cluster in sp.get_channels():
-                            self.doublet_ly.Fill\
-                                (UnsaturatedCluster(cluster))
+                            doublet_npe.append(UnsaturatedCluster(cluster))
+            self.doublet_ly.fill(doublet_npe)
 
         if not doubletfound and not tripletfound:
             self.c_nothing += 1
 
+    def fill_arrays(self, spacepoints, sp_clusters, cluster_npe,
+                    event_mask):
+        """
+        Batched equivalent of calling fill for every selected event
+        of a spill.
+
+        spacepoints and sp_clusters are the SciFiArrays.SpacePointArrays
+        and SpacePointClusterArrays of the spill's recon events,
+        cluster_npe is UnsaturatedClusterBatch of sp_clusters and
+        event_mask selects the recon events to add.
+        """
+        self.events += numpy.count_nonzero(event_mask)
+
+        sp_index = numpy.flatnonzero(
+            (spacepoints["tracker"] == self.tracker) &
+            (spacepoints["station"] == self.station) &
+            event_mask[spacepoints["event"]])
+        sp_event = spacepoints["event"][sp_index]
+        triplet = spacepoints["nchannels"][sp_index] == 3
+
+        # Only the first triplet of each event is used:
+        triplet_events, first = numpy.unique(sp_event[triplet],
+                                             return_index=True)
+        triplets = sp_index[triplet][first]
+        has_triplet = numpy.zeros(len(event_mask), dtype=bool)
+        has_triplet[triplet_events] = True
+
+        # All duplets of events without a triplet:
+        duplets = sp_index[~triplet & ~has_triplet[sp_event]]
+        has_doublet = numpy.zeros(len(event_mask), dtype=bool)
+        has_doublet[spacepoints["event"][duplets]] = True
+
+        self.c_triplet += len(triplets)
+        self.c_doublet += len(duplets)
+        self.c_nothing += numpy.count_nonzero(event_mask & ~has_triplet &
+                                              ~has_doublet)
+
+        n_sp = len(spacepoints["event"])
+        for sps, hist in [(triplets, self.triplet_ly),
+                          (duplets, self.doublet_ly)]:
+            chosen = numpy.zeros(n_sp, dtype=bool)
+            chosen[sps] = True
+            hist.fill(cluster_npe[chosen[sp_clusters["sp"]]])
+
     def compute(self):
         """
         Final step in the analysis process, use the light yields
         to accurately count the number of hits in this plane
         of the detector.
         """
+        import ROOT
+
         print ""
         print " ============================================="
         print " = Now Processing: Tracker %i, Station %i ======"\
@@ -342,14 +572,16 @@ class StationSpacePointEfficiency:
 
         # To understand the duplet stuff, we need to fit the light yields to
         # estimate the SNR from the duplets.
+        triplet_ly = self.triplet_ly.ToTH1D()
+        doublet_ly = self.doublet_ly.ToTH1D()
         bkg = ROOT.TF1("bkg", "expo", 2, 25)
-        tempfunc = TemplateFitter(self.triplet_ly, bkg)
+        tempfunc = TemplateFitter(triplet_ly, bkg)
         fit = ROOT.TF1("f", tempfunc, 2, 25, 4)
         fit.SetParameter(0, 0.05)
         fit.SetParameter(1, 100000)
         fit.FixParameter(2, 0)
         fit.SetParameter(3, -0.3)
-        self.doublet_ly.Fit(fit, "RQN", "", 2, 25)
+        doublet_ly.Fit(fit, "RQN", "", 2, 25)
 
         # Use template to estimate number of real duplets:
         print "Template fraction:",
@@ -399,15 +631,29 @@ class StationSpacePointEfficiency:
         
         return True
 
+    def merge(self, other):
+        """
+        Add the counts and light yields of another
+        StationSpacePointEfficiency (e.g. from another process).
+        """
+        self.events += other.events
+        self.c_triplet += other.c_triplet
+        self.c_doublet += other.c_doublet
+        self.c_nothing += other.c_nothing
+        self.triplet_ly.merge(other.triplet_ly)
+        self.doublet_ly.merge(other.doublet_ly)
+
     def getTObjects(self):
         """
         Function to collate and return all root objects:
         Loops over the dictionary - checking types to pull
-        out all ROOT objects.
+        out all ROOT objects, histograms are converted to ROOT.
         """
+        import ROOT
 
-        return {key : self.__dict__[key] for key in self.__dict__
-                if isinstance(self.__dict__[key], ROOT.TObject)}
+        return ToTObjects({key : self.__dict__[key] for key in self.__dict__
+                           if isinstance(self.__dict__[key],
+                                         (ROOT.TObject, Hist1D, Hist2D))})
 
     def getParams(self):
         """
@@ -0,0 +1,246 @@
+"""
+Pipeline of reader processes, which decode spills and extract them
+into columnar batches, and analyzer processes, which fill from those
+batches, so reading and analysis scale separately.
+
+Batches are passed through a fixed pool of shared memory slots
+(multiprocessing.RawArray). A reader copies the arrays of a batch into
+a free slot and sends only the layout (names, dtypes, shapes and
+offsets); the analyzer fills from read only numpy views of the slot,
+with no copy or pickling, and frees the slot when done. Each analyzer
+is pickled once at the end, to be merged into the result.
+
+extract(recon_events) returns a batch, {table: {column: array}}, or
+None to skip the spill. make_analyzer() returns an object with
+fill_batch(batch) and merge(other). fill_batch must not keep the
+arrays of a batch, the slot is reused as soon as it returns.
+
+pipeline = SharedPipeline(ExtractBatch, n_readers=2, n_analyzers=6)
+scan = pipeline.run(infiles, lambda: CutScan(configs))
+pipeline.print_summary()
+"""
+
+import time
+import traceback
+import multiprocessing
+
+import numpy
+
+from SpillReader import PrefetchReader
+
+_ALIGN = 16
+
+
+def _WriteBatch(slot, batch):
+    """
+    Copy a batch into a slot (a uint8 array), returns its layout.
+    """
+    layout = []
+    offset = 0
+    for table in sorted(batch):
+        for column in sorted(batch[table]):
+            array = numpy.ascontiguousarray(batch[table][column])
+            if array.dtype.hasobject:
+                raise TypeError("%s.%s: object arrays can not be shared" %
+                                (table, column))
+            end = offset + array.nbytes
+            if end > len(slot):
+                raise ValueError("Batch does not fit in a %i byte slot, "
+                                 "increase slot_mb" % len(slot))
+            slot[offset:end].view(array.dtype)[:] = array.ravel()
+            layout.append((table, column, array.dtype.str, array.shape,
+                           offset))
+            offset = end + (-end) % _ALIGN
+    return layout
+
+
+def _ReadBatch(slot, layout):
+    """
+    Read only views of the arrays of a batch in a slot.
+    """
+    batch = {}
+    for table, column, dtype, shape, offset in layout:
+        dtype = numpy.dtype(dtype)
+        size = int(numpy.prod(shape))*dtype.itemsize
+        array = slot[offset:offset + size].view(dtype).reshape(shape)
+        array.flags.writeable = False
+        batch.setdefault(table, {})[column] = array
+    return batch
+
+
+def _EntryRange(infiles, reader, n_readers, entries):
+    """
+    The chain entries [start, stop) read by one of n_readers.
+    """
+    if all(f in entries for f in infiles):
+        n_entries = sum(entries[f] for f in infiles)
+    else:
+        import ROOT
+
+        chain = ROOT.TChain("Spill")
+        for f in infiles:
+            chain.AddFile(f)
+        n_entries = chain.GetEntries()
+    return n_entries*reader//n_readers, n_entries*(reader + 1)//n_readers
+
+
+def _Reader(reader, n_readers, infiles, entries, extract, raw_slots, free,
+            batches, results, depth, type_index):
+    """
+    Reader process, extracts its share of the spills into free slots.
+    """
+    try:
+        slots = [numpy.frombuffer(raw, dtype=numpy.uint8)
+                 for raw in raw_slots]
+        stats = {"spills": 0, "bytes": 0, "read_wait_s": 0.,
+                 "extract_s": 0., "slot_wait_s": 0.}
+        start, stop = _EntryRange(infiles, reader, n_readers, entries)
+        if stop > start:
+            spills = PrefetchReader(infiles, depth=depth, start=start,
+                                    stop=stop, entries=entries,
+                                    type_index=type_index)
+            for entry, spill in spills:
+                t0 = time.time()
+                batch = extract(spill.GetReconEvents())
+                t1 = time.time()
+                stats["extract_s"] += t1 - t0
+                if batch is None:
+                    continue
+                slot = free.get()
+                stats["slot_wait_s"] += time.time() - t1
+                layout = _WriteBatch(slots[slot], batch)
+                batches.put((slot, layout))
+                stats["spills"] += 1
+                stats["bytes"] += sum(numpy.asarray(a).nbytes
+                                      for t in batch.values()
+                                      for a in t.values())
+            stats["read_wait_s"] = spills.summary()["wait_s"]
+        results.put(("reader", reader, stats, None))
+    except Exception:  # pylint: disable = W0703
+        results.put(("error", "reader %i" % reader, traceback.format_exc(),
+                     None))
+
+
+def _Analyzer(analyzer_id, make_analyzer, raw_slots, free, batches,
+              results):
+    """
+    Analyzer process, fills from batches until given None.
+    """
+    try:
+        slots = [numpy.frombuffer(raw, dtype=numpy.uint8)
+                 for raw in raw_slots]
+        stats = {"batches": 0, "batch_wait_s": 0., "fill_s": 0.}
+        analyzer = make_analyzer()
+        while True:
+            t0 = time.time()
+            item = batches.get()
+            t1 = time.time()
+            stats["batch_wait_s"] += t1 - t0
+            if item is None:
+                break
+            slot, layout = item
+            analyzer.fill_batch(_ReadBatch(slots[slot], layout))
+            free.put(slot)
+            stats["fill_s"] += time.time() - t1
+            stats["batches"] += 1
+        results.put(("analyzer", analyzer_id, stats, analyzer))
+    except Exception:  # pylint: disable = W0703
+        results.put(("error", "analyzer %i" % analyzer_id,
+                     traceback.format_exc(), None))
+
+
+class SharedPipeline:
+    """
+    Runs extract in n_readers processes and analyzers in n_analyzers
+    processes, connected by n_slots shared memory slots of slot_mb.
+    """
+
+    def __init__(self, extract, n_readers=1, n_analyzers=4, n_slots=None,
+                 slot_mb=8, depth=4, type_index=False):
+        """
+        Constructor, n_slots defaults to two per process. depth and
+        type_index are passed to each reader's SpillReader.
+        """
+        self.extract = extract
+        self.n_readers = n_readers
+        self.n_analyzers = n_analyzers
+        self.n_slots = n_slots or 2*(n_readers + n_analyzers)
+        self.slot_bytes = int(slot_mb*1024*1024)
+        self.depth = depth
+        self.type_index = type_index
+        self.stats = {}
+
+    def run(self, infiles, make_analyzer, entries=None):
+        """
+        Process infiles, returns the merged analyzer. entries maps
+        paths to known entry counts (e.g. FileManifest.entries).
+        """
+        entries = entries or {}
+        raw_slots = [multiprocessing.RawArray("b", self.slot_bytes)
+                     for i in range(self.n_slots)]
+        free = multiprocessing.Queue()
+        for slot in range(self.n_slots):
+            free.put(slot)
+        batches = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+
+        analyzers = [multiprocessing.Process(
+            target=_Analyzer, args=(i, make_analyzer, raw_slots, free,
+                                    batches, results))
+                     for i in range(self.n_analyzers)]
+        readers = [multiprocessing.Process(
+            target=_Reader, args=(i, self.n_readers, infiles, entries,
+                                  self.extract, raw_slots, free, batches,
+                                  results, self.depth, self.type_index))
+                   for i in range(self.n_readers)]
+        for process in analyzers + readers:
+            process.daemon = True
+            process.start()
+
+        start = time.time()
+        self.stats = {"readers": {}, "analyzers": {}}
+        merged = None
+        finished = False
+        try:
+            n_readers_done = 0
+            while len(self.stats["analyzers"]) < self.n_analyzers:
+                kind, name, stats, analyzer = results.get()
+                if kind == "error":
+                    raise RuntimeError("SharedPipeline %s failed:\n%s" %
+                                       (name, stats))
+                self.stats[kind + "s"][name] = stats
+                if kind == "reader":
+                    n_readers_done += 1
+                    if n_readers_done == self.n_readers:
+                        for i in range(self.n_analyzers):
+                            batches.put(None)
+                elif merged is None:
+                    merged = analyzer
+                else:
+                    merged.merge(analyzer)
+            finished = True
+        finally:
+            for process in analyzers + readers:
+                if not finished and process.is_alive():
+                    process.terminate()
+                process.join()
+        self.stats["wall_s"] = time.time() - start
+        return merged
+
+    def print_summary(self):
+        """
+        Print the time each process spent working and waiting, to see
+        whether reading or analysis limits the rate.
+        """
+        wall = max(self.stats.get("wall_s", 0), 1e-9)
+        for reader, stats in sorted(self.stats["readers"].items()):
+            print "Reader %i: %i spills, %.1f MB, extract %.1f s, " \
+                "wait for reads %.1f s, wait for slots %.1f s" % \
+                (reader, stats["spills"], stats["bytes"]/1e6,
+                 stats["extract_s"], stats["read_wait_s"],
+                 stats["slot_wait_s"])
+        for analyzer, stats in sorted(self.stats["analyzers"].items()):
+            print "Analyzer %i: %i batches, fill %.1f s (%.0f%% busy), " \
+                "wait for batches %.1f s" % \
+                (analyzer, stats["batches"], stats["fill_s"],
+                 100.*stats["fill_s"]/wall, stats["batch_wait_s"])
@@ -0,0 +1,211 @@
+"""
+Read spills from a chain of recon files in a background thread, so
+the decompression of the next spills overlaps with the analysis of the
+current one.
+
+The reader thread decodes up to depth spills ahead into a small pool
+of MAUS.Data buffers and hands them to the analysis loop through a
+bounded queue. A buffer goes back to the reader when the loop asks for
+the next spill, so a spill (and anything taken from it) is only valid
+until the next iteration, as with a single Data and chain.GetEntry.
+
+reader = PrefetchReader(infiles, depth=4)
+for entry, spill in reader:
+    fill(spill.GetReconEvents())
+print reader.summary()
+"""
+
+import sys
+import time
+import Queue
+import threading
+
+from SpillTypeIndex import SelectedEntries
+
+_END = "end"
+_ERROR = "error"
+
+
+def _ReleaseGIL(method):
+    """
+    Let PyROOT drop the GIL while a C++ method runs, so the analysis
+    thread can carry on during it. Old PyROOT and cppyy use different
+    flags, both are set.
+    """
+    for flag in ("_threaded", "__release_gil__"):
+        try:
+            setattr(method, flag, True)
+        except (AttributeError, TypeError):
+            pass
+
+
+class PrefetchReader:
+    """
+    Iterates over the spills of infiles, as (chain entry, spill),
+    decoding them ahead in a background thread.
+
+    Only spills of event_types are handed over (all if None). start
+    and stop limit the chain entries read (stop 0 is the end).
+    implicit_mt > 0 enables ROOT's multithreaded decompression with
+    that many threads. entries maps paths to known entry counts (e.g.
+    FileManifest.entries), so the files are not opened to count them.
+    With type_index, entries not of event_types are found from the
+    SpillTypeIndex of each file and never read.
+    """
+
+    def __init__(self, infiles, depth=4, event_types=("physics_event",),
+                 start=0, stop=0, implicit_mt=0, tree_name="Spill",
+                 entries=None, type_index=False):
+        """
+        Constructor, opens the chain and starts the reader thread.
+        """
+        import ROOT
+        import libMausCpp  # pylint: disable = W0611
+
+        if hasattr(ROOT.ROOT, "EnableThreadSafety"):
+            ROOT.ROOT.EnableThreadSafety()
+        if implicit_mt > 0 and hasattr(ROOT.ROOT, "EnableImplicitMT"):
+            ROOT.ROOT.EnableImplicitMT(implicit_mt)
+        _ReleaseGIL(ROOT.TChain.GetEntry)
+
+        self.chain = ROOT.TChain(tree_name)
+        entries = entries or {}
+        for f in infiles:
+            if f in entries:
+                self.chain.AddFile(f, entries[f])
+            else:
+                self.chain.AddFile(f)
+        self.n_entries = self.chain.GetEntries()
+        self.start = start
+        self.stop = min(stop, self.n_entries) if stop > 0 else self.n_entries
+        self.event_types = event_types
+        if type_index and event_types is not None:
+            selected = SelectedEntries(infiles, event_types)
+            self.entries = selected[(selected >= self.start) &
+                                    (selected < self.stop)].tolist()
+        else:
+            self.entries = range(self.start, self.stop)
+
+        # depth buffers queued, one being read and one being analysed:
+        self._free = Queue.Queue()
+        for i in range(depth + 2):
+            self._free.put(ROOT.MAUS.Data())  # pylint: disable = E1101
+        self._ready = Queue.Queue(depth)
+        self._current = None
+        self._stopping = threading.Event()
+
+        self.read_time = 0.
+        self.wait_time = 0.
+        self.n_read = 0
+        self.n_handed = 0
+
+        self._thread = threading.Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, queue, item):
+        """
+        Put to a queue, giving up if the reader is being closed.
+        """
+        while not self._stopping.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get_free(self):
+        """
+        Take a free buffer, None if the reader is being closed.
+        """
+        while not self._stopping.is_set():
+            try:
+                return self._free.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        return None
+
+    def _read(self):
+        """
+        Reader thread, decodes the entries into free buffers.
+        """
+        try:
+            address = None
+            data = None
+            for entry in self.entries:
+                if data is None:
+                    data = self._get_free()
+                    if data is None:
+                        return
+                if data is not address:
+                    self.chain.SetBranchAddress("data", data)
+                    address = data
+                start = time.time()
+                self.chain.GetEntry(entry)
+                self.read_time += time.time() - start
+                self.n_read += 1
+
+                if self.event_types is not None and \
+                        data.GetSpill().GetDaqEventType() \
+                        not in self.event_types:
+                    continue  # Reuse the buffer for the next entry
+                if not self._put(self._ready, (entry, data)):
+                    return
+                data = None
+            self._put(self._ready, (_END, None))
+        except Exception:  # pylint: disable = W0703
+            self._put(self._ready, (_ERROR, sys.exc_info()))
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """
+        The next (entry, spill), the previous spill's buffer is given
+        back to the reader.
+        """
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        if self._stopping.is_set():
+            raise StopIteration
+
+        start = time.time()
+        entry, data = self._ready.get()
+        self.wait_time += time.time() - start
+
+        if entry == _END:
+            self.close()
+            raise StopIteration
+        if entry == _ERROR:
+            self.close()
+            raise data[0], data[1], data[2]
+        self._current = data
+        self.n_handed += 1
+        return entry, data.GetSpill()
+
+    __next__ = next
+
+    def close(self):
+        """
+        Stop the reader thread, safe to call more than once.
+        """
+        self._stopping.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def summary(self):
+        """
+        Reading statistics, wait is the time the analysis loop spent
+        waiting for spills (the I/O not hidden behind the analysis).
+        """
+        return {"entries_read": self.n_read,
+                "spills": self.n_handed,
+                "read_s": self.read_time,
+                "wait_s": self.wait_time}
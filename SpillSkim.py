@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Copy selected spills into a small ROOT file with the same "Spill" tree
+layout, so follow up studies need not re-read the full recon files.
+
+The skim can be used in place of the original files by any of the
+scripts. A provenance map back to the original files is stored in the
+skim as a TNamed called "Provenance" holding json.
+"""
+
+import json
+import argparse
+
+
+class SpillSkim:
+    """
+    Collect selected (file, entry, event) during a scan, then write the
+    spills holding them to a new file.
+    """
+
+    def __init__(self, outpath):
+        """
+        Constructor, stores where the skim will be written.
+        """
+        self.outpath = outpath
+        self.selected = {}
+
+    def add(self, path, entry, event_number=None):
+        """
+        Select a spill by file and tree entry, with the event within
+        it which caused the selection.
+        """
+        events = self.selected.setdefault((path, entry), [])
+        if event_number is not None and event_number not in events:
+            events.append(event_number)
+
+    def add_chain_entry(self, chain, event_number=None):
+        """
+        Select the spill last read from a TChain.
+        """
+        self.add(chain.GetCurrentFile().GetName(),
+                 chain.GetTree().GetReadEntry(), event_number)
+
+    def write(self):
+        """
+        Write all the selected spills, returning the provenance list.
+        """
+        import ROOT
+        import libMausCpp  # pylint: disable = W0611
+
+        if not self.selected:
+            print "No spills selected, %s not written" % self.outpath
+            return []
+
+        paths = sorted(set(path for path, entry in self.selected))
+
+        chain = ROOT.TChain("Spill")
+        for path in paths:
+            chain.AddFile(path)
+        data = ROOT.MAUS.Data()  # pylint: disable = E1101
+        chain.SetBranchAddress("data", data)
+        chain.GetEntries()
+        offsets = chain.GetTreeOffset()
+
+        out_file = ROOT.TFile(self.outpath, "RECREATE")  # pylint: disable = E1101
+        skim_tree = chain.CloneTree(0)
+
+        provenance = []
+        for path, entry in sorted(self.selected):
+            chain.GetEntry(offsets[paths.index(path)] + entry)
+            skim_tree.Fill()
+            spill = data.GetSpill()
+            provenance.append({"skim_entry": len(provenance),
+                               "file": path,
+                               "entry": entry,
+                               "run": spill.GetRunNumber(),
+                               "spill": spill.GetSpillNumber(),
+                               "events": self.selected[(path, entry)]})
+
+        out_file.cd()
+        skim_tree.Write()
+        ROOT.TNamed("Provenance", json.dumps(provenance)).Write()
+        out_file.Close()
+
+        print "Skimmed %i spills from %i files into %s" % \
+            (len(provenance), len(paths), self.outpath)
+
+        return provenance
+
+
+def ReadProvenance(path):
+    """
+    Return the provenance list stored in a skim file.
+    """
+    import ROOT
+
+    root_file = ROOT.TFile(path, "READ")  # pylint: disable = E1101
+    provenance = json.loads(root_file.Get("Provenance").GetTitle())
+    root_file.Close()
+    return provenance
+
+
+if __name__ == "__main__":
+
+    from EventIndex import EventIndex, ReadEventList
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outpath", help="the skim file to write", type=str)
+    parser.add_argument("index_path", help="an EventIndex of the input files",
+                        type=str)
+    parser.add_argument("run", help="run number of the event list", type=int)
+    parser.add_argument("events", help="event list (spill*1000 + event)",
+                        type=str)
+    args = parser.parse_args()
+
+    index = EventIndex(args.index_path)
+    skim = SpillSkim(args.outpath)
+    for spill, event in ReadEventList(args.events):
+        path, entry = index.locate(args.run, spill, event)
+        skim.add(path, entry, event)
+    skim.write()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""
+Index of the DAQ event type of every spill of a recon file, saved next
+to the file, so loops can skip start/end of burst, run and calibration
+spills without decoding them.
+
+The index is built reading only the daq event type branch of the
+Spill tree (the whole entry if the tree is not split), and is rebuilt
+when the file's size or mtime changes.
+
+entries = SelectedEntries(infiles, ("physics_event",))
+for entry in entries:
+    chain.GetEntry(entry)
+"""
+
+import os
+import argparse
+
+import numpy
+
+INDEX_SUFFIX = ".spilltypes.npz"
+
+
+def IndexPath(path, index_dir=None):
+    """
+    The index file of a recon file, next to it unless index_dir given.
+    """
+    base = os.path.splitext(path)[0] + INDEX_SUFFIX
+    if index_dir is not None:
+        return os.path.join(index_dir, os.path.basename(base))
+    return base
+
+
+def ReadSpillTypes(path):
+    """
+    DAQ event type of each entry of a file, reading as little as
+    possible.
+    """
+    import ROOT
+    import libMausCpp  # pylint: disable = W0611
+
+    root_file = ROOT.TFile(path, "READ")  # pylint: disable = E1101
+    tree = root_file.Get("Spill")
+    data = ROOT.MAUS.Data()  # pylint: disable = E1101
+    tree.SetBranchAddress("data", data)
+
+    split = any("daq_event_type" in leaf.GetName()
+                for leaf in tree.GetListOfLeaves())
+    if split:
+        tree.SetBranchStatus("*", 0)
+        tree.SetBranchStatus("data", 1)
+        tree.SetBranchStatus("*daq_event_type*", 1)
+
+    types = []
+    for entry in range(tree.GetEntries()):
+        tree.GetEntry(entry)
+        spill = data.GetSpill()
+        types.append(str(spill.GetDaqEventType()) if spill else "")
+
+    # Fall back to full reads if the light read gave no types:
+    if split and types and not any(types):
+        tree.SetBranchStatus("*", 1)
+        types = []
+        for entry in range(tree.GetEntries()):
+            tree.GetEntry(entry)
+            types.append(str(data.GetSpill().GetDaqEventType()))
+    root_file.Close()
+    return types
+
+
+def SpillTypes(path, index_dir=None):
+    """
+    Array of the DAQ event type of each entry of a file, from its
+    index, which is built (or rebuilt) if needed.
+    """
+    index_path = IndexPath(path, index_dir)
+    stat = (os.path.getsize(path), os.path.getmtime(path))
+    if os.path.exists(index_path):
+        saved = numpy.load(index_path)
+        if (int(saved["size"]), float(saved["mtime"])) == stat:
+            return saved["names"][saved["codes"]]
+
+    print "Indexing spill types: ", path
+    types = ReadSpillTypes(path)
+    names, codes = numpy.unique(numpy.array(types, dtype=str),
+                                return_inverse=True)
+    try:
+        with open(index_path, "wb") as f:
+            numpy.savez(f, names=names, codes=codes.astype(numpy.uint8),
+                        size=stat[0], mtime=stat[1])
+    except IOError as error:
+        print "Spill type index not saved: %s" % error
+    return names[codes]
+
+
+def SelectedEntries(infiles, event_types=("physics_event",),
+                    index_dir=None):
+    """
+    Chain entries (over infiles, in order) of the spills of
+    event_types.
+    """
+    selected = []
+    offset = 0
+    for path in infiles:
+        types = SpillTypes(path, index_dir)
+        selected.append(offset + numpy.flatnonzero(
+            numpy.in1d(types, list(event_types))))
+        offset += len(types)
+    if not selected:
+        return numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate(selected).astype(numpy.int64)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("infiles", help="recon files to index", type=str,
+                        nargs="+")
+    parser.add_argument("--index-dir", help="directory for the indices "
+                        "(default next to each file)", type=str,
+                        default=None)
+    args = parser.parse_args()
+
+    for infile in args.infiles:
+        names, counts = numpy.unique(SpillTypes(infile, args.index_dir),
+                                     return_counts=True)
+        print infile, ", ".join("%s: %i" % (n, c)
+                                for n, c in zip(names, counts))
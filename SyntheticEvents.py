@@ -0,0 +1,589 @@
+"""
+Synthetic MAUS like recon events, for testing and benchmarking the
+tools without a MAUS installation or recon files.
+
+Muons are generated through both trackers as straight lines (or
+helices with field), digitised into the three planes of every station
+(with the kuno sum of the channel numbers), and clusters, spacepoints,
+pattern recognition tracks and TOF spacepoints made from them. Dead
+channels, plane inefficiency, saturation and noise clusters (which
+form noise duplets) are included.
+
+The objects provide the get_* / Get* accessors used by the scripts,
+so they can be passed to any function expecting MAUS objects:
+
+generator = SyntheticEvents(seed=1)
+for spill in generator.spills(10, events_per_spill=50):
+    for recon_event in spill.GetReconEvents():
+        spe.fill(recon_event)
+"""
+
+import math
+
+import numpy
+
+# Station positions along each tracker (tracker coordinates, mm):
+STATION_Z = [0.0, 200.0, 450.0, 750.0, 1100.0]
+PLANE_ANGLES = [0.0, 2*math.pi/3, 4*math.pi/3]
+CHANNEL_PITCH = 1.4945  # mm per channel (7 fibres)
+CENTRE_CHANNEL = 106.0  # so a triplet sums to 318
+ADC_PEDESTAL = 20
+ADC_GAIN = 12
+
+
+class MockVector(list):
+    """
+    List with the std::vector / TRefArray accessors.
+    """
+
+    def size(self):
+        return len(self)
+
+    def GetEntries(self):
+        return len(self)
+
+    def GetEntriesFast(self):
+        return len(self)
+
+
+class MockThreeVector(object):
+    """
+    ThreeVector with x(), y(), z().
+    """
+
+    def __init__(self, x, y, z):
+        self._xyz = (x, y, z)
+
+    def x(self):
+        return self._xyz[0]
+
+    def y(self):
+        return self._xyz[1]
+
+    def z(self):
+        return self._xyz[2]
+
+
+class MockDigit(object):
+    """
+    SciFiDigit.
+    """
+
+    def __init__(self, tracker, station, plane, channel, npe, adc):
+        self._values = (tracker, station, plane, channel, npe, adc)
+
+    def get_tracker(self):
+        return self._values[0]
+
+    def get_station(self):
+        return self._values[1]
+
+    def get_plane(self):
+        return self._values[2]
+
+    def get_channel(self):
+        return self._values[3]
+
+    def get_npe(self):
+        return self._values[4]
+
+    def get_adc(self):
+        return self._values[5]
+
+
+class MockCluster(object):
+    """
+    SciFiCluster, channel is the mean channel of its digits.
+    """
+
+    def __init__(self, tracker, station, plane, digits):
+        self._tracker, self._station, self._plane = tracker, station, plane
+        self._digits = MockVector(digits)
+        self._channel = sum(d.get_channel() for d in digits) / \
+            float(len(digits))
+        self._npe = sum(d.get_npe() for d in digits)
+        self._used = False
+
+    def get_tracker(self):
+        return self._tracker
+
+    def get_station(self):
+        return self._station
+
+    def get_plane(self):
+        return self._plane
+
+    def get_channel(self):
+        return self._channel
+
+    def get_npe(self):
+        return self._npe
+
+    def get_digits(self):
+        return self._digits
+
+    def is_used(self):
+        return self._used
+
+
+class MockSpacePoint(object):
+    """
+    SciFiSpacePoint made of 2 (duplet) or 3 (triplet) clusters.
+    """
+
+    def __init__(self, tracker, station, clusters, position):
+        self._tracker, self._station = tracker, station
+        self._clusters = MockVector(clusters)
+        self._position = MockThreeVector(*position)
+        self._used = False
+        for cluster in clusters:
+            cluster._used = True
+
+    def get_tracker(self):
+        return self._tracker
+
+    def get_station(self):
+        return self._station
+
+    def get_channels(self):
+        return self._clusters
+
+    def get_npe(self):
+        return sum(c.get_npe() for c in self._clusters)
+
+    def get_position(self):
+        return self._position
+
+    def get_type(self):
+        return "triplet" if len(self._clusters) == 3 else "duplet"
+
+    def is_used(self):
+        return self._used
+
+
+class MockStraightPRTrack(object):
+    """
+    SciFiStraightPRTrack.
+    """
+
+    def __init__(self, tracker, spacepoints, x0, y0, mx, my):
+        self._tracker = tracker
+        self._spacepoints = MockVector(spacepoints)
+        self._params = (x0, y0, mx, my)
+        for sp in spacepoints:
+            sp._used = True
+
+    def get_tracker(self):
+        return self._tracker
+
+    def get_spacepoints(self):
+        return self._spacepoints
+
+    def get_x0(self):
+        return self._params[0]
+
+    def get_y0(self):
+        return self._params[1]
+
+    def get_mx(self):
+        return self._params[2]
+
+    def get_my(self):
+        return self._params[3]
+
+
+class MockHelicalPRTrack(object):
+    """
+    SciFiHelicalPRTrack, x = circle_x0 + R cos(phi), with
+    phi = (dsdz*z + line_sz_c)/R.
+    """
+
+    def __init__(self, tracker, spacepoints, circle_x0, circle_y0, radius,
+                 dsdz, line_sz_c):
+        self._tracker = tracker
+        self._spacepoints = MockVector(spacepoints)
+        self._params = (circle_x0, circle_y0, radius, dsdz, line_sz_c)
+        for sp in spacepoints:
+            sp._used = True
+
+    def get_tracker(self):
+        return self._tracker
+
+    def get_spacepoints(self):
+        return self._spacepoints
+
+    def get_circle_x0(self):
+        return self._params[0]
+
+    def get_circle_y0(self):
+        return self._params[1]
+
+    def get_R(self):
+        return self._params[2]
+
+    def get_dsdz(self):
+        return self._params[3]
+
+    def get_line_sz_c(self):
+        return self._params[4]
+
+
+class MockSciFiEvent(object):
+    """
+    SciFiEvent.
+    """
+
+    def __init__(self, clusters, spacepoints, straight, helical):
+        self._clusters = MockVector(clusters)
+        self._spacepoints = MockVector(spacepoints)
+        self._straight = MockVector(straight)
+        self._helical = MockVector(helical)
+
+    def clusters(self):
+        return self._clusters
+
+    def spacepoints(self):
+        return self._spacepoints
+
+    def straightprtracks(self):
+        return self._straight
+
+    def helicalprtracks(self):
+        return self._helical
+
+    def scifitracks(self):
+        return MockVector()
+
+
+class MockTOFSpacePoint(object):
+    """
+    TOFSpacePoint.
+    """
+
+    def __init__(self, time, hslab, vslab):
+        self._values = (time, hslab, vslab)
+
+    def GetTime(self):
+        return self._values[0]
+
+    def GetHorizSlab(self):
+        return self._values[1]
+
+    def GetVertSlab(self):
+        return self._values[2]
+
+
+class MockTOFSlabHit(object):
+    """
+    TOFSlabHit.
+    """
+
+    def __init__(self, plane, slab):
+        self._plane, self._slab = plane, slab
+
+    def GetPlane(self):
+        return self._plane
+
+    def GetSlab(self):
+        return self._slab
+
+
+class MockTOFStations(object):
+    """
+    TOFEventSpacePoint / TOFEventSlabHit, arrays for TOF0, 1 and 2.
+    """
+
+    def __init__(self, arrays):
+        self._arrays = [MockVector(a) for a in arrays]
+
+    def GetTOF0SpacePointArray(self):
+        return self._arrays[0]
+
+    def GetTOF1SpacePointArray(self):
+        return self._arrays[1]
+
+    def GetTOF2SpacePointArray(self):
+        return self._arrays[2]
+
+    def GetTOF0SlabHitArray(self):
+        return self._arrays[0]
+
+    def GetTOF1SlabHitArray(self):
+        return self._arrays[1]
+
+    def GetTOF2SlabHitArray(self):
+        return self._arrays[2]
+
+
+class MockTOFEvent(object):
+    """
+    TOFEvent.
+    """
+
+    def __init__(self, spacepoints, slab_hits):
+        self._spacepoints = MockTOFStations(spacepoints)
+        self._slab_hits = MockTOFStations(slab_hits)
+
+    def GetTOFEventSpacePoint(self):
+        return self._spacepoints
+
+    def GetTOFEventSlabHit(self):
+        return self._slab_hits
+
+
+class MockReconEvent(object):
+    """
+    ReconEvent.
+    """
+
+    def __init__(self, event_number, scifi_event, tof_event):
+        self._event_number = event_number
+        self._scifi_event = scifi_event
+        self._tof_event = tof_event
+
+    def GetPartEventNumber(self):
+        return self._event_number
+
+    def GetSciFiEvent(self):
+        return self._scifi_event
+
+    def GetTOFEvent(self):
+        return self._tof_event
+
+
+class MockSpill(object):
+    """
+    Spill.
+    """
+
+    def __init__(self, run_number, spill_number, recon_events,
+                 daq_event_type="physics_event"):
+        self._run_number = run_number
+        self._spill_number = spill_number
+        self._recon_events = MockVector(recon_events)
+        self._daq_event_type = daq_event_type
+
+    def GetRunNumber(self):
+        return self._run_number
+
+    def GetSpillNumber(self):
+        return self._spill_number
+
+    def GetDaqEventType(self):
+        return self._daq_event_type
+
+    def GetReconEvents(self):
+        return self._recon_events
+
+
+class SyntheticEvents:
+    """
+    Generator of synthetic recon events.
+    """
+
+    def __init__(self, seed=1, field=False, track_probability=0.9,
+                 plane_efficiency=0.99, dead_fraction=0.005,
+                 noise_clusters=1.0, light_yield=10.0, saturation_pe=18.0,
+                 tof01=29.0, tof12=30.0, run_number=9999):
+        """
+        Constructor, the dead channels are chosen from the seed.
+
+        noise_clusters is the mean number of noise clusters per plane
+        per event, light_yield the mean npe of a muon cluster.
+        """
+        self.rng = numpy.random.RandomState(seed)
+        self.field = field
+        self.track_probability = track_probability
+        self.plane_efficiency = plane_efficiency
+        self.noise_clusters = noise_clusters
+        self.light_yield = light_yield
+        self.saturation_pe = saturation_pe
+        self.tof01 = tof01
+        self.tof12 = tof12
+        self.run_number = run_number
+        self.dead = self.rng.rand(2, 5, 3, 215) < dead_fraction
+        self._n_spills = 0
+
+    def channel(self, tracker, station, plane, x, y):
+        """
+        Channel hit by a particle at (x, y), the three planes sum to
+        the kuno total (319.5 for tracker 1 station 5).
+        """
+        angle = PLANE_ANGLES[plane]
+        channel = CENTRE_CHANNEL + \
+            (x*math.cos(angle) + y*math.sin(angle))/CHANNEL_PITCH
+        if tracker == 1 and station == 5 and plane == 0:
+            channel += 1.5
+        return channel
+
+    def _digits(self, tracker, station, plane, channel, npe):
+        """
+        Digits of a cluster, split over two channels if the hit is
+        near a channel edge. Channels outside the plane are dropped.
+        """
+        first = int(round(channel))
+        shares = [(first, 1.0)]
+        if abs(channel - first) > 0.3:
+            other = first + (1 if channel > first else -1)
+            shares = [(first, 0.6), (other, 0.4)]
+
+        digits = []
+        for ch, share in shares:
+            if ch < 0 or ch > 214 or self.dead[tracker, station - 1,
+                                               plane, ch]:
+                continue
+            digit_npe = round(npe*share, 1)
+            adc = int(ADC_PEDESTAL + ADC_GAIN*digit_npe)
+            if digit_npe >= self.saturation_pe or adc > 255:
+                adc = 255
+            digits.append(MockDigit(tracker, station, plane, ch, digit_npe,
+                                    adc))
+        return digits
+
+    def _track_params(self, tracker):
+        """
+        Random straight line or helix parameters for a muon.
+        """
+        rng = self.rng
+        if self.field:
+            radius = rng.uniform(20, 80)
+            return {"circle_x0": rng.normal(0, 30),
+                    "circle_y0": rng.normal(0, 30), "R": radius,
+                    "dsdz": rng.uniform(0.1, 0.4),
+                    "line_sz_c": rng.uniform(0, 2*math.pi*radius)}
+        return {"x0": rng.normal(0, 50), "y0": rng.normal(0, 50),
+                "mx": rng.normal(0, 0.02), "my": rng.normal(0, 0.02)}
+
+    def _position(self, params, z):
+        """
+        Track position at z.
+        """
+        if self.field:
+            phi = (params["dsdz"]*z + params["line_sz_c"])/params["R"]
+            return (params["circle_x0"] + params["R"]*math.cos(phi),
+                    params["circle_y0"] + params["R"]*math.sin(phi))
+        return (params["x0"] + z*params["mx"], params["y0"] + z*params["my"])
+
+    def _tracker(self, tracker, has_muon):
+        """
+        Clusters, spacepoints and tracks of one tracker.
+        """
+        rng = self.rng
+        clusters, spacepoints, tracks = [], [], []
+        params = self._track_params(tracker) if has_muon else None
+
+        track_sps = []
+        for station in range(1, 6):
+            z = STATION_Z[station - 1]
+            muon_clusters = []
+            if has_muon:
+                x, y = self._position(params, z)
+                npe = rng.poisson(self.light_yield, 3)
+                for plane in range(3):
+                    if rng.rand() > self.plane_efficiency:
+                        continue
+                    digits = self._digits(tracker, station, plane,
+                                          self.channel(tracker, station,
+                                                       plane, x, y),
+                                          npe[plane])
+                    if digits:
+                        muon_clusters.append(MockCluster(tracker, station,
+                                                         plane, digits))
+
+            # Noise clusters, pairs of which form noise duplets:
+            noise = []
+            for plane in range(3):
+                for i in range(rng.poisson(self.noise_clusters)):
+                    digits = self._digits(tracker, station, plane,
+                                          rng.uniform(0, 214),
+                                          rng.exponential(1.5) + 1)
+                    if digits:
+                        noise.append(MockCluster(tracker, station, plane,
+                                                 digits))
+            clusters.extend(muon_clusters + noise)
+
+            if len(muon_clusters) >= 2:
+                sp = MockSpacePoint(tracker, station, muon_clusters,
+                                    (x, y, z))
+                spacepoints.append(sp)
+                track_sps.append(sp)
+            for a, b in zip(noise[::2], noise[1::2]):
+                if a.get_plane() != b.get_plane() and rng.rand() < 0.3:
+                    spacepoints.append(MockSpacePoint(
+                        tracker, station, [a, b],
+                        (rng.normal(0, 80), rng.normal(0, 80), z)))
+
+        if len(track_sps) >= 3:
+            if self.field:
+                tracks.append(MockHelicalPRTrack(
+                    tracker, track_sps, params["circle_x0"],
+                    params["circle_y0"], params["R"], params["dsdz"],
+                    params["line_sz_c"]))
+            else:
+                tracks.append(MockStraightPRTrack(
+                    tracker, track_sps, params["x0"], params["y0"],
+                    params["mx"], params["my"]))
+
+        return clusters, spacepoints, tracks
+
+    def _tof_event(self, has_muon):
+        """
+        TOF spacepoints and slab hits, TOF1 is the trigger at t~0.
+        """
+        rng = self.rng
+        tof1_time = rng.normal(0, 0.2)
+        tof1 = [MockTOFSpacePoint(tof1_time, rng.randint(0, 7),
+                                  rng.randint(0, 7))]
+        tof0, tof2 = [], []
+        if has_muon:
+            tof0.append(MockTOFSpacePoint(
+                tof1_time - rng.normal(self.tof01, 1.0), rng.randint(0, 10),
+                rng.randint(0, 10)))
+            tof2.append(MockTOFSpacePoint(
+                tof1_time + rng.normal(self.tof12, 1.0), rng.randint(0, 10),
+                rng.randint(0, 10)))
+        if rng.rand() < 0.05:
+            tof1.append(MockTOFSpacePoint(rng.uniform(-500, 500),
+                                          rng.randint(0, 7),
+                                          rng.randint(0, 7)))
+
+        slab_hits = [[MockTOFSlabHit(p, sp.GetHorizSlab() if p == 0 else
+                                     sp.GetVertSlab()) for sp in array
+                      for p in range(2)] for array in (tof0, tof1, tof2)]
+        return MockTOFEvent([tof0, tof1, tof2], slab_hits)
+
+    def recon_event(self, event_number=0):
+        """
+        Generate one recon event.
+        """
+        has_muon = self.rng.rand() < self.track_probability
+        clusters, spacepoints, straight, helical = [], [], [], []
+        for tracker in range(2):
+            c, s, t = self._tracker(tracker, has_muon)
+            clusters.extend(c)
+            spacepoints.extend(s)
+            if self.field:
+                helical.extend(t)
+            else:
+                straight.extend(t)
+
+        scifi_event = MockSciFiEvent(clusters, spacepoints, straight,
+                                     helical)
+        return MockReconEvent(event_number, scifi_event,
+                              self._tof_event(has_muon))
+
+    def spill(self, events_per_spill=50):
+        """
+        Generate a physics spill.
+        """
+        spill = MockSpill(self.run_number, self._n_spills,
+                          [self.recon_event(i)
+                           for i in range(events_per_spill)])
+        self._n_spills += 1
+        return spill
+
+    def spills(self, n_spills, events_per_spill=50):
+        """
+        Generate a list of physics spills.
+        """
+        return [self.spill(events_per_spill) for i in range(n_spills)]
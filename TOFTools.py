@@ -5,6 +5,8 @@ A nice set of TOF tools for helping place cuts on the
 tracker data.
 """
 
+import numpy
+
 
 def TOFHit(SlabHitArray):
     """
@@ -138,3 +140,61 @@ def TimeInSpill(Spill, event_number):
     time = time_tag*0.8E-3 - 4.880
 
     return time
+
+
+def TOFArrays(recon_events, trigger_time=500, cleartime_ns=600):
+    """
+    Extract the TOF quantities used for event selection into numpy
+    arrays, so cuts can be applied to whole spills.
+
+    Per event: tof1_nsp, the number of TOF1 spacepoints within
+    cleartime_ns (see TOF1SingleHit), and the slabs of the first TOF1
+    and TOF2 spacepoints (-1 if none).
+
+    Per time: tof01_event/tof01_time and tof12_event/tof12_time, all
+    the times of TOF01Times and TOF12Times (with trigger_time).
+    """
+    per_event = {"tof1_nsp": [], "tof1_hslab": [], "tof1_vslab": [],
+                 "tof2_hslab": [], "tof2_vslab": []}
+    pairs = {"tof01_event": [], "tof01_time": [],
+             "tof12_event": [], "tof12_time": []}
+
+    for event, recon_event in enumerate(recon_events):
+        sps = recon_event.GetTOFEvent().GetTOFEventSpacePoint()
+        tof1_sps = sps.GetTOF1SpacePointArray()
+
+        n_within_window = 0
+        for tof1_sp in tof1_sps:
+            if abs(tof1_sp.GetTime()) < cleartime_ns:
+                n_within_window += 1
+        per_event["tof1_nsp"].append(n_within_window)
+
+        for name, array in [("tof1", tof1_sps),
+                            ("tof2", sps.GetTOF2SpacePointArray())]:
+            if len(array) > 0:
+                per_event[name + "_hslab"].append(array[0].GetHorizSlab())
+                per_event[name + "_vslab"].append(array[0].GetVertSlab())
+            else:
+                per_event[name + "_hslab"].append(-1)
+                per_event[name + "_vslab"].append(-1)
+
+        for name, times in [("tof01", TOF01Times(sps, trigger_time)),
+                            ("tof12", TOF12Times(sps, trigger_time))]:
+            pairs[name + "_event"].extend([event]*len(times))
+            pairs[name + "_time"].extend(times)
+
+    arrays = {key: numpy.array(per_event[key], dtype=numpy.int32)
+              for key in per_event}
+    for key in pairs:
+        dtype = numpy.int32 if key.endswith("_event") else numpy.float64
+        arrays[key] = numpy.array(pairs[key], dtype=dtype)
+    return arrays
+
+
+def TimeWindowHit(events, times, n_events, low_ns, high_ns):
+    """
+    Boolean array of the events with any time in (low_ns, high_ns),
+    e.g. TOF01CoincidenceTime for the tof01 times of TOFArrays.
+    """
+    inside = (times > low_ns) & (times < high_ns)
+    return numpy.bincount(events[inside], minlength=n_events)[:n_events] > 0
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the analysis tools on synthetic events (SyntheticEvents), so
+performance can be checked without MAUS or recon files.
+
+Every benchmark reports events (or histograms) per second. Those
+needing ROOT or MAUS are skipped when they can not be imported.
+Results can be saved with --output and compared against a previous
+run with --baseline, which fails if anything has slowed down by more
+than --tolerance.
+
+python benchmark.py --spills 20 --output bench.json
+python benchmark.py --spills 20 --baseline bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy
+
+from SyntheticEvents import SyntheticEvents
+
+
+class _Quiet:
+    """
+    Context to silence the per event printing of the tools.
+    """
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def BenchTOFCuts(spills, field_spills):
+    """
+    The per event TOFTools selections of SciFiEfficiencyV3/SciFiAlign.
+    """
+    import TOFTools
+
+    n = 0
+    with _Quiet():
+        for spill in spills:
+            for recon_event in spill.GetReconEvents():
+                tof_event = recon_event.GetTOFEvent()
+                if TOFTools.TOF12CoincidenceTime(tof_event, 0, 100):
+                    TOFTools.TOF1SingleHit(tof_event)
+                TOFTools.TOF01CoincidenceTime(tof_event, 28, 32)
+                TOFTools.TOF12Coincidence(tof_event)
+                n += 1
+    return n
+
+
+def BenchTOFArrays(spills, field_spills):
+    """
+    The TOF selections from TOFTools.TOFArrays.
+    """
+    from TOFTools import TOFArrays, TimeWindowHit
+
+    n = 0
+    for spill in spills:
+        recon_events = spill.GetReconEvents()
+        tof = TOFArrays(recon_events)
+        TimeWindowHit(tof["tof12_event"], tof["tof12_time"],
+                      len(recon_events), 0, 100) & (tof["tof1_nsp"] == 1)
+        TimeWindowHit(tof["tof01_event"], tof["tof01_time"],
+                      len(recon_events), 28, 32)
+        n += len(recon_events)
+    return n
+
+
+def BenchTrackEfficiency(spills, field_spills):
+    """
+    TrackEfficiency.fill for both trackers.
+    """
+    from SciFiTools import TrackEfficiency
+
+    tke = [TrackEfficiency(t, "tke_%i" % t) for t in range(2)]
+    n = 0
+    for spill in spills:
+        for recon_event in spill.GetReconEvents():
+            for t in tke:
+                t.fill(recon_event)
+            n += 1
+    return n
+
+
+def BenchTrackEfficiencyBatch(spills, field_spills):
+    """
+    TrackEfficiencyBatch.fill_spill.
+    """
+    from SciFiTools import TrackEfficiencyBatch
+
+    tke = TrackEfficiencyBatch()
+    n = 0
+    for spill in spills:
+        tke.fill_spill(spill.GetReconEvents())
+        n += len(spill.GetReconEvents())
+    return n
+
+
+def BenchStationEfficiency(spills, field_spills):
+    """
+    StationSpacePointEfficiency.fill for all 10 stations.
+    """
+    from SciFiTools import StationSpacePointEfficiency
+
+    spes = [StationSpacePointEfficiency(t, s, "bench_%i_%i" % (t, s))
+            for t in range(2) for s in range(1, 6)]
+    n = 0
+    for spill in spills:
+        for recon_event in spill.GetReconEvents():
+            for spe in spes:
+                spe.fill(recon_event)
+            n += 1
+    return n
+
+
+def BenchStationEfficiencyArrays(spills, field_spills):
+    """
+    StationSpacePointEfficiency.fill_arrays for all 10 stations.
+    """
+    from SciFiTools import StationSpacePointEfficiency, ClusterLightYields
+    from SciFiArrays import SpacePointArrays, SpacePointClusterArrays
+
+    spes = [StationSpacePointEfficiency(t, s, "bencha_%i_%i" % (t, s))
+            for t in range(2) for s in range(1, 6)]
+    n = 0
+    for spill in spills:
+        recon_events = spill.GetReconEvents()
+        spacepoints = SpacePointArrays(recon_events)
+        sp_clusters = SpacePointClusterArrays(recon_events)
+        npe, saturated = ClusterLightYields(sp_clusters)
+        mask = numpy.ones(len(recon_events), dtype=bool)
+        for spe in spes:
+            spe.fill_arrays(spacepoints, sp_clusters, npe, mask)
+        n += len(recon_events)
+    return n
+
+
+def BenchSciFiAlign(spills, field_spills):
+    """
+    SciFiAlign.fill on helical events.
+    """
+    from SciFiAlign import SciFiAlign
+
+    align = SciFiAlign()
+    n = 0
+    for spill in field_spills:
+        for recon_event in spill.GetReconEvents():
+            align.fill(recon_event)
+            n += 1
+    return n
+
+
+def BenchFindDeadChans(spills, field_spills):
+    """
+    FindDeadChansHist on the triplet channel hits of every plane,
+    the rate is histograms per second.
+    """
+    import ROOT
+    from SciFiTools import FindDeadChansHist
+
+    hists = {}
+    for tracker in range(2):
+        for station in range(1, 6):
+            for plane in range(3):
+                name = "bench_chist_%i_%i_%i" % (tracker, station, plane)
+                hists[(tracker, station, plane)] = \
+                    ROOT.TH1D(name, name, 220, -0.5, 219.5)
+    for spill in spills:
+        for recon_event in spill.GetReconEvents():
+            for sp in recon_event.GetSciFiEvent().spacepoints():
+                if len(sp.get_channels()) != 3:
+                    continue
+                for cluster in sp.get_channels():
+                    for digit in cluster.get_digits():
+                        hists[(sp.get_tracker(), sp.get_station(),
+                               digit.get_plane())].Fill(digit.get_channel())
+
+    for hist in hists.values():
+        FindDeadChansHist(hist)
+    return len(hists)
+
+
+def BenchArrayExtraction(spills, field_spills):
+    """
+    Extraction of the SciFiArrays tables.
+    """
+    from SciFiArrays import ClusterArrays, SpacePointArrays, \
+        SpacePointClusterArrays, PRTrackArrays
+
+    n = 0
+    for spill in spills:
+        recon_events = spill.GetReconEvents()
+        for extract in (ClusterArrays, SpacePointArrays,
+                        SpacePointClusterArrays, PRTrackArrays):
+            extract(recon_events)
+        n += len(recon_events)
+    return n
+
+
+def BenchSpacePointFinder(spills, field_spills):
+    """
+    SciFiSpacePointFinder.FindSpacePoints on extracted clusters.
+    """
+    from SciFiArrays import ClusterArrays
+    from SciFiSpacePointFinder import FindSpacePoints
+
+    tables = [ClusterArrays(s.GetReconEvents()) for s in spills]
+    start = time.time()
+    n = 0
+    for spill, clusters in zip(spills, tables):
+        FindSpacePoints(clusters)
+        n += len(spill.GetReconEvents())
+    return n, time.time() - start
+
+
+BENCHMARKS = [("tof_cuts", BenchTOFCuts),
+              ("tof_arrays", BenchTOFArrays),
+              ("track_efficiency", BenchTrackEfficiency),
+              ("track_efficiency_batch", BenchTrackEfficiencyBatch),
+              ("station_efficiency", BenchStationEfficiency),
+              ("station_efficiency_arrays", BenchStationEfficiencyArrays),
+              ("scifi_align", BenchSciFiAlign),
+              ("find_dead_chans", BenchFindDeadChans),
+              ("array_extraction", BenchArrayExtraction),
+              ("spacepoint_finder", BenchSpacePointFinder)]
+
+
+def RunBenchmarks(spills, field_spills, names=None, repeat=3):
+    """
+    Run the benchmarks (all, or those named), returning a dict of the
+    best rate of repeat runs, or None if skipped.
+    """
+    results = {}
+    for name, bench in BENCHMARKS:
+        if names and name not in names:
+            continue
+        best = None
+        try:
+            for i in range(repeat):
+                start = time.time()
+                rval = bench(spills, field_spills)
+                if isinstance(rval, tuple):
+                    count, elapsed = rval
+                else:
+                    count, elapsed = rval, time.time() - start
+                rate = count/max(elapsed, 1e-9)
+                best = rate if best is None else max(best, rate)
+        except ImportError as error:
+            print "%-28s skipped (%s)" % (name, error)
+            results[name] = None
+            continue
+        print "%-28s %12.1f /s" % (name, best)
+        results[name] = best
+    return results
+
+
+def CompareBaseline(results, baseline, tolerance):
+    """
+    Return the benchmarks slower than the baseline by more than
+    tolerance (a fraction).
+    """
+    slower = []
+    for name, rate in results.items():
+        reference = baseline.get(name)
+        if rate is None or reference is None:
+            continue
+        if rate < reference*(1 - tolerance):
+            slower.append(name)
+            print "SLOWER: %s %.1f /s, baseline %.1f /s" % \
+                (name, rate, reference)
+    return slower
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spills", help="number of synthetic spills",
+                        type=int, default=10)
+    parser.add_argument("--events", help="events per spill", type=int,
+                        default=50)
+    parser.add_argument("--seed", help="generator seed", type=int,
+                        default=1)
+    parser.add_argument("--repeat", help="runs per benchmark (best taken)",
+                        type=int, default=3)
+    parser.add_argument("--only", help="benchmarks to run", type=str,
+                        nargs="+", default=None)
+    parser.add_argument("--output", help="json file to save results",
+                        type=str, default=None)
+    parser.add_argument("--baseline", help="json results to compare with",
+                        type=str, default=None)
+    parser.add_argument("--tolerance", help="allowed slow down fraction",
+                        type=float, default=0.2)
+    args = parser.parse_args()
+
+    print "Generating %i spills of %i events" % (args.spills, args.events)
+    spills = SyntheticEvents(seed=args.seed).spills(args.spills, args.events)
+    field_spills = SyntheticEvents(seed=args.seed, field=True)\
+        .spills(args.spills, args.events)
+
+    results = RunBenchmarks(spills, field_spills, args.only, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if CompareBaseline(results, baseline, args.tolerance):
+            sys.exit(1)
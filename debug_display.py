@@ -16,6 +16,10 @@ import xboa.common
 import libMausCpp #pylint: disable = W0611
 import itertools
 
+from DAQTools import PedestalMap, StreamingCalibration
+from FrontEndLookup import FrontEndLookup
+from SciFiMultiplicity import MultiplicityAnalyzer
+
 def main():
     """
     Generates some data and then attempts to load it and make a simple histogram
@@ -24,6 +28,13 @@ def main():
     #my_file_name = "/home/ed/MICE/testdata/maus2_07333.root"
     my_file_name = "/home/ed/MICE/testdata/maus_output_new-mapping-calibration_run7333.root"
 
+    # Reference SciFi calibration/mapping, drifting channels are flagged:
+    maus_scifi_calibration='%s/files/calibration/scifi_calibration_20150912.txt'\
+        % os.environ.get("MAUS_ROOT_DIR")
+    maus_scifi_mapping='%s/files/cabling/scifi_mapping_2015-06-18.txt'\
+        % os.environ.get("MAUS_ROOT_DIR")
+    lookup = FrontEndLookup(maus_scifi_mapping, maus_scifi_calibration)
+
     print "Loading ROOT file", my_file_name
     root_file = ROOT.TFile(my_file_name, "READ") # pylint: disable = E1101
 
@@ -44,24 +55,16 @@ def main():
     n_clusters_tkd_good_hist.SetStats(False)
 
     # Ed's Fun additional super bonus plots:
-    peds_both_hist =  ROOT.TH2D("peds_both", "pedestals Both; channel no; ADC", 8192, -0.5, 8191.5, 256, -0.5, 255.5)
-    peds_both_hist.SetStats(False)
+    pedestals = PedestalMap("peds_both")
     
-    clusters_single_hist = ROOT.TH2D("clusters_singles", "clusters single Both; planeid [(tracker-1)*15 + (station-1)*3 + plane]; count/trigger", 30, -0.5, 29.5, 4, -0.5, 3.5)
-    clusters_single_hist.SetStats(False) 
-    clusters_double_hist = ROOT.TH2D("clusters_double", "clusters double Both; planeid [(tracker-1)*15 + (station-1)*3 + plane]; count/trigger", 30, -0.5, 29.5, 4, -0.5, 3.5)
-    clusters_double_hist.SetStats(False)
-
-    sp_duplets_hist = ROOT.TH2D("sp_duplets", "Duplets; stationid [(tracker-1)*5 + station-1]; count/trigger", 10, -0.5, 9.5, 4, -0.5, 3.5)
-    sp_duplets_hist.SetStats(False)
-    sp_triplet_hist = ROOT.TH2D("sp_triplets", "Triplets; stationid [(tracker-1)*5 + station-1]; count/trigger", 10, -0.5, 9.5, 4, -0.5, 3.5)
-    sp_triplet_hist.SetStats(False)
+    multiplicity = MultiplicityAnalyzer(max_count=3)
 
     anayzed_triggers = 0
+    max_spills = 0  # 0 Will run over all data
 
     for i in range(tree.GetEntries()):
-        if i > 5000:
-           continue
+        if max_spills > 0 and i > max_spills:
+            break
         print "Spill", i
         tree.GetEntry(i)
         spill = data.GetSpill()
@@ -71,16 +74,10 @@ def main():
             # =================================================================================================
             # Store the raw daq data to a histogram for plotting
             # =================================================================================================
-            daq_event = spill.GetDAQData()
-            for j, tracker_daq in enumerate(daq_event.GetTracker0DaqArray()):
-                for k, vlsb in enumerate(tracker_daq.GetVLSBArray()):
-                    peds_both_hist.Fill(128*vlsb.GetBankID() + vlsb.GetChannel(), vlsb.GetADC())
-
-            for j, tracker_daq in enumerate(daq_event.GetTracker1DaqArray()):
-                for k, vlsb in enumerate(tracker_daq.GetVLSBArray()):
-                    peds_both_hist.Fill(128*vlsb.GetBankID() + vlsb.GetChannel(), vlsb.GetADC())
+            pedestals.fill_spill(spill)
 
             
+            selected_events = []
             for j, recon_event in enumerate(spill.GetReconEvents()):
 
                 # =================================================================================================
@@ -122,44 +119,9 @@ def main():
 
                 anayzed_triggers += 1
 
-                # =================================================================================================
-                # Check Cluster Finding Sanity:
-                # =================================================================================================
-                
-                # Count number of entries in each spill: 
-                cluster_singles, cluster_doubles = [0]*30, [0]*30
-                for cluster in recon_event.GetSciFiEvent().clusters():
-                    plane_id = 15*cluster.get_tracker() + 3*(cluster.get_station()-1) + cluster.get_plane()
-                    if  cluster.get_digits().GetEntries() == 1:
-                        cluster_singles[plane_id] += 1
-                    else:
-                        cluster_doubles[plane_id] += 1
-                # After counting, fill:
-                for plane_id in range(30):
-                    clusters_single_hist.Fill(plane_id, cluster_singles[plane_id])
-                    clusters_double_hist.Fill(plane_id, cluster_doubles[plane_id])
-                
-        
-                # =================================================================================================
-                # Spacepoint Finding Sanity:
-                # =================================================================================================
-                duplets, triplets = [0]*10, [0]*10
-
-                for spacepoint in recon_event.GetSciFiEvent().spacepoints():
-                    station_id = 5*spacepoint.get_tracker() + spacepoint.get_station()-1
-                    #print spacepoint.get_type()
-                    if spacepoint.get_type() == "triplet":
-                        triplets[station_id] += 1
-                        print "T"
-                    else:
-                        duplets[station_id] += 1
-                
-                #print ([duplets, triplets])
-                for station_id in range(10):
-                    sp_duplets_hist.Fill(station_id, duplets[station_id])
-                    sp_triplet_hist.Fill(station_id, triplets[station_id])
+                # Cluster and spacepoint multiplicities are counted per spill:
+                selected_events.append(recon_event)
 
-            
                 #print "    event", j
                 # if j != 6:
                 #    continue
@@ -181,6 +143,8 @@ def main():
                         n_clusters_tkd_good_hist.Fill(space_point.get_station(),
                                                   space_point.get_channels_pointers().size())
 
+            multiplicity.fill(selected_events)
+
     print "Analysed %i triggers"%anayzed_triggers
 
     n_clusters_tku_canvas = xboa.common.make_root_canvas("n_clusters_tku")
@@ -202,6 +166,17 @@ def main():
     n_clusters_tkd_good_canvas.Print("n_clusters_5point_tkd.png")
 
 
+    # Refresh the calibration from the raw data, flagging the channels
+    # which drifted from the reference calibration:
+    calibration = StreamingCalibration(pedestals,
+                                       reference=lookup.calibration)
+    drifted = calibration.write_json("scifi_calibration_raw.json")
+    for uid in drifted:
+        print "Drifted channelUID %i: pedestal %.2f, gain %.2f" % \
+            (uid, calibration.adc_pedestal[uid], calibration.adc_gain[uid])
+
+    peds_both_hist = pedestals.ToTH2D()
+    peds_both_hist.SetStats(False)
     peds_both_canvas = xboa.common.make_root_canvas("peds_both_canvas")
     peds_both_canvas.cd()
     peds_both_hist.Draw("COL")
@@ -209,6 +184,12 @@ def main():
 
     ROOT.gStyle.SetPaintTextFormat("1.2f")
 
+    multiplicity_hists = multiplicity.getTObjects()
+    clusters_single_hist = multiplicity_hists["clusters_singles"]
+    clusters_double_hist = multiplicity_hists["clusters_double"]
+    sp_duplets_hist = multiplicity_hists["sp_duplets"]
+    sp_triplet_hist = multiplicity_hists["sp_triplets"]
+
     clusters_single_canvas = xboa.common.make_root_canvas("clusters_single_canvas")
     clusters_single_canvas.cd()
     clusters_single_hist.Scale(1.0/anayzed_triggers)
@@ -9,12 +9,15 @@ import ROOT
 import libMausCpp  # pylint: disable = W0611
 from TOFTools import TOF12CoincidenceTime, TOF1SingleHit, TOF01Times, TOF01CoincidenceTime
 from SciFiTools import UnsaturatedCluster
-from PlotSciFiEvent import PlotSciFiEvent
+from EventGallery import EventGallery
+from SpillSkim import SpillSkim
 from ROOTTools import CombinedNorm
 import math
 
 max_spills = 2000  # 0 Will run over all data
 plot_bad_events = True
+plot_workers = 4  # Processes used to render the bad events
+skim_file = "ds_missing_skim.root"  # None will not skim the bad events
 
 #for MC
 #inpath = "/home/ed/MICE/data/efficiency_investigation/mc"
@@ -27,6 +30,10 @@ infiles = ["/home/ed/MICE/data/cooling/08681_recon.root"] # bad 140mev data
 #infiles = ["/home/ed/MICE/data/08672_recon.root"] # good 240mev data
 #infiles = ['/home/ed/MICE/data/efficiency_investigation/high_sz_2_6_0.root']
 
+#from the run catalog, by optics tag
+#from RunCatalog import RunCatalog
+#infiles = RunCatalog("run_catalog.db").query(optics="...", min_run_time=900)
+
 # Load data for processing:
 print "Setting up ROOT TChain"
 chain = ROOT.TChain("Spill")
@@ -65,6 +72,8 @@ trip_duplet_ds = [0,0]
 
 # find awesome events
 aswesome_events = []
+gallery = EventGallery("ds_missing")
+skim = SpillSkim(skim_file)
 
 
 # Begin the processing
@@ -146,11 +155,9 @@ for i in range(chain.GetEntries()):
                 print " AWE",
                 aswesome_events.append(spill.GetSpillNumber()*1000+j)
                 if plot_bad_events == True:
-                    event = PlotSciFiEvent()
-                    event.fill(recon_event.GetSciFiEvent())
-                    event.draw()
-                    event.c.SaveAs("ds_missing/%04i_%i.png"% (spill.GetSpillNumber(), j))
-                    #raw_input ("press enter to continue")
+                    gallery.add(i, spill.GetSpillNumber(), j)
+                if skim_file is not None:
+                    skim.add_chain_entry(chain, j)
 
             if us_track:
                 TH1D_unusedsptk_US.Fill(us_unused)
@@ -181,6 +188,11 @@ for i in range(chain.GetEntries()):
 
         print ""
 
+if plot_bad_events == True:
+    print "Gallery index:", gallery.render(infiles, plot_workers)
+
+if skim_file is not None:
+    skim.write()
 
 c = ROOT.TCanvas("c1", "c1", 800, 600)
 c.Divide(2,1)